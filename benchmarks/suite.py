@@ -0,0 +1,380 @@
+"""reproducible benchmarks of the scheduler, the price conversion, the load curves, the serialization and the API
+
+All cases run on synthetic fleets, demand and prices drawn from a fixed seed, for each combination of fleet size,
+horizon and resolution of the simulation. The results are written as JSON, a previous result file can be passed
+to compare the runtimes of two runs.
+
+Run with:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --cases optimize,api --fleet-sizes 10,100,1000,10000 --compare results.json
+"""
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterator, List, Optional
+
+import click
+import numpy as np
+
+import drone.config as config
+from drone.headless import arrivals_from_demand, run_headless
+from drone.simulation import Simulation, convert_price_profile
+
+# midnight local time, so schedule and price profile are aligned
+START_TIME = datetime(2023, 1, 1).timestamp()
+PROFILE_RESOLUTIONS = [1, 15, 60, 900, 3600]  # resolutions of the converted price profiles in seconds
+BATTERIES_PER_CHARGER = 10
+API_ENDPOINTS = [
+    ('GET', '/batteries'),
+    ('GET', '/schedules'),
+    ('GET', '/visualisation'),
+    ('GET', '/visualisation/compact'),
+    ('PUT', '/price-profile'),
+]
+
+
+@contextmanager
+def simulation_config(horizon_h: int, resolution: int):
+    """
+    Sets the horizon in hours and the resolution in seconds of the simulations created within the context.
+    """
+    if horizon_h % 24 or (horizon_h * 3600) % resolution:
+        raise ValueError(f'horizon of {horizon_h}h is no multiple of a day or of the resolution of {resolution}s')
+    previous = config.slot_count, config.resolution
+    config.slot_count, config.resolution = horizon_h * 3600 // resolution, resolution
+    try:
+        yield
+    finally:
+        config.slot_count, config.resolution = previous
+
+
+def synthetic_price_profile(rng: np.random.Generator, resolution_s: int = 3600, days: int = 2) -> SimpleNamespace:
+    """
+    Prices in EUR/MWh with a daily cycle, cheapest at night.
+    """
+    hours = np.arange(days * 86400 // resolution_s) * resolution_s / 3600
+    prices = 80 + 40 * np.sin(2 * np.pi * (hours - 8) / 24) + rng.normal(0, 10, len(hours))
+    return SimpleNamespace(price=prices.tolist(), resolution_s=resolution_s)
+
+
+def synthetic_demand(rng: np.random.Generator, events: int = 24) -> SimpleNamespace:
+    """
+    Battery exchanges in seconds after midnight during the day.
+    """
+    return SimpleNamespace(demand=np.sort(rng.integers(6 * 3600, 22 * 3600, events)).tolist())
+
+
+def synthetic_batteries(rng: np.random.Generator, size: int) -> List[SimpleNamespace]:
+    return [SimpleNamespace(state_of_charge=float(soc), capacity_kwh=2, max_power_watt=int(max_power))
+            for soc, max_power in zip(rng.uniform(0.7, 1.0, size), rng.choice([2000, 3000, 4000], size))]
+
+
+def chargers_for(fleet_size: int) -> int:
+    return max(1, fleet_size // BATTERIES_PER_CHARGER)
+
+
+def populate(simulation: Simulation, fleet_size: int, seed: int = 0) -> Simulation:
+    """
+    Restarts the simulation at midnight with a synthetic fleet, demand and price profile.
+    """
+    rng = np.random.default_rng(seed)
+    simulation.restart(START_TIME)
+    simulation.set_demand(synthetic_demand(rng))
+    simulation.set_price_profile(synthetic_price_profile(rng))
+    simulation.create_batteries(synthetic_batteries(rng, fleet_size))
+    return simulation
+
+
+def synthetic_simulation(fleet_size: int, scheduler: str = config.scheduler, seed: int = 0) -> Simulation:
+    return populate(Simulation(charger_count=chargers_for(fleet_size), scheduler=scheduler), fleet_size, seed)
+
+
+def measure(function: Callable, repetitions: int, setup: Optional[Callable] = None) -> Dict[str, float]:
+    """
+    Runs the function repeatedly, setup runs before each repetition and is not measured.
+    Returns runtime statistics in seconds and the result of the last run.
+    """
+    runtimes = []
+    result = None
+    for _ in range(repetitions):
+        if setup is not None:
+            setup()
+        tik = perf_counter()
+        result = function()
+        runtimes.append(perf_counter() - tik)
+    return {
+        'median_s': float(np.median(runtimes)),
+        'min_s': float(np.min(runtimes)),
+        'mean_s': float(np.mean(runtimes)),
+        'repetitions': repetitions,
+        'result': result
+    }
+
+
+def record(case: str, params: dict, runtime: dict, **extra) -> dict:
+    runtime = {key: value for key, value in runtime.items() if key != 'result'}
+    return {'case': case, 'params': params, **runtime, **extra}
+
+
+def bench_price_profile(options: SimpleNamespace) -> List[dict]:
+    rng = np.random.default_rng(options.seed)
+    records = []
+    for resolution_s in PROFILE_RESOLUTIONS:
+        profile = synthetic_price_profile(rng, resolution_s, options.horizon_h // 24)
+        runtime = measure(lambda: convert_price_profile(profile), options.repetitions * 10)
+        records.append(record('price_profile', {'profile_resolution_s': resolution_s}, runtime,
+                              values=len(profile.price)))
+    return records
+
+
+def bench_update_schedule(options: SimpleNamespace) -> List[dict]:
+    records = []
+    for fleet_size in options.fleet_sizes:
+        simulation = synthetic_simulation(fleet_size, seed=options.seed)
+        demand_array = simulation.demand_model.demand_array(0, simulation.total_batteries())
+        demand_array = demand_array - len(simulation.finished_batteries)
+        waiting, charging, finished = (simulation.waiting_batteries, simulation.charging_batteries,
+                                       simulation.finished_batteries)
+        runtime = measure(lambda: simulation.schedule.update_schedule(
+            list(waiting), charging, finished, demand_array, simulation.constraints.copy()), options.repetitions)
+        records.append(record('update_schedule', {'fleet_size': fleet_size}, runtime,
+                              chargers=simulation.charger_count, feasible=bool(runtime['result'])))
+        simulation.close()
+    return records
+
+
+def bench_optimize(options: SimpleNamespace) -> List[dict]:
+    records = []
+    for fleet_size in options.fleet_sizes:
+        for scheduler in options.schedulers:
+            # the optimal scheduler does not take a time budget
+            for time_budget in options.time_budgets if scheduler == 'greedy' else [max(options.time_budgets)]:
+                simulations = []
+
+                def setup():
+                    simulations.append(synthetic_simulation(fleet_size, scheduler, options.seed))
+
+                runtime = measure(lambda: simulations[-1].create_optimized_schedule(START_TIME, time_budget),
+                                  options.repetitions, setup)
+                simulation = simulations[-1]
+                batteries = simulation.charging_batteries + simulation.waiting_batteries
+                load_curve = simulation.schedule.get_load_curve(batteries, optimized=True)
+                records.append(record('optimize',
+                                      {'fleet_size': fleet_size, 'scheduler': scheduler, 'time_budget_s': time_budget},
+                                      runtime, chargers=simulation.charger_count,
+                                      feasible=bool(runtime['result']),
+                                      cost_eur=float(np.sum(simulation.get_cost_curve(load_curve)))))
+                for simulation in simulations:
+                    simulation.close()
+    return records
+
+
+def bench_load_curve(options: SimpleNamespace) -> List[dict]:
+    records = []
+    for fleet_size in options.fleet_sizes:
+        simulation = synthetic_simulation(fleet_size, seed=options.seed)
+        simulation.create_optimized_schedule(START_TIME, min(options.time_budgets))
+        schedule = simulation.schedule
+        batteries = simulation.charging_batteries + simulation.waiting_batteries
+        schedule.make_unoptimized_schedule(simulation.waiting_batteries, simulation.charging_batteries,
+                                           simulation.finished_batteries)
+        for optimized in [True, False]:
+            # the load curves are cached per schedule version, the cache is cleared to measure the calculation
+            runtime = measure(lambda: schedule.get_load_curve(batteries, optimized), options.repetitions,
+                              setup=schedule.load_curves.clear)
+            records.append(record('load_curve', {'fleet_size': fleet_size, 'optimized': optimized}, runtime))
+        simulation.close()
+    return records
+
+
+def bench_batteries(options: SimpleNamespace) -> List[dict]:
+    records = []
+    for fleet_size in options.fleet_sizes:
+        simulation = synthetic_simulation(fleet_size, seed=options.seed)
+        runtime = measure(lambda: json.dumps(simulation.serialize_batteries()), options.repetitions)
+        records.append(record('batteries', {'fleet_size': fleet_size}, runtime, bytes=len(runtime['result'])))
+        simulation.close()
+    return records
+
+
+async def request_rate(client, method: str, path: str, requests: int, concurrency: int, body=None) -> dict:
+    latencies = []
+    sizes = []
+
+    async def worker(count: int):
+        for _ in range(count):
+            tik = perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(perf_counter() - tik)
+            response.raise_for_status()
+            sizes.append(len(response.content))
+
+    tik = perf_counter()
+    await asyncio.gather(*[worker(requests // concurrency + (i < requests % concurrency))
+                           for i in range(concurrency)])
+    runtime = perf_counter() - tik
+    return {
+        'requests_per_s': requests / runtime,
+        'p50_s': float(np.percentile(latencies, 50)),
+        'p99_s': float(np.percentile(latencies, 99)),
+        'bytes': int(np.mean(sizes))
+    }
+
+
+def bench_api(options: SimpleNamespace) -> List[dict]:
+    from httpx import AsyncClient
+
+    from drone import api
+
+    records = []
+    for fleet_size in options.fleet_sizes:
+        # the service planned once, the simulation loop is not running so the requests only compete with each other
+        api.simulation.charger_count = chargers_for(fleet_size)
+        populate(api.simulation, fleet_size, options.seed)
+        api.simulation.replan(min(options.time_budgets))
+        body = vars(synthetic_price_profile(np.random.default_rng(options.seed)))
+
+        async def run():
+            results = []
+            async with AsyncClient(app=api.app, base_url='http://localhost:8000') as client:
+                for method, path in API_ENDPOINTS:
+                    results.append(await request_rate(client, method, path, options.requests, options.concurrency,
+                                                      body if method != 'GET' else None))
+            return results
+
+        for (method, path), result in zip(API_ENDPOINTS, asyncio.run(run())):
+            records.append(record('api', {'fleet_size': fleet_size, 'endpoint': f'{method} {path}',
+                                          'concurrency': options.concurrency}, {}, **result))
+    return records
+
+
+def bench_headless(options: SimpleNamespace) -> List[dict]:
+    records = []
+    for fleet_size in options.fleet_sizes:
+        for days in [1, 7]:
+            simulation = synthetic_simulation(fleet_size, seed=options.seed)
+            simulation.set_demand(SimpleNamespace(demand=[hour * 3600 for hour in range(24)]))
+            arrivals = arrivals_from_demand(simulation.demand_model.events.tolist(), days, start_time=START_TIME)
+            for arrival in arrivals:
+                arrival.max_power_watt = 2000
+            result = run_headless(simulation, days * 86400, arrivals, min(options.time_budgets))
+            records.append(record('headless', {'fleet_size': fleet_size, 'days': days},
+                                  {'median_s': result.runtime_s, 'repetitions': 1},
+                                  speedup=days * 86400 / result.runtime_s, served=result.served,
+                                  declined=result.declined, events=result.events, cost_eur=result.cost_eur))
+            simulation.close()
+    return records
+
+
+CASES = {
+    'price_profile': bench_price_profile,
+    'update_schedule': bench_update_schedule,
+    'optimize': bench_optimize,
+    'load_curve': bench_load_curve,
+    'batteries': bench_batteries,
+    'api': bench_api,
+    'headless': bench_headless,
+}
+
+
+def result_key(result: dict) -> str:
+    return json.dumps([result['case'], result['params']], sort_keys=True)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor()
+    }
+
+
+def format_result(result: dict, baseline: Optional[dict] = None) -> str:
+    params = ' '.join(f'{name}={value}' for name, value in result['params'].items())
+    if 'requests_per_s' in result:
+        line = f"{result['case']:>15} {params:<70} {result['requests_per_s']:>10.1f}/s p99 {result['p99_s'] * 1000:.2f}ms"
+        if baseline is not None:
+            line += f" ({result['requests_per_s'] / baseline['requests_per_s']:.2f}x of baseline)"
+    else:
+        line = f"{result['case']:>15} {params:<70} {result['median_s'] * 1000:>10.3f}ms"
+        if baseline is not None:
+            line += f" ({result['median_s'] / baseline['median_s']:.2f}x of baseline)"
+    return line
+
+
+def run_suite(cases: List[str], horizons: List[int], resolutions: List[int], **options) -> Iterator[dict]:
+    """
+    Runs the cases for each horizon in hours and resolution in seconds and yields the results as they are measured.
+    options - fleet_sizes, schedulers, time_budgets, repetitions, requests, concurrency and seed
+    """
+    for horizon_h in horizons:
+        for resolution in resolutions:
+            with simulation_config(horizon_h, resolution):
+                for case in cases:
+                    for result in CASES[case](SimpleNamespace(horizon_h=horizon_h, **options)):
+                        result['params'] = {'horizon_h': horizon_h, 'resolution_s': resolution, **result['params']}
+                        yield result
+
+
+def integers(value: str) -> List[int]:
+    return [int(item) for item in value.split(',') if item]
+
+
+@click.command()
+@click.option('--cases', default=','.join(CASES), help='Comma separated cases to run.')
+@click.option('--fleet-sizes', default='10,100,1000', help='Comma separated numbers of batteries.')
+@click.option('--horizons', default=str(config.slot_count * config.resolution // 3600),
+              help='Comma separated horizons of the simulation in hours, multiples of a day.')
+@click.option('--resolutions', default=str(config.resolution), help='Comma separated resolutions in seconds.')
+@click.option('--schedulers', default='greedy,optimal', help='Comma separated schedulers of the optimize case.')
+@click.option('--time-budgets', default='0.1,1.0', help='Comma separated time budgets of the optimizer in seconds.')
+@click.option('--repetitions', default=5, help='Repetitions of each measurement.')
+@click.option('--requests', default=200, help='Requests per endpoint of the api case.')
+@click.option('--concurrency', default=8, help='Concurrent clients of the api case.')
+@click.option('--seed', default=0, help='Seed of the synthetic fleets, demand and prices.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Writes the results as JSON.')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), help='Results of a previous run.')
+def main(cases, fleet_sizes, horizons, resolutions, schedulers, time_budgets, repetitions, requests, concurrency,
+         seed, output, compare):
+    logging.disable(logging.WARNING)
+    cases = [case for case in cases.split(',') if case]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise click.BadParameter(f"unknown cases {', '.join(sorted(unknown))}", param_hint='--cases')
+    baseline = {}
+    if compare:
+        baseline = {result_key(result): result for result in json.loads(Path(compare).read_text())['results']}
+
+    parameters = dict(fleet_sizes=integers(fleet_sizes),
+                      schedulers=[scheduler for scheduler in schedulers.split(',') if scheduler],
+                      time_budgets=[float(budget) for budget in time_budgets.split(',') if budget],
+                      repetitions=repetitions, requests=requests, concurrency=concurrency, seed=seed)
+    results = []
+    for result in run_suite(cases, integers(horizons), integers(resolutions), **parameters):
+        results.append(result)
+        click.echo(format_result(result, baseline.get(result_key(result))))
+
+    if output:
+        parameters.update(cases=cases, horizons=integers(horizons), resolutions=integers(resolutions))
+        Path(output).write_text(json.dumps({'environment': environment(), 'parameters': parameters,
+                                            'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
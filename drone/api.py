@@ -1,23 +1,74 @@
-from datetime import timedelta, datetime
+import asyncio
+from time import perf_counter
+from contextlib import asynccontextmanager
 
 from drone.simulation import convert_price_profile
 import logging
-import copy
 from typing import List, Optional
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from drone.models import (Battery, ChargeRequest, DemandEstimation, ExchangeCompleted, ExchangeRequest,
+                          ExchangeTest, PowerLimit, PriceProfile, SimulationConfig)
 import drone.config as config
-from threading import Thread
+from drone.broadcast import SnapshotBroadcaster
+from drone.persistence import StateStore
 from drone.simulation import Simulation
-import numpy as np
+from drone import stations
 
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI()
 simulation = Simulation()
-thread = Thread(target=simulation.start)
-thread.start()
+broadcaster = SnapshotBroadcaster(simulation)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    store = None
+    if config.state_dir is not None:
+        # the state of the last run is restored, changes are logged from now on
+        store = StateStore(config.state_dir)
+        store.restore(simulation)
+    # the simulation runs as long as the service, handlers only read snapshots and apply short changes
+    broadcaster.start()
+    task = asyncio.create_task(simulation.run())
+    yield
+    broadcaster.stop()
+    simulation.stop()
+    await task
+    if store is not None:
+        store.save(simulation)
+        store.close()
+        simulation.store = None
+    simulation.close()
+
+
+class LatencyMiddleware:
+    """
+    Records the time from receiving a request until the response starts, per handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        tik = perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                endpoint = scope.get('endpoint')
+                simulation.metrics.api_request_seconds.observe(
+                    perf_counter() - tik, handler=endpoint.__name__ if endpoint else 'unknown')
+            await send(message)
+
+        await self.app(scope, receive, timed_send)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(LatencyMiddleware)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -33,19 +84,8 @@ app.add_middleware(
             description="""
     This endpoint is used to remove all batteries.
     """)
-def remove_batteries():
-    simulation.clear_batteries()
-    return {
-        "success": True,
-        "message": f"all batteries removed successfully"
-    }
-
-
-class Battery(BaseModel):
-    battery_id: str = Field(example="battery1")
-    state_of_charge: float = Field(example=0.9)
-    capacity_kwh: float = Field(example=2)
-    max_power_watt: float = Field(example=2000)
+async def remove_batteries():
+    return await run_in_threadpool(stations.remove_batteries, simulation, None)
 
 
 @app.post("/battery",
@@ -54,22 +94,18 @@ class Battery(BaseModel):
     This endpoint is used by the simulation to add a battery to the optimization process.
     All batteries should be added at startup.
     """)
-def add_battery(battery: Battery):
-    battery = simulation.create_battery(battery)
-    return {
-        "success": True,
-        "message": f"battery {battery.id} added"
-    }
+async def add_battery(battery: Battery):
+    return await run_in_threadpool(stations.add_battery, simulation, battery.dict())
 
 
-class ChargeRequest(BaseModel):
-    drone_id: str = Field(example="drone123")
-    state_of_charge: float = Field(
-        example=0.75, description="Anticipated state of charge.")
-    capacity_kwh: float = Field(example=1.5)
-    max_power_watt: float = Field(example=1500)
-    delta_eta_seconds: int = Field(
-        example=60*10, description="Time in seconds until estimated time of arrival.")
+@app.post("/batteries",
+          summary="Add batteries",
+          description="""
+    This endpoint is used to add many batteries at once, e.g. when a station is set up.
+    All batteries are added together and the schedule is optimized once.
+    """)
+async def add_batteries(batteries: List[Battery]):
+    return await run_in_threadpool(stations.add_batteries, simulation, [battery.dict() for battery in batteries])
 
 
 @app.post("/charge-request",
@@ -78,21 +114,19 @@ class ChargeRequest(BaseModel):
     This endpoint is used by a drone to request a battery at a charging station shortly before arrival.
     Only currently available batteries are taken into consideration.
     """)
-def charge_request(charge_request: ChargeRequest):
-    success = simulation.check_request(charge_request)
-    if success:
-        success = simulation.add_request(charge_request)
-    return {
-        "success": success,
-        "message": f"charging request {'accepted' if success else 'declined'}"
-    }
+async def charge_request(charge_request: ChargeRequest):
+    return await run_in_threadpool(stations.charge_request, simulation, charge_request.dict())
 
 
-class ExchangeRequest(BaseModel):
-    drone_id: str = Field(example="drone123")
-    state_of_charge: float = Field(
-        example=0.5, description="Actual state of charge of the battery.")
-    response_uri: Optional[str] = Field(example="http://localhost:8000/exchange-test")
+@app.post("/charge-requests",
+          summary="Requests for charging",
+          description="""
+    This endpoint is used to submit many charge requests at once, which are accepted in the given order
+    while charged batteries are available. All requests are applied together and the schedule is optimized once.
+    """)
+async def charge_requests(charge_requests: List[ChargeRequest]):
+    return await run_in_threadpool(stations.charge_requests, simulation,
+                                   [request.dict() for request in charge_requests])
 
 
 @app.put("/exchange",
@@ -102,16 +136,19 @@ class ExchangeRequest(BaseModel):
     It takes in the ID of the drone and the actual state of charge of its current battery.
     Once the battery exchange is finished, a confirmation is sent to the response URI.
     """)
-def exchange_battery(exchange_request: ExchangeRequest):
-    battery = simulation.exchange_battery(exchange_request)
-    return {
-        "success": True,
-        "message": "battery exchange in progress"
-    }
+async def exchange_battery(exchange_request: ExchangeRequest):
+    return await run_in_threadpool(stations.exchange_battery, simulation, exchange_request.dict())
 
 
-class ExchangeCompleted(BaseModel):
-    drone_id: str = Field(example="drone123")
+@app.put("/exchanges",
+         summary="Battery exchanges",
+         description="""
+    This endpoint is used to execute the battery exchanges of many landed drones at once.
+    An exchange fails if the drone has no accepted charging request.
+    """)
+async def exchange_batteries(exchange_requests: List[ExchangeRequest]):
+    return await run_in_threadpool(stations.exchange_batteries, simulation,
+                                   [request.dict() for request in exchange_requests])
 
 
 @app.put("/exchange-completed",
@@ -120,36 +157,39 @@ class ExchangeCompleted(BaseModel):
     This endpoint is used to indicate that a drone's battery has been exchanged successfully.
     It takes in the ID of the drone.
     """)
-def exchange_completed(exchange_completed: ExchangeCompleted):
-    success = simulation.exchange_completed(exchange_completed.drone_id)
-    return {
-        "success": success,
-        "message": "battery exchange completed"
-    }
+async def exchange_completed(exchange_completed: ExchangeCompleted):
+    return await run_in_threadpool(stations.exchange_completed, simulation, exchange_completed.dict())
+
+
+@app.put("/exchanges-completed",
+         summary="Battery exchanges completed",
+         description="""
+    This endpoint is used to indicate that the batteries of many drones have been exchanged successfully.
+    All batteries are added together and the schedule is optimized once.
+    """)
+async def exchanges_completed(exchanges: List[ExchangeCompleted]):
+    return await run_in_threadpool(stations.exchanges_completed, simulation,
+                                   [exchange.dict() for exchange in exchanges])
 
 
-class ExchangeTest(BaseModel):
-    success: bool = Field(example=True)
-    drone_id: str = Field(example="drone123")
-    soc: float = Field(example=1, description="State of charge of the battery.")
-    capacity: float = Field(example=2, description="Capacity of the battery in kWh.")
-    max_power: float = Field(example=2000, description="Maximum power of the battery in W.")
-    message: str = Field(example="battery exchange completed")
+@app.get("/exchange-notifications",
+         summary="Exchange notification metrics",
+         description="""
+    This endpoint returns delivery metrics of the confirmations sent to the response URIs of battery exchanges,
+    namely pending, delivered, failed and retried notifications and the delivery latency (in s).
+    """)
+async def exchange_notifications():
+    return stations.get_exchange_notifications(simulation, None)
 
 
 @app.post("/exchange-test",
           summary="Receive message about successful battery exchange",
           description="This endpoint is a test to receive message about successful battery exchange")
-def exchange_test(message: ExchangeTest):
+async def exchange_test(message: ExchangeTest):
     exchange_instance = ExchangeTest(**message.dict())
     print(repr(exchange_instance))
 
 
-class DemandEstimation(BaseModel):
-    demand: List[int] = Field(example=[i*60*60 for i in range(24)],
-                              description="List representing battery demand events in seconds after midnight.")
-
-
 @app.put("/demand-estimation",
          summary="Demand estimation",
          description="""
@@ -157,33 +197,18 @@ class DemandEstimation(BaseModel):
     The demand should be a list of events in seconds when batteries will be exchanged relative to midnight.
     Event time can only be within 24 hours.
     """)
-def demand_estimation(demand_estimation: DemandEstimation):
-    simulation.set_demand(demand_estimation)
-    return {
-        "success": True
-    }
-
-
-class PriceProfile(BaseModel):
-    price: List[float] = Field(example=[
-        25.02, 18.29, 16.04, 14.6, 14.95, 14.5, 10.76, 12.01, 
-        12.39, 14.04, 14.68, 16.08, 16.08, 16.05, 16.04, 16.1,
-        23.93, 26.9, 26.36, 23.98, 16.09, 14.08, 12.44, 0.04
-    ], description="List of prices at various intervals, must be at most 24 hours long.")
-    resolution_s: int = Field(
-        example=3600, description="Resolution of price profile in seconds.")
+async def demand_estimation(demand_estimation: DemandEstimation):
+    return await run_in_threadpool(stations.set_demand, simulation, demand_estimation.dict())
+
 
 @app.put("/price-profile",
          summary="Price profile",
          description="""
     This endpoint is used to send a prognosis of the price profile of the electricity.
     """)
-def update_price_profile(price_profile: PriceProfile):
+async def update_price_profile(price_profile: PriceProfile):
     # TODO: fix, make seconds instead of milliseconds, tell diogo
-    simulation.set_price_profile(price_profile)
-    return {
-        "success": True
-    }
+    return await run_in_threadpool(stations.set_price_profile, simulation, price_profile.dict())
 
 
 @app.get("/price-profile",
@@ -191,12 +216,18 @@ def update_price_profile(price_profile: PriceProfile):
          description="""
     This endpoint is used to get a prognosis of the price profile of the electricity.
     """)
-def get_price_profile():
-    price_profile = [float(price) for price in simulation.get_price_profile()]
-    return {
-        "success": True,
-        "price_profile": price_profile
-    }
+async def get_price_profile():
+    return stations.get_price_profile(simulation, None)
+
+
+@app.put("/power-limit",
+         summary="Power limit",
+         description="""
+    This endpoint is used to set the grid connection limit of the station shared by all chargers.
+    The charging power of concurrently charging batteries is lowered to stay below the limit.
+    """)
+async def update_power_limit(power_limit: PowerLimit):
+    return await run_in_threadpool(stations.set_power_limit, simulation, power_limit.dict())
 
 
 @app.get("/batteries",
@@ -204,12 +235,8 @@ def get_price_profile():
          description="""
     This endpoint returns a list of batteries with their status.
     """)
-def batteries():
-    batteries = simulation.get_batteries()
-    return {
-        "success": True,
-        "batteries": batteries
-    }
+async def batteries():
+    return stations.get_batteries(simulation, None)
 
 
 
@@ -219,27 +246,26 @@ def batteries():
          description="""
     This endpoint returns the current charging schedules.
     """)
-def schedule():
-    schedule = {
-        "resolution_seconds": config.resolution,
-        "schedules": list([[int(e) for e in schedule] for schedule in simulation.get_schedules()])
-    }
-    return {
-        "success": True,
-        "schedules": schedule
-    }
-
-class SimulationConfig(BaseModel):
-    start_time: int = Field(example=0, description="seconds since midnight")
+async def schedule():
+    return stations.get_schedules(simulation, None)
+
+@app.get("/confidence",
+         summary="Confidence of the current schedule",
+         description="""
+    This endpoint returns a Monte Carlo estimate of the current optimized schedule under demand and price uncertainty,
+    namely the probability that no charged battery is available for a drone (stockout), the expected number of
+    missing batteries and the distribution of the charging cost (in EUR).
+    Demand events are sampled around the demand estimation, prices are perturbed by historical price deviations.
+    """)
+async def confidence():
+    return await run_in_threadpool(stations.get_confidence, simulation, None)
+
 
 @app.post("/restart",
           summary="Restart Simulation",
           description="This endpoint restarts the entire simulation")
-def restart(simulation_config: SimulationConfig):
-    simulation.restart(simulation_config.start_time)
-    return {
-        "success": True,
-    }
+async def restart(simulation_config: SimulationConfig):
+    return await run_in_threadpool(stations.restart, simulation, simulation_config.dict())
 
 @app.get("/visualisation",
          summary="All necessary information for visualisation",
@@ -256,52 +282,68 @@ def restart(simulation_config: SimulationConfig):
         <li>pending charge requests</li>
     </ul>
     """)
-def visualisation():
-    current_time = str(timedelta(seconds=simulation.current_time))
-    optimized_schedule = simulation.rest_get_optimized_schedule()
-    unoptimized_schedule = simulation.rest_get_unoptimized_schedule()
-
-
-    batteries = simulation.get_batteries()
-    # demand_events = simulation.demand_event_list
-
-    current_datetime = datetime.fromtimestamp(simulation.current_time)
-    seconds_since_midnight = (current_datetime.hour * 3600) + (
-            current_datetime.minute * 60) + current_datetime.second
-
-    # create entire demand_array
-    demand_list = copy.copy(simulation.demand_event_list)
-
-    days = int(config.slot_count / config.resolution / 24)
-    for i in range(1, days):
-        demand_list += [event + i * 24 * 60 * 60 for event in demand_list]
-
-    # break demand_list at current time, append at the end
-    demand_list = [demand - seconds_since_midnight for demand in simulation.demand_event_list if
-                   demand >= seconds_since_midnight] + \
-                  [demand - seconds_since_midnight + days * 24 * 60 * 60 for demand in simulation.demand_event_list if
-                   demand < seconds_since_midnight]
-
-    curr_time_index = int(seconds_since_midnight / config.resolution)
-    price_profile = np.concatenate([simulation.price_profile[curr_time_index:], simulation.price_profile[:curr_time_index]])
-    price_profile = price_profile.tolist()
-
-    # TODO: update demand_vents
-    battery_prognosis = {
-        "waiting_battery_prognosis": simulation.prognose_waiting_batteries().tolist(),
-        "finished_battery_prognosis": simulation.prognose_finished_batteries().tolist()
-    }
-    pending_requests = simulation.battery_requests
-    pending_exchange_requests = simulation.exchange_requests
-
-    return {
-        "current_time": current_time,
-        "optimized_schedule": optimized_schedule,
-        "unoptimized_schedule": unoptimized_schedule,
-        "price_profile": price_profile,
-        "batteries": batteries,
-        "demand_events": demand_list,
-        "battery_prognosis": battery_prognosis,
-        "pending_charge_requests": pending_requests,
-        "pending_exchange_requests": pending_exchange_requests
-    }
+async def visualisation():
+    return stations.visualisation(simulation, None)
+
+
+@app.get("/visualisation/compact",
+         summary="Compact schedules and curves for visualisation",
+         description="""
+    This endpoint returns the schedules, load curves, cost curves, price profile and battery prognoses of
+    /visualisation in a compact form.
+    <ul>
+        <li>format=json: every section as runs of equal values, {"values": [...], "lengths": [...]},
+        2D sections as {"rows": [...]} of runs per charger</li>
+        <li>format=npz: all sections as compressed numpy archive, readable with numpy.load</li>
+    </ul>
+    Each section has a tag of its content. Sections whose tags are passed as comma separated list in
+    known are left out, as they did not change. The response has an ETag, a request with a matching
+    If-None-Match header is answered with 304 Not Modified.
+    """)
+async def compact_visualisation(format: str = Query("json", regex="^(json|npz)$"),
+                                known: Optional[str] = Query(None, description="tags of known sections"),
+                                if_none_match: Optional[str] = Header(None)):
+    compact = stations.compact_visualisation(simulation, {"format": format, "known": known,
+                                                          "if_none_match": if_none_match})
+    headers = {"ETag": compact["etag"]}
+    if compact["status"] == 304:
+        return Response(status_code=304, headers=headers)
+    media_type = "application/octet-stream" if format == "npz" else "application/json"
+    return Response(compact["body"], media_type=media_type, headers=headers)
+
+
+@app.get("/events",
+         summary="Stream of the simulation state",
+         description="""
+    This endpoint streams the state of the simulation as server-sent events, instead of polling /visualisation.
+    The first event contains the full state ("full": true), every following event only the changes of the
+    next published state, which is published once per time slot and after every replanning.
+    Schedules, curves and prognoses are sections as in /visualisation/compact, sections and battery lists
+    that are not part of an event did not change. A client that cannot keep up receives the full state again.
+    """)
+async def events():
+    queue = broadcaster.subscribe()
+
+    async def stream():
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is None:
+                    break
+                yield frame.event
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/metrics",
+         summary="Metrics in the Prometheus text format",
+         response_class=PlainTextResponse,
+         description="""
+    This endpoint returns metrics of the simulation in the Prometheus text format, namely durations of the ticks
+    and their phases, replannings, progress of the optimizer, feasibility checks, wait and hold times of the
+    simulation lock, latencies of the API handlers and exchange notifications.
+    """)
+async def metrics():
+    return PlainTextResponse(stations.get_metrics(simulation, None), media_type="text/plain; version=0.0.4")
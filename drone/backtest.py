@@ -0,0 +1,158 @@
+"""replays the historical prices day by day through the scheduler
+
+Each day starts at midnight with the same fleet and demand pattern. The optimized and the unoptimized schedule
+are planned for the price profile of the day and the following day, and their costs are compared.
+
+Run with:
+
+    python -m drone.backtest --start 2012-01-01 --end 2022-12-31 --workers 8
+"""
+import json
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from time import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+import click
+import numpy as np
+
+import drone.config as config
+from drone.price_data import PriceHistory
+from drone.simulation import Simulation
+
+
+@dataclass
+class Scenario:
+    # demand events in seconds after midnight
+    demand: List[int] = field(default_factory=lambda: [hour * 3600 for hour in range(8, 18)])
+    batteries: List[float] = field(default_factory=lambda: [0.2] * 10)  # SoC of the batteries at midnight
+    capacity_kwh: float = 2
+    max_power_watt: float = 2000
+    charger_count: int = config.charger_count
+    scheduler: str = config.scheduler
+    time_budget: float = np.inf  # time the greedy optimizer may spend on a day in seconds
+
+
+@dataclass
+class DayResult:
+    day: str
+    feasible: bool
+    optimized_cost: float  # cost of the optimized schedule in EUR
+    unoptimized_cost: float  # cost of charging as soon as possible in EUR
+    runtime_s: float
+
+
+@dataclass
+class BacktestResult:
+    days: int
+    infeasible_days: int
+    optimized_cost: float
+    unoptimized_cost: float
+    savings: float
+    savings_percent: float
+    runtime_s: float
+    day_results: List[DayResult]
+
+
+history: Optional[PriceHistory] = None  # price history of a worker process
+
+
+def init_worker(csv_file_path: Path):
+    global history
+    history = PriceHistory.load(csv_file_path)
+
+
+def backtest_day(day: str, scenario: Scenario, price_history: Optional[PriceHistory] = None) -> DayResult:
+    tik = time()
+    price_history = price_history or history
+    try:
+        prices = price_history.window(day, 48)
+    except ValueError:
+        # the last day of the history is repeated
+        prices = np.tile(price_history.day(day), 2)
+
+    simulation = Simulation(charger_count=scenario.charger_count, scheduler=scenario.scheduler)
+    try:
+        # midnight local time, so schedule and price profile are aligned
+        simulation.current_time = datetime.fromisoformat(day).timestamp()
+        simulation.set_price_profile(SimpleNamespace(price=prices.tolist(), resolution_s=3600))
+        simulation.set_demand(SimpleNamespace(demand=scenario.demand))
+        for soc in scenario.batteries:
+            simulation.create_battery(SimpleNamespace(state_of_charge=soc,
+                                                      capacity_kwh=scenario.capacity_kwh,
+                                                      max_power_watt=scenario.max_power_watt))
+
+        feasible = simulation.create_optimized_schedule(simulation.current_time, scenario.time_budget)
+        schedule = simulation.schedule
+        batteries = simulation.charging_batteries + simulation.waiting_batteries
+        optimized_cost = np.sum(simulation.get_cost_curve(schedule.get_load_curve(batteries, optimized=True)))
+        schedule.make_unoptimized_schedule(simulation.waiting_batteries,
+                                           simulation.charging_batteries,
+                                           simulation.finished_batteries)
+        unoptimized_cost = np.sum(simulation.get_cost_curve(schedule.get_load_curve(batteries, optimized=False)))
+    finally:
+        simulation.close()
+    return DayResult(day, bool(feasible), float(optimized_cost), float(unoptimized_cost), time() - tik)
+
+
+def backtest(start: str, end: str, scenario: Scenario, workers: int = 0,
+             csv_file_path: Path = config.price_data_path) -> BacktestResult:
+    """
+    Backtests all days from start to end (inclusive), on a pool of worker processes if workers > 0.
+    """
+    tik = time()
+    days = [str(day) for day in np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)]
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(csv_file_path,)) as executor:
+            day_results = list(executor.map(partial(backtest_day, scenario=scenario), days,
+                                            chunksize=max(1, len(days) // (workers * 8))))
+    else:
+        price_history = PriceHistory.load(csv_file_path)
+        day_results = [backtest_day(day, scenario, price_history) for day in days]
+
+    optimized_cost = sum(result.optimized_cost for result in day_results)
+    unoptimized_cost = sum(result.unoptimized_cost for result in day_results)
+    return BacktestResult(
+        days=len(day_results),
+        infeasible_days=sum(not result.feasible for result in day_results),
+        optimized_cost=optimized_cost,
+        unoptimized_cost=unoptimized_cost,
+        savings=unoptimized_cost - optimized_cost,
+        savings_percent=100 * (unoptimized_cost - optimized_cost) / unoptimized_cost if unoptimized_cost else 0.0,
+        runtime_s=time() - tik,
+        day_results=day_results
+    )
+
+
+@click.command()
+@click.option('--start', default='2012-01-01', help='First day of the backtest.')
+@click.option('--end', default='2022-12-31', help='Last day of the backtest.')
+@click.option('--workers', default=0, help='Worker processes, 0 to run in this process.')
+@click.option('--batteries', default=10, help='Number of batteries at midnight.')
+@click.option('--soc', default=0.2, help='State of charge of the batteries at midnight.')
+@click.option('--chargers', default=config.charger_count, help='Number of chargers.')
+@click.option('--scheduler', default=config.scheduler, type=click.Choice(['greedy', 'optimal']))
+@click.option('--demand', default=','.join(str(hour * 3600) for hour in range(8, 18)),
+              help='Comma separated demand events in seconds after midnight.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Writes the results of all days as JSON.')
+def main(start, end, workers, batteries, soc, chargers, scheduler, demand, output):
+    scenario = Scenario(demand=[int(event) for event in demand.split(',')],
+                        batteries=[soc] * batteries,
+                        charger_count=chargers,
+                        scheduler=scheduler)
+    result = backtest(start, end, scenario, workers)
+    click.echo(f'days: {result.days}, infeasible: {result.infeasible_days}')
+    click.echo(f'optimized cost: {result.optimized_cost:.2f} EUR, unoptimized cost: {result.unoptimized_cost:.2f} EUR')
+    click.echo(f'savings: {result.savings:.2f} EUR ({result.savings_percent:.1f}%)')
+    click.echo(f'runtime: {result.runtime_s:.1f}s')
+    if output:
+        Path(output).write_text(json.dumps(asdict(result), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,22 @@
+from typing import List, Optional
 import numpy as np
-from math import ceil
 
 import drone.config as config
 
 
 class Battery:
-    def __init__(self, id: int, soc: float, capacity: float, resolution=config.resolution, max_power=config.max_power):
+    def __init__(self, id: int, soc: float, capacity: float, resolution=None, max_power=config.max_power):
         """
         soc - state of charge in ws
+        resolution - length of a time step in seconds, config.resolution by default
         """
         self.soc = soc
         self.capacity = capacity
         self.max_power = max_power
         self.soc_delta_per_timestep = None
-        self.resolution = resolution
+        self.resolution = config.resolution if resolution is None else resolution
         self.id = id
+        self.charger = None  # charger the battery is charged on or planned to be charged on
         # TODO: change once chargers are introduced
         self.actual_power = self.max_power
         self.set_charging_power(self.max_power)
@@ -29,11 +31,12 @@ class Battery:
         self.actual_power = charging_power
         self.soc_delta_per_timestep = charging_power * (self.resolution / 3600) / (self.capacity * 1000)
 
-    def update(self):
+    def update(self, timesteps: float = 1.0):
         """
-        charging_power - update soc once per timestep
+        timesteps - number of time steps the battery is charged with the charging power, may be fractional
+        Returns whether the battery is fully charged.
         """
-        self.soc += self.soc_delta_per_timestep
+        self.soc += self.soc_delta_per_timestep * timesteps
         if self.soc >= 1.0:
             self.soc = 1.0
             return True
@@ -50,20 +53,61 @@ class Battery:
         int: The number of remaining time steps if constraints allow charging within those steps.
              Returns -1 if constraints exceed the available number of time steps.
         """
-        needed_charge = 1 - self.soc  # Calculate the remaining charge
-        minimum_needed_time_steps = ceil(needed_charge / self.soc_delta_per_timestep)  # Calculate remaining time steps
-
-        # Count the number of time steps needed to get the minimum number of unconstrained charging time steps
-        count_false = 0
-        for i, val in enumerate(charging_constraints[0]):
-            if not val:
-                count_false += 1
-            if count_false >= minimum_needed_time_steps:
-                return i + 1  # returning the number of indices including the current one
-
-        return -1  # Return -1 if needed steps are not available
+        return int(finish_indices([self], charging_constraints)[0])
 
     def __str__(self):
         return f"B {self.id}: soc {self.soc*100}%, capacity {self.capacity}kWh, " \
                f"charging power {self.actual_power}W/{self.max_power}W, " \
                f"soc increase per timestep {self.soc_delta_per_timestep}"
+
+
+def needed_timesteps(batteries: List[Battery]) -> np.ndarray:
+    """
+    Calculates the (fractional) number of time steps at full power needed to fully charge each battery.
+    A fully charged battery still needs to be charged for a moment to be swapped to finished.
+    """
+    soc = np.fromiter((battery.soc for battery in batteries), float, len(batteries))
+    soc_delta = np.fromiter((battery.soc_delta_per_timestep for battery in batteries), float, len(batteries))
+    return np.maximum((1 - soc) / soc_delta, 1e-9)
+
+
+def required_timesteps(batteries: List[Battery]) -> np.ndarray:
+    """
+    Calculates the number of unconstrained time steps needed to fully charge each battery.
+    """
+    return np.ceil(needed_timesteps(batteries)).astype(int)
+
+
+def finish_indices(batteries: List[Battery],
+                   charging_constraints: np.ndarray,
+                   power_factor: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Calculates when each battery is fully charged if the batteries are charged one after another.
+
+    Parameters:
+    batteries (List[Battery]): Batteries in charging order.
+    charging_constraints (np.ndarray): An array representing charging constraints.
+    power_factor (Optional[np.ndarray]): Share of the maximum power batteries are charged with in each time step.
+
+    Returns:
+    np.ndarray: The number of time steps until each battery is fully charged (index after its last time step).
+                -1 for batteries that cannot be fully charged within the available time steps.
+    """
+    if power_factor is None:
+        free_slots = np.cumsum(~charging_constraints[0])
+        needed_slots = np.cumsum(required_timesteps(batteries))
+        finish = np.searchsorted(free_slots, needed_slots, side='left') + 1
+        finish[finish > len(free_slots)] = -1
+        return finish
+
+    # with reduced power the rest of a time step is lost once a battery is full, so batteries are resolved in order
+    progress = np.cumsum(~charging_constraints[0] * power_factor)
+    finish = np.full(len(batteries), -1)
+    reached = 0.0
+    for i, needed in enumerate(needed_timesteps(batteries)):
+        index = int(np.searchsorted(progress, reached + needed, side='left'))
+        if index >= len(progress):
+            break
+        finish[i] = index + 1
+        reached = progress[index]
+    return finish
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from typing import Optional, Set
+
+import drone.config as config
+from drone.compact import CompactSnapshot
+from drone.simulation import Simulation
+from drone.snapshot import SimulationSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Frame:
+    version: int
+    data: str  # JSON of the frame
+    event: bytes  # frame as server-sent event
+
+
+def make_frame(compact: CompactSnapshot, snapshot: SimulationSnapshot,
+               previous: Optional[SimulationSnapshot] = None,
+               previous_compact: Optional[CompactSnapshot] = None) -> Frame:
+    """
+    Serializes the changes since the previous snapshot, or the full state without previous snapshot.
+    Sections left out of a frame are unchanged.
+    """
+    known = previous_compact.tags.values() if previous_compact is not None else ()
+    frame = compact.encode(known)
+    frame['full'] = previous is None
+    # the batteries are compared by their fingerprint, so unchanged batteries are not serialized
+    if previous is None or previous.battery_key != snapshot.battery_key:
+        frame['batteries'] = snapshot.batteries
+    for name in ['pending_charge_requests', 'pending_exchange_requests']:
+        value = getattr(snapshot, name)
+        if previous is None or getattr(previous, name) != value:
+            frame[name] = value
+    data = json.dumps(frame)
+    return Frame(compact.version, data, f'id: {compact.version}\ndata: {data}\n\n'.encode())
+
+
+class SnapshotBroadcaster:
+    """
+    Pushes the state of the simulation to all subscribers whenever a snapshot is published.
+
+    Each frame is serialized once and the same bytes are queued for every subscriber, so the cost does
+    not grow with the number of dashboards. A new subscriber starts with the full state, followed by
+    the changes of each snapshot. A subscriber that cannot keep up gets the full state again instead
+    of the frames it missed.
+    """
+
+    def __init__(self, simulation: Simulation, queue_size: int = config.push_queue_size):
+        self.simulation = simulation
+        self.queue_size = queue_size
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.snapshot: Optional[SimulationSnapshot] = None
+        self.compact: Optional[CompactSnapshot] = None
+        self.full_frame: Optional[Frame] = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.simulation.listeners.append(self.notify)
+
+    def stop(self):
+        """
+        Ends the streams of all subscribers.
+        """
+        if self.notify in self.simulation.listeners:
+            self.simulation.listeners.remove(self.notify)
+        for queue in self.subscribers:
+            self.put(queue, None)
+
+    def notify(self, snapshot: SimulationSnapshot):
+        # called on the thread of the simulation
+        self.loop.call_soon_threadsafe(self.publish, snapshot)
+
+    def publish(self, snapshot: SimulationSnapshot):
+        if self.snapshot is not None and snapshot.version <= self.snapshot.version:
+            return
+        compact = CompactSnapshot(snapshot)
+        if self.subscribers:
+            frame = make_frame(compact, snapshot, self.snapshot, self.compact)
+            for queue in self.subscribers:
+                if queue.full():
+                    # the subscriber missed frames, it continues with the full state
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(self.get_full_frame(snapshot, compact))
+                else:
+                    queue.put_nowait(frame)
+        self.snapshot, self.compact = snapshot, compact
+
+    def get_full_frame(self, snapshot: SimulationSnapshot, compact: CompactSnapshot) -> Frame:
+        if self.full_frame is None or self.full_frame.version != compact.version:
+            self.full_frame = make_frame(compact, snapshot)
+        return self.full_frame
+
+    def subscribe(self) -> asyncio.Queue:
+        """
+        Returns a queue of the frames for a new subscriber, None ends the stream.
+        """
+        queue = asyncio.Queue(self.queue_size)
+        if self.snapshot is None:
+            self.publish(self.simulation.snapshot)
+        queue.put_nowait(self.get_full_frame(self.snapshot, self.compact))
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    @staticmethod
+    def put(queue: asyncio.Queue, frame: Optional[Frame]):
+        while queue.full():
+            queue.get_nowait()
+        queue.put_nowait(frame)
@@ -0,0 +1,101 @@
+"""compact encodings of the schedules and curves of a snapshot
+
+Schedules, load curves and prices are piecewise constant over many slots, so they are sent as runs of equal
+values. Each section carries a tag of its content, sections the client already knows are not sent again.
+"""
+import hashlib
+import io
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from drone.snapshot import SimulationSnapshot
+
+
+def run_lengths(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the value and the length of each run of equal values.
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values, np.zeros(0, int)
+    starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+    return values[starts], np.diff(np.append(starts, len(values)))
+
+
+def encode_runs(values: np.ndarray) -> dict:
+    """
+    Encodes a 1D array as runs, a 2D array as runs of each row.
+    """
+    values = np.asarray(values)
+    if values.ndim > 1:
+        return {"rows": [encode_runs(row) for row in values]}
+    run_values, lengths = run_lengths(values)
+    return {"values": run_values.tolist(), "lengths": lengths.tolist()}
+
+
+def decode_runs(runs: dict) -> np.ndarray:
+    if "rows" in runs:
+        return np.array([decode_runs(row) for row in runs["rows"]])
+    return np.repeat(runs["values"], runs["lengths"])
+
+
+def section_tag(name: str, values: np.ndarray) -> str:
+    """
+    Returns a tag of the name and content of a section. The name is part of the tag, so sections with equal
+    content under different names still have different tags.
+    """
+    values = np.ascontiguousarray(values)
+    digest = hashlib.blake2b(str((name, values.dtype, values.shape)).encode(), digest_size=8)
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+class CompactSnapshot:
+    """
+    Compact encodings of the schedules and curves of a snapshot, calculated on first use.
+    """
+
+    def __init__(self, snapshot: SimulationSnapshot):
+        self.version = snapshot.version
+        self.current_time = snapshot.current_time
+        self.sections: Dict[str, np.ndarray] = snapshot.curves
+        self.tags = {name: section_tag(name, values) for name, values in self.sections.items()}
+        # a snapshot is published every tick, the ETag only changes with the time and the content of the sections
+        content = str((self.current_time, sorted(self.tags.items())))
+        self.etag = '"' + hashlib.blake2b(content.encode(), digest_size=8).hexdigest() + '"'
+        self.runs: Dict[str, dict] = {}
+        self.npz = None
+
+    def encode(self, known: Iterable[str] = ()) -> dict:
+        """
+        known - tags of sections the client already has, these sections are left out
+        """
+        known = set(known)
+        sections = {}
+        for name, values in self.sections.items():
+            if self.tags[name] in known:
+                continue
+            if name not in self.runs:
+                self.runs[name] = encode_runs(values)
+            sections[name] = self.runs[name]
+        return {
+            "version": self.version,
+            "current_time": self.current_time,
+            "tags": self.tags,
+            "sections": sections
+        }
+
+    def to_npz(self) -> bytes:
+        """
+        Returns the sections as compressed .npz archive, which is read with numpy.load.
+        """
+        if self.npz is None:
+            buffer = io.BytesIO()
+            np.savez_compressed(buffer, **self.sections)
+            self.npz = buffer.getvalue()
+        return self.npz
+
+
+def parse_known(known: str) -> List[str]:
+    return [tag for tag in known.split(',') if tag] if known else []
@@ -1,34 +1,173 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-import pandas as pd
+from typing import Optional, Tuple
 
+import numpy as np
 
-class CE:
+import drone.config as config
+from drone.price_data import PriceHistory
 
-    def __init__(self):
-        self.price_profile = None
-        self.scheduler = Scheduler()
 
-    def load_price_data(self, csv_file_path: Path):
-        price_data = pd.read_csv(csv_file_path, sep=',', parse_dates=True, index_col='date')
-        price_data = price_data.interpolate(method='linear')  # interpolate NaN values
-        price_data.index = pd.to_datetime(price_data.index, format="%d.%m.%Y %H:%M")
-        price_data = price_data.squeeze(axis=0)
-        self.price_profile = price_data
+def price_deviations(prices: np.ndarray) -> np.ndarray:
+    """
+    Returns the hourly change of the historical prices from one day to the next, which is used as error of
+    the price profile. The changes are ordered in time, starting at midnight.
+    """
+    prices = np.asarray(prices, dtype=float)
+    return prices[24:] - prices[:-24]
 
-    def get_price_data(self):
-        return self.price_profile
 
-    def check_constraints_with_scheduler(self):
-        schedule = self.scheduler.generate_schedule()
+def evaluate_scenarios(rng: np.random.Generator,
+                       samples: int,
+                       supply: np.ndarray,
+                       energy_wh: np.ndarray,
+                       demand_events: np.ndarray,
+                       price_profile: np.ndarray,
+                       deviations: np.ndarray,
+                       hour: int,
+                       demand_jitter_s: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates a schedule for random demand and price scenarios.
 
-    def delete_most_expensive_slot(self, charging_constraint: pd.Series):
-        pass
+    The number of demand events is Poisson distributed around the estimated number, each event is an estimated
+    event shifted by normal noise. The price profile is perturbed by the historical price deviations of a random
+    day, starting at the current hour of day.
 
+    supply - number of finished batteries available in each slot following the schedule
+    energy_wh - energy charged in each slot following the schedule
+    demand_events - estimated demand events in seconds after the current time
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
-    ROOT_DIR = Path().resolve()
-    my_CE = CE()
-    my_CE.get_price_data(csv_file_path = ROOT_DIR / 'data' / 'price_profiles' / 'prices2012-2023.csv')
-    print(my_CE.get_price_profile)
+    Returns the maximum number of missing batteries and the cost in EUR of each scenario.
+    """
+    slots = len(supply)
 
+    shortfall = np.zeros(samples, int)
+    if len(demand_events):
+        counts = rng.poisson(len(demand_events), samples)
+        width = int(counts.max(initial=0))
+        times = demand_events[rng.integers(0, len(demand_events), (samples, width))] + \
+            rng.normal(0, demand_jitter_s, (samples, width))
+        event_slots = np.floor(times / config.resolution).astype(int)
+        valid = (np.arange(width) < counts[:, None]) & (event_slots >= 0) & (event_slots < slots)
+        events = (np.arange(samples)[:, None] * slots + event_slots)[valid]
+        demand = np.cumsum(np.bincount(events, minlength=samples * slots).reshape(samples, slots), axis=1)
+        shortfall = np.maximum(np.max(demand - supply, axis=1), 0)
+
+    # price deviations are hourly, the cost only depends on the energy charged in each hour
+    slots_per_hour = 3600 // config.resolution
+    hours = -(-slots // slots_per_hour)
+    energy_per_hour = np.zeros(hours * slots_per_hour)
+    energy_per_hour[:slots] = energy_wh
+    energy_per_hour = energy_per_hour.reshape(hours, slots_per_hour).sum(axis=1)
+    days = (len(deviations) - hours - hour) // 24
+    starts = rng.integers(0, days, samples) * 24 + hour
+    cost = (float(np.dot(price_profile, energy_wh)) +
+            deviations[starts[:, None] + np.arange(hours)] @ energy_per_hour) / 1000000
+    return shortfall, cost
+
+
+def evaluate_shared(memory_name: str, shape: Tuple[int], seed: np.random.SeedSequence, samples: int,
+                    **inputs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluates scenarios in a worker process, reading the price deviations from shared memory.
+    """
+    memory = SharedMemory(name=memory_name)
+    try:
+        deviations = np.ndarray(shape, float, buffer=memory.buf)
+        result = evaluate_scenarios(np.random.default_rng(seed), samples, deviations=deviations, **inputs)
+        del deviations
+        return result
+    finally:
+        memory.close()
+
+
+class ConfidenceEstimator:
+    """
+    Monte Carlo estimate of the stockout probability and cost distribution of a schedule under demand and
+    price uncertainty.
+
+    Scenarios are evaluated in batches with numpy. With workers, the batches are evaluated by a pool of processes
+    which read the historical price deviations from shared memory, so only the schedule is sent to them.
+    """
+
+    def __init__(self,
+                 deviations: np.ndarray,
+                 samples: int = config.scenario_samples,
+                 demand_jitter_s: float = config.demand_jitter_s,
+                 workers: int = config.scenario_workers,
+                 batch_size: int = config.scenario_batch_size,
+                 seed: Optional[int] = None):
+        self.deviations = np.ascontiguousarray(deviations, dtype=float)
+        self.samples = samples
+        self.demand_jitter_s = demand_jitter_s
+        self.workers = workers
+        self.batch_size = batch_size
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+        self.memory: Optional[SharedMemory] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            self.memory = SharedMemory(create=True, size=max(self.deviations.nbytes, 1))
+            np.ndarray(self.deviations.shape, float, buffer=self.memory.buf)[:] = self.deviations
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+
+    @classmethod
+    def from_csv(cls, csv_file_path: Path = config.price_data_path, **kwargs) -> 'ConfidenceEstimator':
+        return cls(price_deviations(PriceHistory.load(csv_file_path).prices), **kwargs)
+
+    def estimate(self,
+                 supply: np.ndarray,
+                 load_curve: np.ndarray,
+                 demand_events: np.ndarray,
+                 price_profile: np.ndarray,
+                 hour: int) -> dict:
+        """
+        supply - number of finished batteries available in each slot following the schedule
+        load_curve - total load of the station in each slot in W
+        demand_events - estimated demand events in seconds after the current time
+        price_profile - estimated price in each slot in EUR/MWh
+        hour - current hour of day
+        """
+        inputs = {
+            'supply': np.asarray(supply),
+            'energy_wh': np.asarray(load_curve) * (config.resolution / 3600),
+            'demand_events': np.asarray(demand_events, dtype=float),
+            'price_profile': np.asarray(price_profile, dtype=float),
+            'hour': hour,
+            'demand_jitter_s': self.demand_jitter_s,
+        }
+        batches = [min(self.batch_size, self.samples - start) for start in range(0, self.samples, self.batch_size)]
+        seeds = self.seed_sequence.spawn(len(batches))
+        if self.executor is not None:
+            futures = [self.executor.submit(evaluate_shared, self.memory.name, self.deviations.shape, seed, samples,
+                                            **inputs)
+                       for seed, samples in zip(seeds, batches)]
+            results = [future.result() for future in futures]
+        else:
+            results = [evaluate_scenarios(np.random.default_rng(seed), samples, deviations=self.deviations, **inputs)
+                       for seed, samples in zip(seeds, batches)]
+        shortfall = np.concatenate([result[0] for result in results])
+        cost = np.concatenate([result[1] for result in results])
+        return {
+            'samples': self.samples,
+            'stockout_probability': float(np.mean(shortfall > 0)),
+            'expected_shortfall': float(np.mean(shortfall)),
+            'cost_eur': {
+                'mean': float(np.mean(cost)),
+                'std': float(np.std(cost)),
+                'p5': float(np.percentile(cost, 5)),
+                'p50': float(np.percentile(cost, 50)),
+                'p95': float(np.percentile(cost, 95)),
+            }
+        }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
@@ -1,5 +1,32 @@
+from pathlib import Path
+
 
 resolution = 60  # resolution of a timestep in seconds
 max_power = 200  # max power in W
 simulation_time_factor = 60.0
 slot_count = 48*60  # has to be multiple of 24 hours
+scheduler = 'greedy'  # 'greedy' or 'optimal'
+charger_count = 1  # number of chargers per station
+power_limit_iterations = 10  # iterations to settle the charging power below the site power limit
+exchange_response_uri = "https://bexstream-preprod.beyond-vision.pt/api/v1/elevation/batteryExchanged"
+notification_workers = 8  # concurrent deliveries of exchange notifications
+notification_timeout = 5.0  # timeout of a notification request in seconds
+notification_retries = 3  # retries of a failed notification
+notification_backoff = 0.5  # delay before the first retry in seconds, doubled after each retry
+headless_replan_slots = 60  # slots after which the headless simulation replans without any event
+price_data_path = Path(__file__).resolve().parent.parent / 'data' / 'price_profiles' / 'prices2012-2023.csv'
+scenario_samples = 1000  # demand and price scenarios of the confidence estimation
+scenario_batch_size = 250  # scenarios evaluated at once
+scenario_workers = 0  # worker processes evaluating the scenarios, 0 to evaluate in the calling thread
+demand_jitter_s = 15 * 60  # standard deviation of the time of a demand event in seconds
+replan_interval_slots = 60  # slots after which the plan is optimized again without any change
+replan_debounce_s = 0.05  # changes within this time are coalesced into one replanning
+push_queue_size = 8  # frames queued for a subscriber of the state before it gets the full state again
+tick_trace = False  # logs the duration of the phases of each tick as JSON to drone.simulation.trace
+state_dir = None  # directory of the write-ahead log and the snapshots of the state, None keeps the state in memory
+state_snapshot_interval_slots = 15  # slots between snapshots of the state, changes in between are logged
+state_fsync = False  # writes each logged change through to the disk, so it survives a crash of the machine
+station_workers = 0  # worker processes of the service of many stations, 0 for one per CPU core
+station_handler_threads = 4  # requests a station worker handles concurrently
+station_request_timeout = 30.0  # time the service waits for the response of a station worker in seconds
+station_event_interval_s = 0.25  # interval at which the event streams of a station poll for a new state
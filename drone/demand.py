@@ -0,0 +1,62 @@
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+import drone.config as config
+
+DAY_S = 24 * 60 * 60
+
+
+class DemandModel:
+    """
+    Estimated demand of a station as sorted battery exchange events in seconds after midnight.
+
+    The model is immutable, a new demand estimation creates a new model. The demand the scheduler has to meet
+    is derived once per time of day and number of batteries and cached.
+    """
+
+    cache_size = 16
+
+    def __init__(self, events: Iterable[int]):
+        """
+        events - demand events in seconds after midnight, events of a single day are repeated for the next day
+        """
+        events = np.sort(np.fromiter(events, dtype=np.int64))
+        if len(events) and events[-1] < DAY_S:
+            events = np.concatenate([events, events + DAY_S])
+        events.setflags(write=False)
+        self.events = events
+        self.demand_arrays: Dict[Tuple[int, int], np.ndarray] = {}
+
+    @classmethod
+    def daily(cls) -> 'DemandModel':
+        """
+        One battery exchange every hour.
+        """
+        return cls(np.arange(24) * 3600)
+
+    def rotate(self, seconds: int) -> np.ndarray:
+        """
+        Returns the demand events in seconds after the given time of day,
+        events before the time of day are appended at the end of the horizon.
+        """
+        split = np.searchsorted(self.events, seconds, side='left')
+        horizon_days = config.slot_count * config.resolution // DAY_S
+        return np.concatenate([self.events[split:] - seconds, self.events[:split] - seconds + horizon_days * DAY_S])
+
+    def demand_array(self, seconds: int, batteries: int) -> np.ndarray:
+        """
+        Returns the cumulative number of batteries demanded until each slot after the given time of day.
+        At most the given number of batteries can be demanded, as there are no more batteries at the station.
+        """
+        key = (seconds, batteries)
+        demand_array = self.demand_arrays.get(key)
+        if demand_array is None:
+            demand_slots = self.rotate(seconds)[:batteries] // config.resolution
+            demand_slots = demand_slots[(demand_slots >= 0) & (demand_slots < config.slot_count)]
+            demand_array = np.cumsum(np.bincount(demand_slots, minlength=config.slot_count))
+            demand_array.setflags(write=False)
+            if len(self.demand_arrays) >= self.cache_size:
+                self.demand_arrays.clear()
+            self.demand_arrays[key] = demand_array
+        return demand_array
@@ -0,0 +1,129 @@
+from typing import Sequence
+import numpy as np
+
+
+class SlackTree:
+    """
+    Segment tree over the slack of all demanded batteries supporting range add and range minimum in O(log n).
+    """
+
+    def __init__(self, values: Sequence[int]):
+        self.size = 1
+        while self.size < max(len(values), 1):
+            self.size *= 2
+        self.height = self.size.bit_length() - 1
+        self.tree = [np.inf] * (2 * self.size)
+        self.lazy = [0] * self.size
+        for i, value in enumerate(values):
+            self.tree[self.size + i] = value
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def _apply(self, node: int, value):
+        self.tree[node] += value
+        if node < self.size:
+            self.lazy[node] += value
+
+    def _build(self, node: int):
+        while node > 1:
+            node >>= 1
+            self.tree[node] = min(self.tree[2 * node], self.tree[2 * node + 1]) + self.lazy[node]
+
+    def _push(self, node: int):
+        for shift in range(self.height, 0, -1):
+            parent = node >> shift
+            if self.lazy[parent]:
+                self._apply(2 * parent, self.lazy[parent])
+                self._apply(2 * parent + 1, self.lazy[parent])
+                self.lazy[parent] = 0
+
+    def add(self, left: int, right: int, value):
+        """adds value to all entries in [left, right)"""
+        left += self.size
+        right += self.size
+        left0, right0 = left, right
+        while left < right:
+            if left & 1:
+                self._apply(left, value)
+                left += 1
+            if right & 1:
+                right -= 1
+                self._apply(right, value)
+            left >>= 1
+            right >>= 1
+        self._build(left0)
+        self._build(right0 - 1)
+
+    def min(self, left: int, right: int):
+        """returns the minimum of all entries in [left, right)"""
+        left += self.size
+        right += self.size
+        self._push(left)
+        self._push(right - 1)
+        result = np.inf
+        while left < right:
+            if left & 1:
+                result = min(result, self.tree[left])
+                left += 1
+            if right & 1:
+                right -= 1
+                result = min(result, self.tree[right])
+            left >>= 1
+            right >>= 1
+        return result
+
+
+class FeasibilityEngine:
+    """
+    Incremental feasibility check for blocking the charging slots of a single charger.
+
+    Batteries are charged one after another, so the k-th battery is finished once the prefix count of
+    free slots reaches the summed required time steps of the first k batteries. The k-th unit of demand
+    has to be served by the k-th finished battery, which gives every demanded battery a deadline.
+    The engine keeps the slack (free slots before the deadline minus required slots) of every demanded
+    battery. Blocking slot k removes one free slot before every deadline after k, so it keeps the schedule
+    feasible iff the minimum slack of those batteries is at least one.
+    """
+
+    def __init__(self, required_timesteps: Sequence[int], demand: np.ndarray, charging_constraints: np.ndarray):
+        """
+        required_timesteps - unconstrained time steps needed by each battery in charging order
+        demand - cumulative number of batteries that have to be finished at each slot
+        charging_constraints - blocked slots of the charger, updated in place when a slot is blocked
+        """
+        self.charging_constraints = charging_constraints
+        demand = np.maximum.accumulate(np.asarray(demand))
+        demanded = max(int(np.ceil(demand[-1])), 0) if len(demand) else 0
+        # the k-th battery has to be finished before the first slot with a demand of at least k
+        self.deadlines = np.searchsorted(demand, np.arange(1, demanded + 1), side='left')
+        cumulative_required = np.cumsum(np.asarray(required_timesteps, dtype=int))
+
+        self.feasible = demanded <= len(cumulative_required)
+        if not self.feasible:
+            self.slack = SlackTree([])
+            return
+
+        free_slots = np.concatenate([[0], np.cumsum(~charging_constraints)])
+        slack = free_slots[self.deadlines] - cumulative_required[:demanded]
+        self.feasible = bool(np.all(slack >= 0))
+        self.slack = SlackTree(slack.tolist())
+
+    def block(self, slot: int) -> bool:
+        """
+        Blocks the slot if the demand can still be met afterwards.
+
+        Returns:
+        bool: True if the slot is blocked after the call, False if blocking it would break the demand.
+        """
+        if self.charging_constraints[slot]:
+            return True
+        if not self.feasible:
+            return False
+        first = int(np.searchsorted(self.deadlines, slot, side='right'))
+        last = len(self.deadlines)
+        if first < last:
+            if self.slack.min(first, last) < 1:
+                return False
+            self.slack.add(first, last, -1)
+        self.charging_constraints[slot] = True
+        return True
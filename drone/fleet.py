@@ -0,0 +1,261 @@
+from enum import IntEnum
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from drone.battery import Battery
+
+
+class BatteryState(IntEnum):
+    REMOVED = -1
+    WAITING = 0
+    CHARGING = 1
+    FINISHED = 2
+
+
+def column(name: str, dtype):
+    """
+    Property of a battery handle backed by a column of its fleet.
+    """
+    def get(self):
+        return dtype(getattr(self.fleet, name)[self.row])
+
+    def set(self, value):
+        getattr(self.fleet, name)[self.row] = value
+
+    return property(get, set)
+
+
+class FleetBattery(Battery):
+    """
+    Handle of a battery stored in a row of a fleet, usable wherever a Battery is expected.
+    """
+
+    def __init__(self, fleet: 'Fleet', row: int):
+        self.fleet = fleet
+        self.row = row
+
+    id = column('id', int)
+    soc = column('soc', float)
+    capacity = column('capacity', float)
+    max_power = column('max_power', float)
+    actual_power = column('actual_power', float)
+    soc_delta_per_timestep = column('soc_delta', float)
+    resolution = column('resolution', float)
+
+    @property
+    def charger(self) -> Optional[int]:
+        charger = int(self.fleet.charger[self.row])
+        return charger if charger >= 0 else None
+
+    @charger.setter
+    def charger(self, charger: Optional[int]):
+        self.fleet.charger[self.row] = -1 if charger is None else charger
+
+
+class Fleet:
+    """
+    Struct-of-arrays store of the batteries of a station.
+
+    Each battery is a row of numpy columns, so charging, state transitions and serialization are vectorized.
+    Batteries of a state are queued by the order column: waiting batteries in charging order,
+    finished batteries in the order they were finished. Rows of removed batteries are reclaimed by compact.
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = 0  # number of used rows
+        self.sequence = 0  # next queue position
+        self.handles: Dict[int, FleetBattery] = {}  # battery id -> handle
+        self.id = np.zeros(size, int)
+        self.soc = np.zeros(size)
+        self.capacity = np.zeros(size)
+        self.max_power = np.zeros(size)
+        self.actual_power = np.zeros(size)
+        self.soc_delta = np.zeros(size)
+        self.resolution = np.zeros(size)
+        self.charger = np.full(size, -1)
+        self.state = np.full(size, BatteryState.REMOVED, np.int8)
+        self.order = np.zeros(size, int)
+
+    columns = ['id', 'soc', 'capacity', 'max_power', 'actual_power', 'soc_delta', 'resolution', 'charger', 'state',
+               'order']
+
+    def grow(self):
+        size = max(2 * len(self.id), 64)
+        for name in self.columns:
+            values = getattr(self, name)
+            grown = np.full(size, BatteryState.REMOVED if name == 'state' else -1 if name == 'charger' else 0,
+                            values.dtype)
+            grown[:len(values)] = values
+            setattr(self, name, grown)
+
+    def add(self, battery: Battery, state: BatteryState) -> FleetBattery:
+        """
+        Stores a copy of the battery, queued last among the batteries of the state.
+        """
+        if self.size == len(self.id):
+            self.grow()
+        row = self.size
+        self.size += 1
+        self.id[row] = battery.id
+        self.soc[row] = battery.soc
+        self.capacity[row] = battery.capacity
+        self.max_power[row] = battery.max_power
+        self.actual_power[row] = battery.actual_power
+        self.soc_delta[row] = battery.soc_delta_per_timestep
+        self.resolution[row] = battery.resolution
+        self.charger[row] = -1 if battery.charger is None else battery.charger
+        self.set_state(np.array([row]), state)
+        handle = FleetBattery(self, row)
+        self.handles[battery.id] = handle
+        return handle
+
+    def pop(self, state: BatteryState) -> Optional[Battery]:
+        """
+        Removes the first battery of the state and returns it as a battery of its own.
+        """
+        rows = self.rows(state)
+        if len(rows) == 0:
+            return None
+        row = rows[0]
+        battery = Battery(int(self.id[row]), float(self.soc[row]), float(self.capacity[row]),
+                          resolution=float(self.resolution[row]), max_power=float(self.max_power[row]))
+        battery.set_charging_power(float(self.actual_power[row]))
+        self.state[row] = BatteryState.REMOVED
+        del self.handles[battery.id]
+        return battery
+
+    def compact(self):
+        """
+        Reclaims the rows of removed batteries. Moves rows, so handles must not be used concurrently.
+        """
+        rows = np.flatnonzero(self.state[:self.size] != BatteryState.REMOVED)
+        for name in self.columns:
+            values = getattr(self, name)
+            values[:len(rows)] = values[rows]
+            values[len(rows):self.size] = BatteryState.REMOVED if name == 'state' else -1 if name == 'charger' else 0
+        for row, battery_id in enumerate(self.id[:len(rows)].tolist()):
+            self.handles[battery_id].row = row
+        self.size = len(rows)
+
+    def remove(self, battery_id: int) -> bool:
+        """
+        Removes the battery in whatever state it is, returns whether the fleet had the battery.
+        """
+        handle = self.handles.pop(battery_id, None)
+        if handle is None:
+            return False
+        self.state[handle.row] = BatteryState.REMOVED
+        return True
+
+    def removed(self) -> int:
+        return self.size - len(self.handles)
+
+    def set_state(self, rows: np.ndarray, state: BatteryState):
+        """
+        Moves the batteries to the state, queued last in the given order.
+        """
+        self.state[rows] = state
+        self.order[rows] = np.arange(self.sequence, self.sequence + len(rows))
+        self.sequence += len(rows)
+
+    def rows(self, state: BatteryState) -> np.ndarray:
+        """
+        Returns the rows of the batteries of the state in queue order.
+        """
+        rows = np.flatnonzero(self.state[:self.size] == state)
+        return rows[np.argsort(self.order[rows], kind='stable')]
+
+    def count(self, state: BatteryState) -> int:
+        return int(np.count_nonzero(self.state[:self.size] == state))
+
+    def batteries(self, state: BatteryState) -> List[FleetBattery]:
+        rows = self.rows(state)
+        batteries = []
+        for battery_id, row in zip(self.id[rows].tolist(), rows.tolist()):
+            # the handles of a copy are created on first use
+            if battery_id not in self.handles:
+                self.handles[battery_id] = FleetBattery(self, row)
+            batteries.append(self.handles[battery_id])
+        return batteries
+
+    def charge(self, rows: np.ndarray, timesteps: np.ndarray) -> np.ndarray:
+        """
+        Charges the batteries for the (fractional) number of time steps with their charging power.
+        Returns which of the batteries are fully charged, batteries not charged at all are never full.
+        """
+        charged = timesteps > 0
+        soc = self.soc[rows] + self.soc_delta[rows] * timesteps
+        full = charged & (soc >= 1.0)
+        soc[full] = 1.0
+        self.soc[rows[charged]] = soc[charged]
+        return full
+
+    def sort(self, state: BatteryState):
+        """
+        Queues the batteries of the state with the highest SoC first.
+        """
+        rows = self.rows(state)
+        self.set_state(rows[np.argsort(-self.soc[rows], kind='stable')], state)
+
+    def fingerprint(self, *states: BatteryState) -> bytes:
+        """
+        Returns the batteries of the states in queue order with everything that determines their charging,
+        to detect changes of the fleet.
+        """
+        rows = np.concatenate([self.rows(state) for state in states])
+        return np.stack([self.id[rows], self.soc[rows], self.soc_delta[rows], self.max_power[rows],
+                         self.charger[rows], self.state[rows]]).tobytes()
+
+    def get_columns(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the used rows of all columns, including rows of removed batteries.
+        """
+        return {name: getattr(self, name)[:self.size] for name in self.columns}
+
+    def copy(self) -> 'Fleet':
+        """
+        Returns a copy of the used rows of the columns, to be read while the fleet changes.
+        The handles of the copy are created when its batteries are asked for.
+        """
+        fleet = Fleet(0)
+        for name in self.columns:
+            setattr(fleet, name, getattr(self, name)[:self.size].copy())
+        fleet.size = self.size
+        fleet.sequence = self.sequence
+        return fleet
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], sequence: int) -> 'Fleet':
+        """
+        Creates a fleet from the columns of get_columns and the next queue position.
+        """
+        size = len(columns['id'])
+        fleet = cls(max(size, 64))
+        for name in cls.columns:
+            getattr(fleet, name)[:size] = columns[name]
+        fleet.size = size
+        fleet.sequence = sequence
+        for row in np.flatnonzero(fleet.state[:size] != BatteryState.REMOVED).tolist():
+            fleet.handles[int(fleet.id[row])] = FleetBattery(fleet, row)
+        return fleet
+
+    def serialize(self, state: BatteryState, charger: bool = False) -> List[dict]:
+        rows = self.rows(state)
+        columns = {
+            'battery_id': self.id[rows].tolist(),
+            'soc': self.soc[rows].tolist(),
+            'capacity': self.capacity[rows].tolist(),
+            'max_power': self.max_power[rows].tolist(),
+        }
+        if charger:
+            columns['charger'] = self.charger[rows].tolist()
+        keys = list(columns)
+        return [dict(zip(keys, values)) for values in zip(*columns.values())]
+
+    def serialize_states(self) -> dict:
+        return {
+            'waiting_batteries': self.serialize(BatteryState.WAITING),
+            'finished_batteries': self.serialize(BatteryState.FINISHED),
+            'charging_batteries': self.serialize(BatteryState.CHARGING, charger=True)
+        }
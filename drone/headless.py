@@ -0,0 +1,106 @@
+from dataclasses import dataclass
+from time import time
+from typing import Iterable, List
+
+import numpy as np
+
+import drone.config as config
+from drone.simulation import Simulation
+
+
+@dataclass
+class Arrival:
+    """
+    A drone arriving at the station to exchange its battery for a charged one.
+    """
+    time: int  # simulation time in seconds
+    state_of_charge: float
+    capacity_kwh: float = 2
+    max_power_watt: float = config.max_power
+
+
+@dataclass
+class HeadlessResult:
+    end_time: int  # simulation time in seconds
+    served: int  # arrivals that got a charged battery
+    declined: int  # arrivals without a charged battery at the station
+    energy_wh: float  # energy charged
+    cost_eur: float  # cost of the charged energy
+    events: int  # number of times the clock jumped
+    runtime_s: float
+
+
+def arrivals_from_demand(demand_events: List[int], days: int, state_of_charge: float = 0.2,
+                         start_time: int = 0) -> List[Arrival]:
+    """
+    Creates a drone arrival for each demand event (in seconds after midnight) of each day.
+    """
+    return [Arrival(start_time + day * 86400 + event, state_of_charge)
+            for day in range(days) for event in sorted(demand_events) if event < 86400]
+
+
+def run_headless(simulation: Simulation,
+                 duration_s: int,
+                 arrivals: Iterable[Arrival] = (),
+                 time_budget: float = np.inf,
+                 replan_slots: int = config.headless_replan_slots) -> HeadlessResult:
+    """
+    Runs the simulation on a virtual clock as fast as possible.
+
+    Instead of stepping every slot, the clock jumps from event to event, namely battery swaps and drone
+    arrivals, and the schedule is optimized after each event or after replan_slots slots without event.
+    The battery state machine is the same as in the real time simulation.
+
+    time_budget - time the greedy optimizer may spend per replanning in seconds, infinite by default so
+                  results do not depend on the speed of the machine
+    """
+    tik = time()
+    if simulation.current_time is None:
+        simulation.current_time = 0
+    end_time = simulation.current_time + duration_s
+    arrivals = sorted(arrivals, key=lambda arrival: arrival.time)
+    next_arrival = 0
+    served = declined = events = 0
+    energy_wh = cost_eur = 0.0
+
+    simulation.create_optimized_schedule(simulation.current_time, time_budget)
+    while simulation.current_time < end_time:
+        # exchange the batteries of all drones that arrived until now
+        while next_arrival < len(arrivals) and arrivals[next_arrival].time <= simulation.current_time:
+            success, _ = simulation.take_battery()
+            if success:
+                simulation.create_battery(arrivals[next_arrival])
+                served += 1
+            else:
+                declined += 1
+            next_arrival += 1
+
+        # jump to the next event
+        slots = min(replan_slots, int(np.ceil((end_time - simulation.current_time) / config.resolution)))
+        if next_arrival < len(arrivals):
+            arrival_slots = int(np.ceil((arrivals[next_arrival].time - simulation.current_time) / config.resolution))
+            slots = min(slots, max(arrival_slots, 1))
+        slots = simulation.next_swap(slots)
+
+        price_profile = np.take(simulation.price_profile,
+                                np.arange(slots) + simulation.current_time_index(), mode='wrap')
+        load = simulation.advance(slots)
+        energy_curve_wh = load * (config.resolution / 3600)
+        energy_wh += float(np.sum(energy_curve_wh))
+        cost_eur += float(np.sum(energy_curve_wh * price_profile / 1000000))
+
+        simulation.current_time += slots * config.resolution
+        simulation.create_optimized_schedule(simulation.current_time, time_budget)
+        events += 1
+
+    simulation.replan_requested.clear()
+    simulation.publish_snapshot()
+    return HeadlessResult(
+        end_time=simulation.current_time,
+        served=served,
+        declined=declined,
+        energy_wh=energy_wh,
+        cost_eur=cost_eur,
+        events=events,
+        runtime_s=time() - tik
+    )
@@ -0,0 +1,195 @@
+"""metrics of the simulation in the Prometheus text format
+
+The metrics are plain counters and histograms behind a lock, so they are cheap enough to stay enabled.
+"""
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def format_labels(labels: Labels, extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in labels] + ([extra] if extra else [])
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.lock = Lock()
+        self.values: Dict[Labels, object] = {}
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.extend(self.render_value(labels, value))
+        return lines
+
+    def render_value(self, labels: Labels, value) -> List[str]:
+        return [f'{self.name}{format_labels(labels)} {value}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items())) if labels else ()
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items())) if labels else ()
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bucket] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self.values.get(tuple(sorted(labels.items())))
+        return sum(state[0]) if state else 0
+
+    def render_value(self, labels: Labels, state) -> List[str]:
+        counts, total = state
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="' + ('+Inf' if bound == float('inf') else repr(bound)) + '"'
+            lines.append(f'{self.name}_bucket{format_labels(labels, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(labels)} {total}')
+        lines.append(f'{self.name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+class FunctionMetric(Metric):
+    """
+    Metric whose value is read when the metrics are rendered, for values counted elsewhere.
+    """
+
+    def __init__(self, name: str, help: str, kind: str, function: Callable[[], float]):
+        super().__init__(name, help)
+        self.kind = kind
+        self.function = function
+
+    def render(self) -> List[str]:
+        value = self.function()
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        return lines + ([f'{self.name} {value}'] if value is not None else [])
+
+
+class Registry:
+    def __init__(self, prefix: str = 'drone_'):
+        self.prefix = prefix
+        self.metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.add(Counter(self.prefix + name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.add(Gauge(self.prefix + name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.add(Histogram(self.prefix + name, help, buckets))
+
+    def function(self, name: str, help: str, function: Callable[[], float], kind: str = 'gauge') -> FunctionMetric:
+        return self.add(FunctionMetric(self.prefix + name, help, kind, function))
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+class TimedLock:
+    """
+    Lock that records how long it was waited for and how long it was held.
+    """
+
+    def __init__(self, wait: Histogram, hold: Histogram):
+        self.lock = Lock()
+        self.wait = wait
+        self.hold = hold
+        self.acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        tik = perf_counter()
+        acquired = self.lock.acquire(blocking, timeout)
+        if acquired:
+            self.acquired_at = perf_counter()
+            self.wait.observe(self.acquired_at - tik)
+        return acquired
+
+    def release(self):
+        held = perf_counter() - self.acquired_at
+        self.lock.release()
+        self.hold.observe(held)
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class SimulationMetrics:
+    """
+    Metrics of the simulation loop, the optimizer, the lock of the simulation and the API.
+    """
+
+    def __init__(self, registry: Registry = None):
+        self.registry = registry if registry is not None else Registry()
+        registry = self.registry
+        self.tick_seconds = registry.histogram('tick_seconds', 'Duration of the ticks of the simulation loop.')
+        self.phase_seconds = registry.histogram(
+            'phase_seconds', 'Duration of the phases of the simulation loop: advance, optimize, publish, log and persist.')
+        self.tick_overruns = registry.counter('tick_overruns_total', 'Ticks that took longer than a slot.')
+        self.replans = registry.counter('replans_total', 'Optimizations of the plan.')
+        self.shifted_ticks = registry.counter('shifted_ticks_total',
+                                              'Ticks that published the shifted plan without optimizing.')
+        self.optimizer_iterations = registry.counter('optimizer_iterations_total',
+                                                     'Slots tried by the greedy optimizer.')
+        self.optimizer_slots = registry.counter('optimizer_slots_total',
+                                                'Slots the greedy optimizer had to try to complete its plans.')
+        self.optimizer_progress = registry.gauge('optimizer_progress_ratio',
+                                                 'Share of the slots the greedy optimizer tried in the last plan.')
+        self.feasibility_checks = registry.counter('feasibility_checks_total',
+                                                   'Feasibility checks of schedules and of blocked slots.')
+        self.lock_wait_seconds = registry.histogram('lock_wait_seconds', 'Time waited for the simulation lock.')
+        self.lock_hold_seconds = registry.histogram('lock_hold_seconds', 'Time the simulation lock was held.')
+        self.api_request_seconds = registry.histogram('api_request_seconds', 'Latency of the API handlers.')
@@ -0,0 +1,71 @@
+from typing import Optional, Sequence
+import numpy as np
+
+
+def min_cost_constraints(required_timesteps: Sequence[int],
+                         charging_power: Sequence[float],
+                         demand: np.ndarray,
+                         price_profile: np.ndarray) -> Optional[np.ndarray]:
+    """calculates the cost-optimal charging constraints of a single charger
+
+    Batteries are charged one after another in the given order, so every unconstrained slot charges the
+    battery owning the next required time step (its rank). The cheapest set of unconstrained slots is a
+    min-cost path through the (slot, rank) lattice: in each slot the path either stays on its rank
+    (slot is blocked) or advances by one rank and pays price * power of the battery owning that rank.
+    Demand deadlines cut off all ranks that are too low at the respective slot.
+
+    Args:
+        required_timesteps (Sequence[int]): unconstrained time steps needed by each battery in charging order
+        charging_power (Sequence[float]): charging power of each battery in W
+        demand (np.ndarray): cumulative number of batteries that have to be finished at each slot
+        price_profile (np.ndarray): price of each slot
+
+    Returns:
+        Optional[np.ndarray]: blocked slots, None if the demand cannot be met
+    """
+    slots = len(price_profile)
+    required_timesteps = np.asarray(required_timesteps, dtype=int)
+    cumulative_required = np.concatenate([[0], np.cumsum(required_timesteps)])
+
+    demand = np.maximum.accumulate(np.asarray(demand))
+    demanded = max(int(np.ceil(demand[-1])), 0) if len(demand) else 0
+    if demanded > len(required_timesteps):
+        return None
+
+    # minimum rank that has to be reached before each slot boundary
+    deadlines = np.searchsorted(demand, np.arange(1, demanded + 1), side='left')
+    needed_rank = np.zeros(slots + 1, dtype=int)
+    np.maximum.at(needed_rank, deadlines, cumulative_required[1:demanded + 1])
+    needed_rank = np.maximum.accumulate(needed_rank)
+
+    # charging beyond the demand only pays off in slots with negative prices
+    max_rank = min(cumulative_required[-1], slots,
+                   cumulative_required[demanded] + int(np.sum(price_profile < 0)))
+    if needed_rank[-1] > max_rank:
+        return None
+
+    # power of the battery owning each rank, rank 0 is the empty start
+    rank_power = np.zeros(max_rank + 1)
+    rank_power[1:] = np.repeat(np.asarray(charging_power, dtype=float), required_timesteps)[:max_rank]
+
+    cost = np.full(max_rank + 1, np.inf)
+    cost[0] = 0
+    cost[:needed_rank[0]] = np.inf
+    advanced = np.zeros((slots, max_rank + 1), dtype=bool)
+    for slot in range(slots):
+        advance_cost = np.full(max_rank + 1, np.inf)
+        advance_cost[1:] = cost[:-1] + price_profile[slot] * rank_power[1:]
+        advanced[slot] = advance_cost < cost
+        cost = np.where(advanced[slot], advance_cost, cost)
+        cost[:needed_rank[slot + 1]] = np.inf
+
+    rank = int(np.argmin(cost))
+    if not np.isfinite(cost[rank]):
+        return None
+
+    charging_constraints = np.ones(slots, dtype=bool)
+    for slot in range(slots - 1, -1, -1):
+        if rank > 0 and advanced[slot, rank]:
+            charging_constraints[slot] = False
+            rank -= 1
+    return charging_constraints
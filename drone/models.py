@@ -0,0 +1,80 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class Battery(BaseModel):
+    battery_id: str = Field(example="battery1")
+    state_of_charge: float = Field(example=0.9)
+    capacity_kwh: float = Field(example=2)
+    max_power_watt: float = Field(example=2000)
+
+
+class ChargeRequest(BaseModel):
+    drone_id: str = Field(example="drone123")
+    state_of_charge: float = Field(
+        example=0.75, description="Anticipated state of charge.")
+    capacity_kwh: float = Field(example=1.5)
+    max_power_watt: float = Field(example=1500)
+    delta_eta_seconds: int = Field(
+        example=60*10, description="Time in seconds until estimated time of arrival.")
+
+
+class ExchangeRequest(BaseModel):
+    drone_id: str = Field(example="drone123")
+    state_of_charge: float = Field(
+        example=0.5, description="Actual state of charge of the battery.")
+    response_uri: Optional[str] = Field(example="http://localhost:8000/exchange-test")
+
+
+class ExchangeCompleted(BaseModel):
+    drone_id: str = Field(example="drone123")
+
+
+class ExchangeTest(BaseModel):
+    success: bool = Field(example=True)
+    drone_id: str = Field(example="drone123")
+    soc: float = Field(example=1, description="State of charge of the battery.")
+    capacity: float = Field(example=2, description="Capacity of the battery in kWh.")
+    max_power: float = Field(example=2000, description="Maximum power of the battery in W.")
+    message: str = Field(example="battery exchange completed")
+
+
+class DemandEstimation(BaseModel):
+    demand: List[int] = Field(example=[i*60*60 for i in range(24)],
+                              description="List representing battery demand events in seconds after midnight.")
+
+
+class PriceProfile(BaseModel):
+    price: List[float] = Field(example=[
+        25.02, 18.29, 16.04, 14.6, 14.95, 14.5, 10.76, 12.01, 
+        12.39, 14.04, 14.68, 16.08, 16.08, 16.05, 16.04, 16.1,
+        23.93, 26.9, 26.36, 23.98, 16.09, 14.08, 12.44, 0.04
+    ], description="List of prices at various intervals, must be at most 24 hours long.")
+    resolution_s: int = Field(
+        example=3600, description="Resolution of price profile in seconds.")
+
+
+class PowerLimit(BaseModel):
+    power_watt: List[float] = Field(example=[
+        8000, 8000, 8000, 8000, 8000, 8000, 6000, 6000,
+        4000, 4000, 4000, 4000, 4000, 4000, 4000, 4000,
+        4000, 4000, 6000, 6000, 8000, 8000, 8000, 8000
+    ], description="Grid connection limit of the station at various intervals, must be at most 24 hours long.")
+    resolution_s: int = Field(
+        example=3600, description="Resolution of power limit in seconds.")
+
+
+class SimulationConfig(BaseModel):
+    start_time: int = Field(example=0, description="seconds since midnight")
+
+
+# the id names the state directory of the station, ids of dots only would name its parents
+STATION_ID_PATTERN = r"^(?!\.+$)[A-Za-z0-9_.-]+$"
+
+
+class StationConfig(BaseModel):
+    station_id: str = Field(example="station1", regex=STATION_ID_PATTERN)
+    charger_count: int = Field(example=1, ge=1, description="Number of chargers of the station.")
+    scheduler: str = Field(example="greedy", regex="^(greedy|optimal)$")
+    start_time: int = Field(0, example=0, description="seconds since midnight")
@@ -0,0 +1,107 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from time import time, sleep
+from typing import Optional
+import logging
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+import drone.config as config
+
+logger = logging.getLogger(__name__)
+
+
+class ExchangeNotifier:
+    """
+    Delivers "battery exchanged" messages in the background.
+
+    Messages are posted by a bounded pool of worker threads sharing one pooled HTTP session, so a slow
+    upstream never blocks the simulation. Failed deliveries are retried with exponential backoff,
+    delivery latency and failures are collected as metrics.
+    """
+
+    def __init__(self,
+                 default_uri: str = config.exchange_response_uri,
+                 max_workers: int = config.notification_workers,
+                 timeout: float = config.notification_timeout,
+                 retries: int = config.notification_retries,
+                 backoff: float = config.notification_backoff):
+        self.default_uri = default_uri
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='exchange-notifier')
+        self.closed = False
+
+        self.lock = Lock()
+        self.pending = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies = deque(maxlen=1000)  # latency of the latest deliveries in seconds
+
+    def notify(self, drone_id: str, response_uri: Optional[str] = None) -> Future:
+        """
+        Queues a message for the drone, sent to response_uri or the default URI.
+        The returned future resolves to True once the message is delivered, False if all attempts failed.
+        """
+        message = {
+            "assetId": drone_id
+        }
+        with self.lock:
+            self.pending += 1
+        return self.executor.submit(self.deliver, response_uri or self.default_uri, message)
+
+    def deliver(self, uri: str, message: dict) -> bool:
+        tik = time()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    response = self.session.post(uri, json=message, timeout=self.timeout)
+                    response.raise_for_status()  # Raise an exception for HTTP errors
+                    with self.lock:
+                        self.delivered += 1
+                        self.latencies.append(time() - tik)
+                    return True
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f'error sending message to {uri} (attempt {attempt + 1}): {e}')
+                    status = e.response.status_code if e.response is not None else None
+                    if status is not None and status < 500 or attempt == self.retries:
+                        break
+                    with self.lock:
+                        self.retried += 1
+                    sleep(self.backoff * 2 ** attempt)
+            with self.lock:
+                self.failed += 1
+            return False
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            latencies = np.array(self.latencies)
+            return {
+                'pending': self.pending,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'retried': self.retried,
+                'latency_seconds': {
+                    'mean': float(latencies.mean()) if len(latencies) else None,
+                    'p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+                    'max': float(latencies.max()) if len(latencies) else None,
+                }
+            }
+
+    def shutdown(self, wait: bool = True):
+        self.closed = True
+        self.executor.shutdown(wait=wait)
+        self.session.close()
@@ -0,0 +1,354 @@
+"""durable state of the simulation as write-ahead log and snapshots
+
+Every change of the state through the API is appended to the log before it is acknowledged. The simulation loop
+periodically writes a snapshot of the fleet, the pending requests, the demand, the profiles and the warm start
+of the optimizer (constraints and schedule) as numpy arrays, after which the older log entries are dropped.
+On startup the latest snapshot is loaded and the changes logged after it are applied again.
+
+The log holds changes, not the charging of the batteries: after a restore the batteries continue from their
+state of charge in the snapshot. Charge requests log the battery they reserved, so a restored request keeps its
+battery even if that battery was not charged yet in the snapshot. Exchange notifications are not sent again.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from time import time
+from types import SimpleNamespace
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import drone.config as config
+from drone.battery import Battery
+from drone.demand import DemandModel
+from drone.fleet import Fleet
+from drone.schedule import Schedule
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def battery_state(battery: Battery) -> dict:
+    return {
+        'id': int(battery.id),
+        'soc': float(battery.soc),
+        'capacity': float(battery.capacity),
+        'max_power': float(battery.max_power),
+        'actual_power': float(battery.actual_power),
+        'resolution': float(battery.resolution)
+    }
+
+
+def battery_from_state(state: dict) -> Battery:
+    battery = Battery(state['id'], state['soc'], state['capacity'], resolution=state['resolution'],
+                      max_power=state['max_power'])
+    battery.set_charging_power(state['actual_power'])
+    return battery
+
+
+def request_state(request: dict) -> dict:
+    state = {name: battery_state(request[name]) for name in ['charged_battery', 'new_battery']}
+    if 'response_uri' in request:
+        state['response_uri'] = request['response_uri']
+    return state
+
+
+def request_from_state(state: dict) -> dict:
+    request = {name: battery_from_state(state[name]) for name in ['charged_battery', 'new_battery']}
+    if 'response_uri' in state:
+        request['response_uri'] = state['response_uri']
+    return request
+
+
+def capture(simulation) -> Tuple[dict, dict]:
+    """
+    Returns the arrays and the metadata of the state of the simulation, to be called within its lock.
+    """
+    schedule = simulation.schedule
+    arrays = {f'fleet_{name}': values.copy() for name, values in simulation.fleet.get_columns().items()}
+    arrays.update(
+        constraints=simulation.constraints.copy(),
+        optimized_schedule=schedule.optimized_schedule.copy(),
+        charging_constraints=schedule.charging_constraints.copy(),
+        power_factor=np.array(schedule.power_factor),
+        price_profile=simulation.price_profile.copy(),
+        power_limit=simulation.power_limit.copy(),
+        demand_events=np.array(simulation.demand_model.events)
+    )
+    meta = {
+        'format': FORMAT_VERSION,
+        'slot_count': config.slot_count,
+        'resolution': config.resolution,
+        'charger_count': simulation.charger_count,
+        'current_time': simulation.current_time,
+        'id_counter': simulation.id_counter,
+        'fleet_sequence': simulation.fleet.sequence,
+        'plan_complete': simulation.plan_complete,
+        'slots_since_replan': simulation.slots_since_replan,
+        'battery_requests': {drone_id: request_state(request)
+                             for drone_id, request in simulation.battery_requests.items()},
+        'exchange_requests': {drone_id: request_state(request)
+                              for drone_id, request in simulation.exchange_requests.items()}
+    }
+    return arrays, meta
+
+
+def apply_snapshot(simulation, arrays: dict, meta: dict):
+    """
+    Replaces the state of the simulation with a snapshot, including the constraints the optimizer continues from.
+    """
+    expected = {'format': FORMAT_VERSION, 'slot_count': config.slot_count, 'resolution': config.resolution,
+                'charger_count': simulation.charger_count}
+    mismatch = {name: meta.get(name) for name, value in expected.items() if meta.get(name) != value}
+    if mismatch:
+        raise ValueError(f'snapshot does not match the configuration of the simulation: {mismatch}')
+
+    columns = {name: arrays[f'fleet_{name}'] for name in Fleet.columns}
+    schedule = Schedule(mode=simulation.scheduler, chargers=simulation.charger_count)
+    schedule.optimized_schedule = arrays['optimized_schedule']
+    schedule.charging_constraints = arrays['charging_constraints']
+    schedule.power_factor = arrays['power_factor']
+    schedule.version += 1
+    with simulation.lock:
+        simulation.current_time = meta['current_time']
+        simulation.fleet = Fleet.from_columns(columns, meta['fleet_sequence'])
+        simulation.battery_requests = {drone_id: request_from_state(state)
+                                       for drone_id, state in meta['battery_requests'].items()}
+        simulation.exchange_requests = {drone_id: request_from_state(state)
+                                        for drone_id, state in meta['exchange_requests'].items()}
+        simulation.id_counter = meta['id_counter']
+        simulation.constraints = arrays['constraints']
+        simulation.schedule = schedule
+        simulation.price_profile = arrays['price_profile']
+        simulation.power_limit = arrays['power_limit']
+        simulation.demand_model = DemandModel(arrays['demand_events'])
+        simulation.plan_complete = meta['plan_complete']
+        simulation.slots_since_replan = meta['slots_since_replan']
+        # plans started before the restore are discarded
+        simulation.epoch += 1
+
+
+def reserve_batteries(simulation, requests: List[dict]):
+    """
+    Applies logged charge requests with the batteries they reserved.
+    """
+    with simulation.lock:
+        for request in requests:
+            charged_battery = request['charged_battery']
+            simulation.fleet.remove(charged_battery['id'])
+            simulation.battery_requests[request['drone_id']] = request_from_state(request)
+            simulation.id_counter = max(simulation.id_counter, request['new_battery']['id'] + 1)
+    simulation.request_replan()
+
+
+def take_battery(simulation, battery_id: int):
+    """
+    Applies a logged battery taken from the station, by id as the finished batteries may differ after a restore.
+    """
+    with simulation.lock:
+        simulation.fleet.remove(battery_id)
+    simulation.request_replan()
+
+
+OPERATIONS = {
+    'restart': lambda simulation, args: simulation.restart(args['start_time']),
+    'clear_batteries': lambda simulation, args: simulation.clear_batteries(),
+    'set_demand': lambda simulation, args: simulation.set_demand(SimpleNamespace(**args)),
+    'set_price_profile': lambda simulation, args: simulation.set_price_profile(SimpleNamespace(**args)),
+    'set_power_limit': lambda simulation, args: simulation.set_power_limit(SimpleNamespace(**args)),
+    'create_batteries': lambda simulation, args: simulation.create_batteries(
+        [SimpleNamespace(**battery) for battery in args]),
+    'add_requests': reserve_batteries,
+    'take_battery': take_battery,
+    'exchange_batteries': lambda simulation, args: simulation.exchange_batteries(
+        [SimpleNamespace(**request) for request in args]),
+    'exchanges_completed': lambda simulation, args: simulation.exchanges_completed(args, notify=False),
+}
+
+
+class StateStore:
+    """
+    Write-ahead log and snapshots of the state of a simulation in a directory.
+
+    The log is a JSON line per change with an increasing sequence number. A snapshot rotates the log into
+    a segment first, the segment is deleted once the snapshot is written, so a crash in between loses nothing.
+    Snapshots are written to a temporary file and renamed, a crash leaves the previous snapshot intact.
+
+    Changes are numbered and queued within the lock of the simulation by append, and written by commit after
+    the lock is released. Entries queued by concurrent changes are written together with one flush, so a write
+    to the disk holds up neither the simulation nor other changes.
+    """
+
+    snapshot_name = 'snapshot.npz'
+    log_name = 'wal.jsonl'
+
+    def __init__(self, directory: Path, snapshot_interval_slots: int = config.state_snapshot_interval_slots,
+                 fsync: bool = config.state_fsync):
+        """
+        fsync - writes every log entry through to the disk, otherwise entries survive crashes of the process
+                but not of the machine
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.snapshot_interval_slots = snapshot_interval_slots
+        self.fsync = fsync
+        self.sequence = 0  # sequence number of the last log entry
+        self.slots = 0  # slots since the last snapshot
+        self.log_file = None
+        self.pending: List[str] = []  # entries appended but not written yet, in sequence order
+        self.pending_lock = Lock()
+        self.write_lock = Lock()  # orders the writes of the log
+
+    @property
+    def snapshot_path(self) -> Path:
+        return self.directory / self.snapshot_name
+
+    @property
+    def log_path(self) -> Path:
+        return self.directory / self.log_name
+
+    def append(self, operation: str, args, current_time=None):
+        """
+        Queues a change for the log, to be called within the lock of the simulation so the log has the order
+        of the changes. The change is written by the next commit.
+        """
+        self.sequence += 1
+        entry = json.dumps({'seq': self.sequence, 'time': current_time, 'op': operation, 'args': args},
+                           separators=(',', ':'))
+        with self.pending_lock:
+            self.pending.append(entry)
+
+    def commit(self):
+        """
+        Writes the queued changes to the log, to be called after the lock of the simulation is released and
+        before the change is acknowledged. Returns once the changes queued before the call are written.
+        """
+        with self.write_lock:
+            with self.pending_lock:
+                entries, self.pending = self.pending, []
+            if not entries:
+                return
+            if self.log_file is None:
+                self.log_file = open(self.log_path, 'a', encoding='utf-8')
+            self.log_file.write(''.join(entry + '\n' for entry in entries))
+            self.log_file.flush()
+            if self.fsync:
+                os.fsync(self.log_file.fileno())
+
+    def count_slot(self) -> bool:
+        """
+        Counts a slot of the simulation, returns whether a snapshot is due.
+        """
+        self.slots += 1
+        return self.slots >= self.snapshot_interval_slots
+
+    def rotate(self) -> int:
+        """
+        Moves the log into a segment, to be called within the lock of the simulation.
+        Returns the sequence number of the last entry.
+        """
+        self.commit()
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        if self.log_path.exists():
+            self.log_path.replace(self.directory / f'wal-{self.sequence}.jsonl')
+        return self.sequence
+
+    def segments(self) -> List[Path]:
+        """
+        Returns the log segments ordered by their last sequence number, followed by the log.
+        """
+        segments = sorted(self.directory.glob('wal-*.jsonl'), key=lambda path: int(path.stem.split('-')[1]))
+        return segments + ([self.log_path] if self.log_path.exists() else [])
+
+    def save(self, simulation):
+        """
+        Writes a snapshot of the simulation and drops the log entries it contains.
+        """
+        tik = time()
+        with simulation.lock:
+            arrays, meta = capture(simulation)
+            meta['sequence'] = self.rotate()
+        temporary_path = self.snapshot_path.with_suffix('.tmp')
+        with open(temporary_path, 'wb') as file:
+            np.savez(file, meta=np.array(json.dumps(meta)), **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        temporary_path.replace(self.snapshot_path)
+        if hasattr(os, 'O_DIRECTORY'):
+            # the rename is only durable once the directory is written
+            directory = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        for segment in self.segments():
+            if segment != self.log_path and int(segment.stem.split('-')[1]) <= meta['sequence']:
+                segment.unlink()
+        self.slots = 0
+        logger.debug(f'saved snapshot of sequence {meta["sequence"]} in {time() - tik:.3f}s')
+
+    def load(self) -> Optional[Tuple[dict, dict]]:
+        """
+        Returns the arrays and the metadata of the latest snapshot, None without snapshot.
+        """
+        if not self.snapshot_path.exists():
+            return None
+        with np.load(self.snapshot_path, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        return arrays, json.loads(str(arrays.pop('meta')))
+
+    def entries(self, after: int = 0) -> Iterator[dict]:
+        """
+        Yields the logged changes with a sequence number above the given one in order.
+        A torn last line of a crash while writing is skipped.
+        """
+        for segment in self.segments():
+            with open(segment, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        logger.warning(f'skipped incomplete log entry in {segment}')
+                        continue
+                    if entry['seq'] > after:
+                        yield entry
+
+    def restore(self, simulation) -> bool:
+        """
+        Restores the simulation from the latest snapshot and the changes logged after it,
+        then logs further changes of the simulation. Returns whether any state was restored.
+        """
+        tik = time()
+        snapshot = self.load()
+        after = 0
+        if snapshot is not None:
+            arrays, meta = snapshot
+            apply_snapshot(simulation, arrays, meta)
+            after = self.sequence = meta['sequence']
+
+        # the changes are applied without logging them again
+        simulation.store = None
+        replayed = 0
+        for entry in self.entries(after):
+            OPERATIONS[entry['op']](simulation, entry['args'])
+            self.sequence = entry['seq']
+            replayed += 1
+        simulation.store = self
+        restored = snapshot is not None or replayed > 0
+        if restored:
+            restored_at = time()
+            simulation.publish_snapshot()
+            logger.info(f'restored the state from {self.directory} with {replayed} logged changes '
+                        f'in {restored_at - tik:.3f}s, published in {time() - restored_at:.3f}s')
+        return restored
+
+    def close(self):
+        self.commit()
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
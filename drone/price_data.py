@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import drone.config as config
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%d.%m.%Y %H:%M"
+HOUR = np.timedelta64(1, 'h')
+DAY = np.timedelta64(1, 'D')
+
+DateLike = Union[str, date, datetime, np.datetime64]
+
+
+def parse_price_csv(csv_file_path: Path):
+    """
+    Parses the historical prices and resamples them to whole days of hourly prices.
+    Missing prices are interpolated linearly.
+
+    Returns the timestamps as datetime64[h] and the prices in EUR/MWh.
+    """
+    price_data = pd.read_csv(csv_file_path, usecols=['date', 'actual'], dtype={'date': str, 'actual': float})
+    timestamps = pd.to_datetime(price_data['date'], format=DATE_FORMAT).to_numpy().astype('datetime64[h]')
+    prices = price_data['actual'].to_numpy()
+
+    # drop missing prices and repeated hours (change from daylight saving time)
+    valid = ~np.isnan(prices)
+    timestamps, unique = np.unique(timestamps[valid], return_index=True)
+    prices = prices[valid][unique]
+
+    start = timestamps[0].astype('datetime64[D]')
+    end = (timestamps[-1] + HOUR).astype('datetime64[D]')
+    if end < timestamps[-1] + HOUR:
+        end += DAY
+    grid = np.arange(start, end, HOUR)
+    if len(grid) != len(timestamps):
+        prices = np.interp(grid.astype(int), timestamps.astype(int), prices)
+    return grid, prices
+
+
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class PriceHistory:
+    """
+    Hourly historical prices in EUR/MWh covering whole days.
+
+    The prices are parsed from the CSV once and cached as .npy files, which are memory-mapped on later loads.
+    The cache is rebuilt when the modification time and the content of the CSV changed.
+    Days and windows are views of the cached prices, no data is copied.
+    """
+
+    def __init__(self, timestamps: np.ndarray, prices: np.ndarray):
+        self.timestamps = timestamps  # start of each hour as datetime64[h]
+        self.prices = prices
+        self.start = timestamps[0].astype('datetime64[D]')
+
+    @classmethod
+    def load(cls, csv_file_path: Path = config.price_data_path, cache_dir: Optional[Path] = None) -> 'PriceHistory':
+        """
+        cache_dir - directory of the cache files, next to the CSV by default
+        """
+        csv_file_path = Path(csv_file_path)
+        cache_dir = Path(cache_dir) if cache_dir is not None else csv_file_path.parent / '.cache'
+        timestamps_path = cache_dir / f'{csv_file_path.stem}.timestamps.npy'
+        prices_path = cache_dir / f'{csv_file_path.stem}.prices.npy'
+        meta_path = cache_dir / f'{csv_file_path.stem}.json'
+
+        stat = csv_file_path.stat()
+        meta = json.loads(meta_path.read_text()) if meta_path.exists() else {}
+        cached = timestamps_path.exists() and prices_path.exists() and meta.get('size') == stat.st_size
+        if cached and meta.get('mtime_ns') != stat.st_mtime_ns:
+            # the file was touched, e.g. by a checkout, the cache is still valid if the content is the same
+            cached = meta.get('sha256') == file_hash(csv_file_path)
+            if cached:
+                cls.write_meta(meta_path, csv_file_path, meta['sha256'])
+
+        if cached:
+            return cls(np.load(timestamps_path, mmap_mode='r'), np.load(prices_path, mmap_mode='r'))
+
+        timestamps, prices = parse_price_csv(csv_file_path)
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            for path, values in [(timestamps_path, timestamps), (prices_path, prices)]:
+                temporary_path = path.with_name(f'{path.stem}.tmp.npy')
+                np.save(temporary_path, values)
+                os.replace(temporary_path, path)
+            cls.write_meta(meta_path, csv_file_path, file_hash(csv_file_path))
+        except OSError as e:
+            logger.warning(f'cannot cache the prices of {csv_file_path}: {e}')
+        return cls(timestamps, prices)
+
+    @staticmethod
+    def write_meta(meta_path: Path, csv_file_path: Path, sha256: str):
+        stat = csv_file_path.stat()
+        temporary_path = meta_path.with_suffix('.tmp')
+        temporary_path.write_text(json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256}))
+        os.replace(temporary_path, meta_path)
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def index(self, timestamp: DateLike) -> int:
+        """
+        Returns the index of the hour of the timestamp.
+        """
+        index = int((np.datetime64(timestamp, 'h') - self.timestamps[0]) // HOUR)
+        if not 0 <= index < len(self.prices):
+            raise ValueError(f'{timestamp} is not within the price history')
+        return index
+
+    def window(self, start: DateLike, hours: int) -> np.ndarray:
+        """
+        Returns the prices of the hours starting at the hour of start.
+        """
+        index = self.index(start)
+        if index + hours > len(self.prices):
+            raise ValueError(f'{hours} hours from {start} are not within the price history')
+        return self.prices[index:index + hours]
+
+    def day(self, day: DateLike) -> np.ndarray:
+        """
+        Returns the 24 hourly prices of the day.
+        """
+        return self.window(np.datetime64(day, 'D'), 24)
+
+    def days(self) -> np.ndarray:
+        """
+        Returns the prices as array of days and hours.
+        """
+        return self.prices.reshape(-1, 24)
@@ -1,142 +1,349 @@
-from typing import List
+from typing import List, Optional
 import numpy as np
 import logging
-from drone.battery import Battery
+from drone.battery import Battery, finish_indices, required_timesteps
+from drone.compact import run_lengths
 import drone.config as config
 from drone.custom_types import ChargingBatteries, FinishedBatteries, WaitingBatteries
+from drone.feasibility import FeasibilityEngine
+from drone.min_cost import min_cost_constraints
 
 logger = logging.getLogger(__name__)
 
 
+def assign_chargers(charging_batteries: ChargingBatteries,
+                    waiting_batteries: WaitingBatteries,
+                    charging_constraints: np.ndarray) -> List[List[Battery]]:
+    """
+    Assigns batteries to chargers in charging order.
+    Charging batteries stay on their charger, every waiting battery is put on the charger that is free first.
+    Batteries that cannot be assigned because all chargers are busy until the end of the schedule are left out.
+    """
+    chargers, slots = charging_constraints.shape
+    charger_batteries: List[List[Battery]] = [[] for _ in range(chargers)]
+    if chargers == 1:
+        charger_batteries[0] = charging_batteries + waiting_batteries
+        return charger_batteries
+
+    free_slots = np.cumsum(~charging_constraints, axis=1)
+    needed_slots = np.zeros(chargers, int)  # required time steps of all batteries assigned to a charger
+    free_at = np.zeros(chargers, int)  # slot at which a charger has finished all its batteries
+
+    def assign(charger: int, battery: Battery, timesteps: int):
+        charger_batteries[charger].append(battery)
+        needed_slots[charger] += timesteps
+        free_at[charger] = min(np.searchsorted(free_slots[charger], needed_slots[charger], side='left') + 1, slots)
+
+    timesteps = required_timesteps(charging_batteries + waiting_batteries)
+    pinned = {battery.charger for battery in charging_batteries}
+    unpinned = iter(charger for charger in range(chargers) if charger not in pinned)
+    for battery, battery_timesteps in zip(charging_batteries, timesteps):
+        charger = battery.charger if battery.charger is not None else next(unpinned)
+        assign(charger, battery, battery_timesteps)
+    for battery, battery_timesteps in zip(waiting_batteries, timesteps[len(charging_batteries):]):
+        charger = int(np.argmin(free_at))
+        if free_at[charger] >= slots:
+            break
+        assign(charger, battery, battery_timesteps)
+    return charger_batteries
+
+
+def fill_schedule(charger_batteries: List[List[Battery]],
+                  charging_constraints: np.ndarray,
+                  power_factor: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Assigns the slots of each charger to its batteries, which are charged one after another.
+    A battery that cannot be fully charged occupies the rest of the schedule, unused slots are -1.
+    """
+    slots = charging_constraints.shape[1]
+    schedule = np.ones(charging_constraints.shape, int) * -1
+    for charger, batteries in enumerate(charger_batteries):
+        if not batteries:
+            continue
+        finish = finish_indices(batteries, charging_constraints[charger:charger + 1], power_factor)
+        unfinished = np.flatnonzero(finish < 0)
+        if len(unfinished):
+            finish = finish[:unfinished[0] + 1]
+            finish[-1] = slots
+        battery_ids = np.array([battery.id for battery in batteries[:len(finish)]])
+
+        owner = np.searchsorted(finish, np.arange(slots), side='right')
+        scheduled = owner < len(finish)
+        schedule[charger, scheduled] = battery_ids[owner[scheduled]]
+    return schedule
+
+
+def max_power_by_id(batteries: List[Battery], schedule: np.ndarray) -> np.ndarray:
+    """
+    Returns a lookup array of the maximum power of each battery id in W.
+    The last entry is 0 W, so slots without a battery (-1) can be looked up as well.
+    """
+    size = max(max((battery.id for battery in batteries), default=0), int(schedule.max(initial=0))) + 2
+    max_power = np.zeros(size)
+    max_power[[battery.id for battery in batteries]] = [battery.max_power for battery in batteries]
+    return max_power
+
+
+def site_power_factor(schedule: np.ndarray,
+                      charging_constraints: np.ndarray,
+                      batteries: List[Battery],
+                      power_limit: np.ndarray) -> np.ndarray:
+    """
+    Calculates the share of their maximum power all batteries charging in a slot are charged with,
+    so that the total load of the station stays below the power limit.
+    """
+    load = np.sum(np.where(charging_constraints, 0, max_power_by_id(batteries, schedule)[schedule]), axis=0)
+    return np.minimum(1, power_limit / np.maximum(load, 1e-9))
+
+
+def shift_slots(array: np.ndarray, slots: int, fill) -> np.ndarray:
+    """
+    Returns the array moved forward by the given number of slots along the last axis, with the freed slots
+    at the end set to fill.
+    """
+    shifted = np.full_like(array, fill)
+    if slots < array.shape[-1]:
+        shifted[..., :array.shape[-1] - slots] = array[..., slots:]
+    return shifted
+
+
+def swapped_battery_events(schedule: np.ndarray) -> np.ndarray:
+    """
+    Returns the number of batteries finished in each slot over all chargers.
+    """
+    return np.sum(np.diff(schedule, axis=1, prepend=schedule[:, :1]) != 0, axis=0)
+
+
 class Schedule:
 
-    def __init__(self, slots: int = config.slot_count):
-        self.optimized_schedule: np.ndarray = np.ones((1, slots), int) * -1
-        self.unoptimized_schedule = np.ones((1, slots), int) * -1
+    def __init__(self, slots: Optional[int] = None, mode: str = config.scheduler, chargers: int = 1):
+        """
+        slots - number of slots of the schedule, config.slot_count by default
+        mode - 'greedy' blocks the most expensive slots first as long as the demand is met,
+               'optimal' calculates the cost-optimal constraints
+        chargers - number of chargers, each charger is a row of the schedule
+        """
+        if mode not in ('greedy', 'optimal'):
+            raise ValueError(f'unknown scheduler mode {mode}')
+        self.mode = mode
+        slots = config.slot_count if slots is None else slots
+        self.optimized_schedule: np.ndarray = np.ones((chargers, slots), int) * -1
+        self.unoptimized_schedule = np.ones((chargers, slots), int) * -1
         self.demand: np.ndarray = np.zeros(self.optimized_schedule.shape, int)
         self.charging_constraints = np.zeros(self.optimized_schedule.shape, dtype=bool)
         self.demand_estimation = None
+        self.assignment: List[List[Battery]] = [[] for _ in range(chargers)]
+        self.power_limit: Optional[np.ndarray] = None
+        self.power_factor = np.ones(slots)
+        self.unoptimized_power_factor = np.ones(slots)
+        # versions of the schedules to cache their load curves
+        self.version = 0
+        self.unoptimized_version = 0
+        self.unoptimized_key = None
+        self.load_curves = {}
 
     def update_schedule(self,
                         waiting_batteries: WaitingBatteries,
                         charging_batteries: ChargingBatteries,
                         finished_batteries: FinishedBatteries,
                         demand_estimation,
-                        charging_constraints) -> bool:
+                        charging_constraints,
+                        power_limit: Optional[np.ndarray] = None) -> bool:
+        """
+        power_limit - maximum total load of the station in each slot in W, None for no limit
+        """
 
         assert np.all(self.optimized_schedule.shape == charging_constraints.shape)
         self.demand_estimation = demand_estimation
-        self.charging_constraints = charging_constraints
+        self.power_limit = power_limit
 
         # charge batteries with the highest SoC first
         waiting_batteries.sort(key=lambda battery: battery.soc, reverse=True)
-        self.optimized_schedule: np.ndarray = np.ones(self.optimized_schedule.shape, int) * -1
-        i = 0
+        self.assignment = assign_chargers(charging_batteries, waiting_batteries, charging_constraints)
+        for waiting_battery in waiting_batteries:
+            waiting_battery.charger = None
+        for charger, batteries in enumerate(self.assignment):
+            for battery in batteries:
+                battery.charger = charger
 
-        for charging_battery in charging_batteries:
-            # calculate amount of timestamps needed and ceil
-            timesteps = charging_battery.remaining_timesteps(
-                self.charging_constraints[:, i:]
-            )
+        return self.apply_constraints(charging_constraints)
 
-            if timesteps < 0:
-                self.optimized_schedule[0, i:] = charging_battery.id
-                i = self.optimized_schedule.shape[1]
-                break
-            else:
-                self.optimized_schedule[0, i:i + timesteps] = charging_battery.id
-            i += timesteps
-        if i < self.optimized_schedule.shape[1]:
-            for waiting_battery in waiting_batteries:
-                timesteps = waiting_battery.remaining_timesteps(
-                    self.charging_constraints[:, i:])
-                # calculate amount of timestamps needed and ceil
-                if timesteps < 0:
-                    self.optimized_schedule[0, i:] = waiting_battery.id
-                    i = self.optimized_schedule.shape[1]
-                    break
-                else:
-                    self.optimized_schedule[0, i:i + timesteps] = waiting_battery.id
-                i += timesteps
+    def apply_constraints(self, charging_constraints) -> bool:
+        """
+        Fills the schedule for new constraints, keeping the charger assignment of the last update_schedule call.
+        Returns whether the schedule meets the demand estimation.
+        """
+        self.charging_constraints = charging_constraints
+        self.optimized_schedule, self.power_factor = self.fill_limited_schedule(
+            self.assignment,
+            self.charging_constraints,
+            self.power_limit
+        )
+        self.version += 1
 
         # check conformance with demand estimation
-        swapped_battery_events = np.insert(np.diff(self.optimized_schedule[0]), 0, 0)
-        swapped_battery_sum = np.cumsum(swapped_battery_events != 0)
-        return np.all(demand_estimation <= swapped_battery_sum)
+        swapped_battery_sum = np.cumsum(swapped_battery_events(self.optimized_schedule))
+        return np.all(self.demand_estimation <= swapped_battery_sum)
 
-    def make_unoptimized_schedule(self,
-                                  waiting_batteries: WaitingBatteries,
-                                  charging_batteries: ChargingBatteries,
-                                  finished_batteries: FinishedBatteries) -> bool:
+    @staticmethod
+    def fill_limited_schedule(charger_batteries: List[List[Battery]],
+                              charging_constraints: np.ndarray,
+                              power_limit: Optional[np.ndarray]):
+        """
+        Fills the schedule while lowering the charging power of concurrently charging batteries to stay
+        below the power limit. Lower power extends the charging of batteries, which changes which batteries
+        charge concurrently, so the schedule is filled until the power factor settles.
+        Returns the schedule and the share of the maximum power batteries are charged with in each slot.
+        """
+        schedule = fill_schedule(charger_batteries, charging_constraints)
+        power_factor = np.ones(charging_constraints.shape[1])
+        if power_limit is None:
+            return schedule, power_factor
+
+        batteries = [battery for batteries in charger_batteries for battery in batteries]
+        for _ in range(config.power_limit_iterations):
+            next_power_factor = site_power_factor(schedule, charging_constraints, batteries, power_limit)
+            if np.allclose(next_power_factor, power_factor):
+                break
+            power_factor = next_power_factor
+            schedule = fill_schedule(charger_batteries, charging_constraints, power_factor)
+        return schedule, site_power_factor(schedule, charging_constraints, batteries, power_limit)
 
-        unoptimized_schedule: np.ndarray = np.ones(self.optimized_schedule.shape, int) * -1
-        charging_constraints = np.zeros((1, config.slot_count), dtype=bool)
-        assert np.all(unoptimized_schedule.shape == charging_constraints.shape)
+    def charger_demand(self, demand_estimation) -> List[np.ndarray]:
+        """
+        Splits the demand estimation into the demand each charger has to meet with the charger assignment
+        of the last update_schedule call. The k-th demanded battery is the k-th battery finished on any charger.
+        """
+        chargers, slots = self.charging_constraints.shape
+        if chargers == 1:
+            return [demand_estimation]
 
-        # charge batteries with the highest SoC first
-        waiting_batteries.sort(key=lambda battery: battery.soc, reverse=True)
-        i = 0
+        demand = np.maximum.accumulate(np.asarray(demand_estimation))
+        demanded = max(int(np.ceil(demand[-1])), 0) if len(demand) else 0
+        deadlines = np.searchsorted(demand, np.arange(1, demanded + 1), side='left')
 
-        for charging_battery in charging_batteries:
-            # calculate amount of timestamps needed and ceil
-            timesteps = charging_battery.remaining_timesteps(
-                charging_constraints[:, i:]
+        finish = [finish_indices(batteries, self.charging_constraints[charger:charger + 1])
+                  for charger, batteries in enumerate(self.assignment)]
+        finish_charger = np.concatenate([np.full(len(f), charger) for charger, f in enumerate(finish)])
+        finish = np.concatenate(finish)
+        finished = (finish >= 0) & (finish < slots)
+        order = np.argsort(finish[finished], kind='stable')
+
+        # batteries serving the demand in the order they are finished
+        serving_charger = finish_charger[finished][order][:demanded]
+        deadlines = deadlines[:len(serving_charger)]
+
+        charger_demand = []
+        for charger in range(chargers):
+            charger_deadlines = deadlines[serving_charger == charger]
+            charger_demand.append(np.searchsorted(charger_deadlines, np.arange(slots), side='right'))
+        return charger_demand
+
+    def feasibility_engines(self, demand_estimation, charging_constraints) -> List[FeasibilityEngine]:
+        """
+        Creates an incremental feasibility engine per charger for the charger assignment of the last
+        update_schedule call. Slots blocked through the engines are written to charging_constraints in place.
+        """
+        return [
+            FeasibilityEngine(required_timesteps(batteries), demand, charging_constraints[charger])
+            for charger, (batteries, demand) in enumerate(zip(self.assignment, self.charger_demand(demand_estimation)))
+        ]
+
+    def optimal_constraints(self, demand_estimation, price_profile: np.ndarray):
+        """
+        Calculates the cost-optimal charging constraints for the charger assignment of the last update_schedule call.
+        Returns None if the demand cannot be met.
+        """
+        charging_constraints = np.ones(self.optimized_schedule.shape, dtype=bool)
+        for charger, (batteries, demand) in enumerate(zip(self.assignment, self.charger_demand(demand_estimation))):
+            charger_constraints = min_cost_constraints(
+                required_timesteps(batteries),
+                [battery.max_power for battery in batteries],
+                demand,
+                price_profile
             )
+            if charger_constraints is None:
+                return None
+            charging_constraints[charger] = charger_constraints
+        return charging_constraints
 
-            if timesteps < 0:
-                unoptimized_schedule[0, i:] = charging_battery.id
-                i = unoptimized_schedule.shape[1]
-                break
-            else:
-                unoptimized_schedule[0, i:i + timesteps] = charging_battery.id
-            i += timesteps
-        if i < unoptimized_schedule.shape[1]:
-            for waiting_battery in waiting_batteries:
-                timesteps = waiting_battery.remaining_timesteps(
-                    charging_constraints[:, i:])
-                # calculate amount of timestamps needed and ceil
-                if timesteps < 0:
-                    unoptimized_schedule[0, i:] = waiting_battery.id
-                    i = unoptimized_schedule.shape[1]
-                    break
-                else:
-                    unoptimized_schedule[0, i:i + timesteps] = waiting_battery.id
-                i += timesteps
+    def shift(self, slots: int):
+        """
+        Moves the optimized schedule forward by the given number of slots. If the batteries were charged as
+        planned, the shifted schedule is the one update_schedule would calculate with the shifted constraints.
+        """
+        self.optimized_schedule = shift_slots(self.optimized_schedule, slots, -1)
+        self.charging_constraints = shift_slots(self.charging_constraints, slots, False)
+        self.power_factor = shift_slots(self.power_factor, slots, 1.0)
+        self.version += 1
+
+    def make_unoptimized_schedule(self,
+                                  waiting_batteries: WaitingBatteries,
+                                  charging_batteries: ChargingBatteries,
+                                  finished_batteries: FinishedBatteries,
+                                  power_limit: Optional[np.ndarray] = None,
+                                  key=None) -> bool:
+        """
+        key - state the schedule is made for, the schedule is only made again if the key changed
+        """
+        if key is not None and key == self.unoptimized_key:
+            return True
 
-        self.unoptimized_schedule = unoptimized_schedule
+        charging_constraints = np.zeros(self.optimized_schedule.shape, dtype=bool)
+
+        # charge batteries with the highest SoC first, the list of the caller is not changed
+        waiting_batteries = sorted(waiting_batteries, key=lambda battery: battery.soc, reverse=True)
+        self.unoptimized_schedule, self.unoptimized_power_factor = self.fill_limited_schedule(
+            assign_chargers(charging_batteries, waiting_batteries, charging_constraints),
+            charging_constraints,
+            power_limit
+        )
+        self.unoptimized_version += 1
+        self.unoptimized_key = key
         return True
 
+    def cached_load_curve(self, optimized: bool) -> Optional[np.ndarray]:
+        """
+        Returns the load curve of the current version of the schedule if it was calculated already, otherwise None.
+        """
+        version = self.version if optimized else self.unoptimized_version
+        cached_version, load_curve = self.load_curves.get(optimized, (None, None))
+        return load_curve if cached_version == version else None
+
     def get_load_curve(self, batteries: List[Battery], optimized: bool):
-        load_curve = np.zeros(self.optimized_schedule.shape)
+        """
+        Returns the load of each charger in each slot in W, cached per schedule version.
+        """
+        load_curve = self.cached_load_curve(optimized)
+        if load_curve is not None:
+            return load_curve
+
         if optimized:
             schedule = self.optimized_schedule
+            power_factor = self.power_factor
+            version = self.version
         else:
             schedule = self.unoptimized_schedule
+            power_factor = self.unoptimized_power_factor
+            version = self.unoptimized_version
 
-        for i in range(schedule.shape[1]):
-            if (optimized and self.charging_constraints[0][i]) or schedule[0][i] == -1:
-                load_curve[0][i] = 0
-            else:
-                battery_id = schedule[0][i]
-                charging_battery = next((battery for battery in batteries if battery.id == battery_id), None)
-                load_curve[0][i] = charging_battery.actual_power
-
+        load_curve = max_power_by_id(batteries, schedule)[schedule] * power_factor
+        if optimized:
+            load_curve[self.charging_constraints] = 0
+        load_curve.setflags(write=False)
+        self.load_curves[optimized] = (version, load_curve)
         return load_curve
 
     def format_schedule(self) -> str:
         schedule_strs = []
         for charger_idx, charger in enumerate(self.optimized_schedule):
-            i = 0
+            battery_ids, lengths = run_lengths(charger)
+            ends = np.cumsum(lengths)
             charger_strs = []
-            while i < len(charger):
-                battery_id = charger[i]
+            for battery_id, start, end in zip(battery_ids, ends - lengths, ends):
                 if battery_id == -1:
                     break
-                start = i
-                while i < len(charger) and charger[i] == battery_id:
-                    i += 1
-                end = i - 1
-                charger_strs.append(f"(B {battery_id}: {start}-{end})")
+                charger_strs.append(f"(B {battery_id}: {start}-{end - 1})")
             if charger_strs:
                 schedule_strs.append(
                     f"C {charger_idx} -> " + ', '.join(charger_strs))
@@ -1,21 +1,29 @@
-import json
-from typing import Callable, List
-from threading import Lock
-from time import time, sleep
-
-import requests
+import asyncio
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+from threading import Event, Lock
+from time import time
 
 from drone.battery import Battery
+from drone.compact import CompactSnapshot
+from drone.confidence_estimator import ConfidenceEstimator
+from drone.demand import DemandModel
+from drone.fleet import BatteryState, Fleet, FleetBattery
+from drone.metrics import SimulationMetrics, TimedLock
 import drone.config as config
 from datetime import datetime, timedelta
-import copy
+import json
 
 import numpy as np
 
 import logging
-from drone.schedule import Schedule
+from drone.notifier import ExchangeNotifier
+from drone.persistence import StateStore, request_state
+from drone.schedule import Schedule, swapped_battery_events
+from drone.snapshot import SimulationSnapshot, read_only
 
 logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger(__name__ + '.trace')
 
 
 def convert_price_profile(profile) -> np.ndarray:
@@ -27,238 +35,332 @@ def convert_price_profile(profile) -> np.ndarray:
     Returns:
         np.ndarray: price profile in simulation resolution
     """
-    price_profile_array = np.zeros(config.slot_count, dtype=float)
+    return convert_profile(profile.price, profile.resolution_s)
 
-    profile_time_span_s = profile.resolution_s
-    slot_time_span_s = config.resolution
 
-    profile_index = 0
-    profile_end = (profile_index + 1) * profile_time_span_s
+def convert_profile(values: List[float], resolution_s: float) -> np.ndarray:
+    """converts list of values with certain resolution to simulation resolution
 
-    for slot in range(config.slot_count):
-        slot_start = slot * slot_time_span_s
-        slot_end = (slot + 1) * slot_time_span_s
+    The profile is repeated until it covers all simulation slots and cut off after the last slot.
+    Each slot gets the time-weighted average of the profile within the slot, which is calculated
+    from the cumulative integral of the profile.
 
-        # if outside of price profile skip:
-        while slot_start > profile_end:
-            profile_index += 1
-            # profile_start = profile_index*profile_time_span_ms 
-            profile_end = (profile_index + 1) * profile_time_span_s
+    Args:
+        values (List[float]): profile values
+        resolution_s (float): resolution of the profile in seconds
 
-        # now slot_start < profile end
-        if profile_index >= len(profile.price):
-            break
+    Returns:
+        np.ndarray: profile in simulation resolution
+    """
+    horizon_s = config.slot_count * config.resolution
+    value_count = int(np.ceil(horizon_s / resolution_s))
+    values = np.resize(np.asarray(values[:value_count], dtype=float), value_count)
+    if resolution_s % config.resolution == 0:
+        # each value covers whole slots, the slots take the value without rounding errors of the integral
+        return np.repeat(values, resolution_s // config.resolution)[:config.slot_count]
 
-        if slot_end < profile_end:
-            # if inside of price profile slot
-            price = profile.price[profile_index]
-        else:
-            # if partly in price profile
-            price = 0
-            slot_curr = slot_start
-            while profile_end < slot_end:
-                if profile_index >= len(profile.price):
-                    break
-                price += (profile_end - slot_curr) / (slot_end - slot_start) * profile.price[profile_index]
-                slot_curr = profile_end
-                profile_index += 1
-                profile_end = (profile_index + 1) * profile_time_span_s
-            if profile_index >= len(profile.price):
-                break
-            price += (slot_end - slot_curr) / (slot_end - slot_start) * profile.price[profile_index]
-        price_profile_array[slot] = price
-    return price_profile_array
+    profile_edges = np.arange(len(values) + 1) * resolution_s
+    integral = np.concatenate([[0], np.cumsum(values * resolution_s)])
+    slot_edges = np.arange(config.slot_count + 1) * config.resolution
+    return np.diff(np.interp(slot_edges, profile_edges, integral)) / config.resolution
+
+
+def seconds_since_midnight(current_time) -> int:
+    current_datetime = datetime.fromtimestamp(current_time)
+    return (current_datetime.hour * 3600) + (current_datetime.minute * 60) + current_datetime.second
 
 
 class Simulation:
 
-    def __init__(self, time_factor=config.simulation_time_factor, charger_count: int = 1):
+    def __init__(self, time_factor=config.simulation_time_factor, charger_count: int = config.charger_count,
+                 scheduler: str = config.scheduler):
         self.current_time = None
         self.time_factor = time_factor
+        self.scheduler = scheduler
 
-        self.waiting_batteries: List[Battery] = []
-        self.charging_batteries: List[Battery] = []
-        self.finished_batteries: List[Battery] = []
+        self.fleet = Fleet()
 
         self.battery_requests = {}
         self.exchange_requests = {}
         self.charger_count = charger_count
 
-        self.lock = Lock()
+        self.metrics = SimulationMetrics()
+        # the lock only guards short changes of the state, the optimizer runs on copies outside of it
+        self.lock = TimedLock(self.metrics.lock_wait_seconds, self.metrics.lock_hold_seconds)
+        self.replan_requested = Event()
+        self.stopped = Event()
+        self.epoch = 0  # increased when the state is reset, plans of an older epoch are discarded
+        self.plan_complete = False  # whether the optimizer finished the last plan within its time budget
+        self.slots_since_replan = 0
         self.id_counter = 0
 
-        self.constraints = np.zeros((1, config.slot_count), dtype=bool)
-        self.demand_event_list = [i * 60 * 60 for i in range(24)]
+        self.constraints = np.zeros((charger_count, config.slot_count), dtype=bool)
+        self.demand_model = DemandModel.daily()
         self.price_profile = np.zeros(config.slot_count, dtype=float)
-
-        self.schedule = Schedule()
+        self.power_limit = np.full(config.slot_count, np.inf)  # grid connection limit of the station in W
+
+        self.schedule = Schedule(mode=scheduler, chargers=charger_count)
+        # created again on first use after the simulation was closed
+        self.notifier = ExchangeNotifier()
+        self.notifier_lock = Lock()
+        for name, kind, help in [('pending', 'gauge', 'Exchange notifications waiting for delivery.'),
+                                 ('delivered', 'counter', 'Delivered exchange notifications.'),
+                                 ('failed', 'counter', 'Exchange notifications not delivered after all retries.'),
+                                 ('retried', 'counter', 'Retries of exchange notifications.')]:
+            self.metrics.registry.function(f'exchange_notifications_{name}', help,
+                                           lambda name=name: self.notifier.get_metrics()[name], kind)
+        # created on first use, as the historical prices take a moment to load
+        self.estimator: Optional[ConfidenceEstimator] = None
+        self.estimator_lock = Lock()
+        self.confidence = None  # snapshot version and confidence estimation of its schedule
+        self.snapshot: Optional[SimulationSnapshot] = None
+        self.compact: Optional[CompactSnapshot] = None
+        self.cost_curves = {}  # schedule, version and price profile of the cached cost curves
+        # called with every published snapshot on the thread of the simulation, must not block
+        self.listeners: List[Callable[[SimulationSnapshot], None]] = []
+        self.store: Optional[StateStore] = None  # write-ahead log and snapshots of the state, if durable
+        self.publish_snapshot()
 
     def restart(self, start_time):
-        with self.lock:
+        with self.changing():
+            self.log('restart', {'start_time': start_time})
             self.current_time = start_time
-            self.waiting_batteries.clear()
-            self.charging_batteries.clear()
-            self.finished_batteries.clear()
+            self.fleet = Fleet()
             self.battery_requests.clear()
             self.exchange_requests.clear()
-            self.constraints = np.zeros((1, config.slot_count), dtype=bool)
-            self.demand_event_list = [i * 60 * 60 for i in range(24)]
+            self.constraints = np.zeros((self.charger_count, config.slot_count), dtype=bool)
+            self.demand_model = DemandModel.daily()
             self.price_profile = np.zeros(config.slot_count, dtype=float)
-            self.schedule = Schedule()
+            self.power_limit = np.full(config.slot_count, np.inf)
+            self.schedule = Schedule(mode=self.scheduler, chargers=self.charger_count)
             self.id_counter = 0
+            self.epoch += 1
+        self.request_replan()
+
+    @contextmanager
+    def changing(self):
+        """
+        Holds the lock for a logged change, the log is written after the lock is released.
+        """
+        with self.lock:
+            yield
+        if self.store is not None:
+            self.store.commit()
+
+    def log(self, operation: str, args):
+        """
+        Logs a change of the state to the store, to be called within the lock of changing.
+        """
+        if self.store is not None:
+            self.store.append(operation, args, self.current_time)
+
+    def request_replan(self):
+        """
+        Asks the simulation loop to replan as soon as possible, without waiting for the optimizer.
+        Requests are coalesced, a burst of changes is planned once.
+        """
+        self.replan_requested.set()
+
+    @property
+    def waiting_batteries(self) -> List[FleetBattery]:
+        return self.fleet.batteries(BatteryState.WAITING)
+
+    @property
+    def charging_batteries(self) -> List[FleetBattery]:
+        return self.fleet.batteries(BatteryState.CHARGING)
+
+    @property
+    def finished_batteries(self) -> List[FleetBattery]:
+        return self.fleet.batteries(BatteryState.FINISHED)
+
+    def serialize_batteries(self) -> dict:
+        return self.fleet.serialize_states()
 
     def get_batteries(self):
-        with self.lock:
-            batteries = {
-                'waiting_batteries': [],
-                'finished_batteries': [],
-                'charging_batteries': []
-            }
-            for battery in self.waiting_batteries:
-                batteries['waiting_batteries'].append({
-                    'battery_id': battery.id,
-                    'soc': battery.soc,
-                    'capacity': battery.capacity,
-                    'max_power': battery.max_power,
-                }
-                )
-            for battery in self.charging_batteries:
-                batteries['charging_batteries'].append({
-                    'battery_id': battery.id,
-                    'soc': battery.soc,
-                    'capacity': battery.capacity,
-                    'max_power': battery.max_power,
-                }
-                )
-            for battery in self.finished_batteries:
-                batteries['finished_batteries'].append({
-                    'battery_id': battery.id,
-                    'soc': battery.soc,
-                    'capacity': battery.capacity,
-                    'max_power': battery.max_power,
-                }
-                )
-        return batteries
+        return self.snapshot.batteries
 
     def get_schedules(self):
-        return self.schedule.optimized_schedule
+        return self.snapshot.schedules
 
     def set_demand(self, demand):
-        self.demand_event_list = demand.demand
-        latest_event = max(self.demand_event_list)
-        if latest_event < 86400:
-            self.demand_event_list = self.demand_event_list + [event + 86400 for event in self.demand_event_list]
-        self.demand_event_list.sort()
-        self.create_optimized_schedule(self.current_time, 0)
+        demand_model = DemandModel(demand.demand)
+        with self.changing():
+            self.log('set_demand', {'demand': [int(event) for event in demand.demand]})
+            self.demand_model = demand_model
+        self.request_replan()
 
     def set_price_profile(self, price_profile):
-        with self.lock:
-            while len(price_profile.price) < config.slot_count * config.resolution / price_profile.resolution_s:
-                price_profile.price = price_profile.price + price_profile.price
-            if len(price_profile.price) > config.slot_count * config.resolution / price_profile.resolution_s:
-                price_profile.price = price_profile.price[
-                                      :int(config.slot_count * config.resolution / price_profile.resolution_s)]
-            price_profile = convert_price_profile(price_profile)
+        args = {'price': list(price_profile.price), 'resolution_s': price_profile.resolution_s}
+        price_profile = convert_price_profile(price_profile)
+        with self.changing():
+            self.log('set_price_profile', args)
             self.price_profile = price_profile
-        self.create_optimized_schedule(self.current_time, 0)
+        self.request_replan()
 
     def get_price_profile(self):
-        return self.price_profile
+        return self.snapshot.price_profile
+
+    def set_power_limit(self, power_limit):
+        args = {'power_watt': list(power_limit.power_watt), 'resolution_s': power_limit.resolution_s}
+        power_limit = convert_profile(power_limit.power_watt, power_limit.resolution_s)
+        with self.changing():
+            self.log('set_power_limit', args)
+            self.power_limit = power_limit
+        self.request_replan()
+
+    def current_power_limit(self, time_index: int) -> Optional[np.ndarray]:
+        """
+        Returns the power limit starting at the given slot since midnight, None if the station has no limit.
+        """
+        power_limit = self.power_limit
+        if np.all(np.isinf(power_limit)):
+            return None
+        return np.concatenate([power_limit[time_index:], power_limit[:time_index]])
 
     def check_request(self, charge_request: any):
-        return len(self.finished_batteries) > 0
+        return self.fleet.count(BatteryState.FINISHED) > 0
 
     def take_battery(self):
-        with self.lock:
-            if self.finished_batteries:
-                battery = self.finished_batteries.pop(0)
-                return True, battery
-            else:
+        with self.changing():
+            battery = self.fleet.pop(BatteryState.FINISHED)
+            if battery is None:
                 return False, None
+            self.log('take_battery', int(battery.id))
+        self.request_replan()
+        return True, battery
 
     def add_request(self, request):
-        with self.lock:
-            if self.finished_batteries:
-                battery = self.finished_batteries.pop(0)
-                self.battery_requests[request.drone_id] = {
-                    'charged_battery': battery,
-                    'new_battery': Battery(
-                        self.id_counter,
-                        request.state_of_charge,
-                        request.capacity_kwh,
-                        max_power=request.max_power_watt
-                    )
-                }
-                self.id_counter += 1
-                return True
-            else:
-                return False
+        return self.add_requests([request])[0]
+
+    def add_requests(self, requests) -> List[bool]:
+        """
+        Reserves a finished battery for each charge request, all requests are applied at once.
+        Returns whether each request was accepted, requests are declined once no finished battery is left.
+        """
+        accepted = []
+        with self.changing():
+            for request in requests:
+                battery = self.fleet.pop(BatteryState.FINISHED)
+                if battery is not None:
+                    self.battery_requests[request.drone_id] = {
+                        'charged_battery': battery,
+                        'new_battery': Battery(
+                            self.id_counter,
+                            request.state_of_charge,
+                            request.capacity_kwh,
+                            max_power=request.max_power_watt
+                        )
+                    }
+                    self.id_counter += 1
+                accepted.append(battery is not None)
+            if self.store is not None and any(accepted):
+                # the reserved batteries are logged, a restored request keeps its battery
+                self.log('add_requests', [dict(request_state(self.battery_requests[request.drone_id]),
+                                               drone_id=request.drone_id)
+                                          for request, success in zip(requests, accepted) if success])
+        if any(accepted):
+            self.request_replan()
+        return accepted
 
     def clear_batteries(self):
-        with self.lock:
-            self.waiting_batteries.clear()
-            self.charging_batteries.clear()
-            self.finished_batteries.clear()
+        with self.changing():
+            self.log('clear_batteries', None)
+            self.fleet = Fleet()
             self.battery_requests.clear()
-
-    def add_battery(self, battery: Battery):
-        with self.lock:
-            self.waiting_batteries.append(battery)
-            self.create_optimized_schedule(self.current_time, 0)
+            self.epoch += 1
+        self.request_replan()
 
     def create_battery(self, battery):
-        with self.lock:
-            new_battery = Battery(
-                id=self.id_counter,
-                soc=battery.state_of_charge,
-                capacity=battery.capacity_kwh,
-                max_power=battery.max_power_watt
-            )
-            self.id_counter += 1
-            if battery.state_of_charge == 1:
-                self.finished_batteries.append(new_battery)
-            else:
-                self.waiting_batteries.append(new_battery)
-            return new_battery
+        return self.create_batteries([battery])[0]
+
+    def create_batteries(self, batteries) -> List[FleetBattery]:
+        """
+        Adds new batteries to the station, all batteries are added at once and planned together.
+        """
+        new_batteries = []
+        with self.changing():
+            self.log('create_batteries', [{'state_of_charge': battery.state_of_charge,
+                                           'capacity_kwh': battery.capacity_kwh,
+                                           'max_power_watt': battery.max_power_watt} for battery in batteries])
+            for battery in batteries:
+                new_battery = Battery(
+                    id=self.id_counter,
+                    soc=battery.state_of_charge,
+                    capacity=battery.capacity_kwh,
+                    max_power=battery.max_power_watt
+                )
+                self.id_counter += 1
+                if battery.state_of_charge == 1:
+                    new_batteries.append(self.fleet.add(new_battery, BatteryState.FINISHED))
+                else:
+                    new_batteries.append(self.fleet.add(new_battery, BatteryState.WAITING))
+        self.request_replan()
+        return new_batteries
 
     def exchange_battery(self, exchange_request):
-        request = self.battery_requests.pop(exchange_request.drone_id)
-        request['new_battery'].soc = exchange_request.state_of_charge
-        request['response_uri'] = exchange_request.response_uri
-        self.exchange_requests[exchange_request.drone_id] = request
-        return True
+        return self.exchange_batteries([exchange_request])[0]
+
+    def exchange_batteries(self, exchange_requests) -> List[bool]:
+        """
+        Starts the battery exchanges of landed drones, all exchanges are applied at once.
+        Returns whether each drone had an accepted charge request.
+        """
+        started = []
+        with self.changing():
+            self.log('exchange_batteries', [{'drone_id': request.drone_id,
+                                             'state_of_charge': request.state_of_charge,
+                                             'response_uri': request.response_uri} for request in exchange_requests])
+            for exchange_request in exchange_requests:
+                request = self.battery_requests.pop(exchange_request.drone_id, None)
+                if request is not None:
+                    request['new_battery'].soc = exchange_request.state_of_charge
+                    request['response_uri'] = exchange_request.response_uri
+                    self.exchange_requests[exchange_request.drone_id] = request
+                started.append(request is not None)
+        return started
 
     def exchange_completed(self, drone_id):
-        with self.lock:
-            request = self.exchange_requests.pop(drone_id)
-            print(request)
-            new_battery = request['new_battery']
-            self.waiting_batteries.append(new_battery)
-            self.create_optimized_schedule(self.current_time, 0)
-            new_battery_for_drone = request['charged_battery']
-
-            response_uri = "https://bexstream-preprod.beyond-vision.pt/api/v1/elevation/batteryExchanged"
-
-            message = {
-                "assetId": drone_id
-                # "success": True,
-                # "drone_id": drone_id,
-                # "soc": new_battery_for_drone.soc,
-                # "capacity": new_battery_for_drone.capacity,
-                # "max_power": new_battery_for_drone.max_power,
-                # "message": "battery exchange completed"
-            }
-            json_message = json.dumps(message)
-
-            # Send the message to the specified REST interface
-            try:
-                response = requests.post(response_uri, data=json_message, headers={'Content-Type': 'application/json'})
-                response.raise_for_status()  # Raise an exception for HTTP errors
-                return True
-            except requests.exceptions.RequestException as e:
-                # Handle the exception (e.g., log the error)
-                print(f"Error sending message to {response_uri}: {e}")
-                return False
+        return self.exchanges_completed([drone_id])[0]
+
+    def exchanges_completed(self, drone_ids, notify: bool = True) -> List[bool]:
+        """
+        Adds the batteries of completed exchanges to the station, all exchanges are applied at once.
+        Returns whether each drone had an exchange in progress.
+        notify - whether the drones are notified of the completed exchanges
+        """
+        drone_ids = list(drone_ids)
+        requests = []
+        with self.changing():
+            self.log('exchanges_completed', drone_ids)
+            for drone_id in drone_ids:
+                request = self.exchange_requests.pop(drone_id, None)
+                if request is not None:
+                    logger.debug(request)
+                    self.fleet.add(request['new_battery'], BatteryState.WAITING)
+                requests.append(request)
+        if any(request is not None for request in requests):
+            self.request_replan()
+
+        # Send the messages to the REST interface of the requests in the background
+        for drone_id, request in zip(drone_ids, requests):
+            if notify and request is not None:
+                self.exchange_notifier().notify(drone_id, request.get('response_uri'))
+        return [request is not None for request in requests]
+
+    def exchange_notifier(self) -> ExchangeNotifier:
+        """
+        Returns the notifier of the exchanges, a closed notifier is replaced by a new one.
+        """
+        with self.notifier_lock:
+            if self.notifier.closed:
+                self.notifier = ExchangeNotifier()
+            return self.notifier
+
+    def current_time_index(self) -> int:
+        """
+        Returns the slot of the current time since midnight.
+        """
+        return int(seconds_since_midnight(self.current_time) / config.resolution)
 
     def create_optimized_schedule(self, current_time, time_budget):
         # check the most expensive unblocked timeslot and block it until no schedule is feasible
@@ -267,134 +369,265 @@ class Simulation:
         time_budget *= 0.9
         tik = time()
 
-        demand_array = np.zeros(config.slot_count)
-        current_datetime = datetime.fromtimestamp(current_time)
-        seconds_since_midnight = (current_datetime.hour * 3600) + (
-                current_datetime.minute * 60) + current_datetime.second
-
-        # create entire demand_array
-        demand_list = copy.copy(self.demand_event_list)
-
-        days = int(config.slot_count / config.resolution / 24)
-        for i in range(1, days):
-            demand_list += [event + i * 24 * 60 * 60 for event in demand_list]
-
-        # break demand_list at current time, append at the end
-        demand_list = [demand - seconds_since_midnight for demand in self.demand_event_list if
-                       demand >= seconds_since_midnight] + \
-                      [demand - seconds_since_midnight + days * 24 * 60 * 60 for demand in self.demand_event_list if
-                       demand < seconds_since_midnight]
-
-        for demand in demand_list[:self.total_batteries()]:
-            demand_slot_index = int(demand / config.resolution)
-            if demand_slot_index < config.slot_count:
-                demand_array[demand_slot_index] += 1
-
-        curr_time_index = int(seconds_since_midnight / config.resolution)
-        demand_array = np.array(np.cumsum(demand_array) - len(self.battery_requests) - len(self.finished_batteries))
-        price_profile = np.concatenate([self.price_profile[curr_time_index:], self.price_profile[:curr_time_index]])
-
-        works = self.schedule.update_schedule(
-            self.waiting_batteries,
-            self.charging_batteries,
-            self.finished_batteries,
+        # copy the inputs, the optimizer works on the copies without holding the lock
+        with self.lock:
+            epoch = self.epoch
+            schedule = self.schedule
+            waiting_batteries = list(self.waiting_batteries)
+            charging_batteries = list(self.charging_batteries)
+            finished_batteries = list(self.finished_batteries)
+            constraints = self.constraints.copy()
+            demand_model = self.demand_model
+            price_profile = self.price_profile
+            pending_batteries = len(self.battery_requests) + len(finished_batteries)
+            total_batteries = self.total_batteries()
+            self.slots_since_replan = 0
+
+        seconds = seconds_since_midnight(current_time)
+        curr_time_index = int(seconds / config.resolution)
+        demand_array = demand_model.demand_array(seconds, total_batteries) - pending_batteries
+        price_profile = np.concatenate([price_profile[curr_time_index:], price_profile[:curr_time_index]])
+        power_limit = self.current_power_limit(curr_time_index)
+
+        self.metrics.feasibility_checks.inc()
+        works = schedule.update_schedule(
+            waiting_batteries,
+            charging_batteries,
+            finished_batteries,
             demand_array,
-            self.constraints
+            constraints,
+            power_limit
         )
 
         if not works:
-            self.constraints[:, :] = False
-            works = self.schedule.update_schedule(
-                self.waiting_batteries,
-                self.charging_batteries,
-                self.finished_batteries,
+            constraints[:, :] = False
+            self.metrics.feasibility_checks.inc()
+            works = schedule.update_schedule(
+                waiting_batteries,
+                charging_batteries,
+                finished_batteries,
                 demand_array,
-                self.constraints
+                constraints,
+                power_limit
             )
             if not works:
                 logger.warning('cannot generate a feasible schedule')
+                self.commit_constraints(epoch, constraints, complete=False)
                 return False
 
-        # Optimize as long as possible:
-        sorted_indices = sorted(range(len(price_profile)), key=price_profile.__getitem__)
+        complete = True
+        if schedule.mode == 'optimal':
+            # cost-optimal constraints in bounded time
+            optimal_constraints = schedule.optimal_constraints(demand_array, price_profile)
+            if optimal_constraints is not None:
+                constraints = optimal_constraints
+        else:
+            # Optimize as long as possible, blocking the most expensive slots first:
+            engines = schedule.feasibility_engines(demand_array, constraints)
+            sorted_indices = np.argsort(-price_profile, kind='stable')
+
+            idx = 0
+            while time() - tik < time_budget and idx < len(sorted_indices):
+                for engine in engines:
+                    engine.block(sorted_indices[idx])
+                idx += 1
+            complete = idx == len(sorted_indices)
+            self.metrics.feasibility_checks.inc(idx * len(engines))
+            self.metrics.optimizer_iterations.inc(idx)
+            self.metrics.optimizer_slots.inc(len(sorted_indices))
+            self.metrics.optimizer_progress.set(idx / max(len(sorted_indices), 1))
+
+        self.metrics.feasibility_checks.inc()
+        if not schedule.apply_constraints(constraints):
+            # the optimizers plan with full charging power, with the power lowered to the power limit
+            # unblock the least expensive blocked slots until the schedule is feasible
+            blocked = constraints.copy()
+            blocked_slots = np.flatnonzero(np.any(blocked, axis=0))
+            blocked_slots = blocked_slots[np.argsort(price_profile[blocked_slots], kind='stable')]
+            low, high = 0, len(blocked_slots)
+            while low < high:
+                middle = (low + high) // 2
+                constraints = blocked.copy()
+                constraints[:, blocked_slots[:middle]] = False
+                self.metrics.feasibility_checks.inc()
+                if schedule.apply_constraints(constraints):
+                    high = middle
+                else:
+                    low = middle + 1
+            constraints = blocked
+            constraints[:, blocked_slots[:low]] = False
+            self.metrics.feasibility_checks.inc()
+            if not schedule.apply_constraints(constraints):
+                logger.warning('cannot generate a feasible schedule within the power limit')
+        self.commit_constraints(epoch, constraints, complete)
+        return True
 
-        idx = 0
-        while time() - tik < time_budget and idx < len(sorted_indices):
-            self.constraints[0, sorted_indices[idx]] = True
-            works = self.schedule.update_schedule(
-                self.waiting_batteries,
-                self.charging_batteries,
-                self.finished_batteries,
-                demand_array,
-                self.constraints
+    def commit_constraints(self, epoch: int, constraints: np.ndarray, complete: bool = True):
+        """
+        Takes over the constraints of a plan, unless the state was reset while planning.
+        complete - whether the plan was optimized until the end, an incomplete plan is optimized further next slot
+        """
+        with self.lock:
+            if epoch != self.epoch:
+                return
+            self.constraints = constraints
+            self.plan_complete = complete
+            # charge batteries with the highest SoC first, batteries added while planning are planned next time
+            self.fleet.sort(BatteryState.WAITING)
+            # the charger assignment is set again, as batteries added while planning may have moved the columns
+            self.fleet.charger[self.fleet.rows(BatteryState.WAITING)] = -1
+            for charger, batteries in enumerate(self.schedule.assignment):
+                for battery in batteries:
+                    battery.charger = charger
+
+    def replan(self, time_budget):
+        """
+        Optimizes the schedule within the time budget and publishes the result.
+        """
+        # changes requested from now on are not part of this plan and are planned again
+        self.replan_requested.clear()
+        tik = time()
+        self.create_optimized_schedule(self.current_time, time_budget)
+        self.metrics.replans.inc()
+        self.metrics.phase_seconds.observe(time() - tik, phase='optimize')
+        self.publish_snapshot()
+
+    def publish_snapshot(self):
+        """
+        Publishes an immutable snapshot of the simulation for the read paths.
+        Only the columns of the fleet and the references to the inputs are copied within the lock,
+        the batteries, schedules and curves are derived from the copies after releasing it.
+        """
+        tik = time()
+        with self.lock:
+            current_time = self.current_time
+            schedule = self.schedule
+            fleet = self.fleet.copy()
+            demand_model = self.demand_model
+            price_profile = self.price_profile
+            # plain dicts, so the requests are JSON-safe and comparable between snapshots
+            pending_charge_requests = {drone_id: request_state(request)
+                                       for drone_id, request in self.battery_requests.items()}
+            pending_exchange_requests = {drone_id: request_state(request)
+                                         for drone_id, request in self.exchange_requests.items()}
+
+        fleet_key = fleet.fingerprint(BatteryState.CHARGING, BatteryState.WAITING)
+
+        seconds = seconds_since_midnight(current_time) if current_time is not None else 0
+        curr_time_index = int(seconds / config.resolution)
+
+        # the batteries are only listed if the baseline or a load curve is calculated again
+        # the baseline only changes with the batteries and the power limit, not with every replanning
+        power_limit = self.current_power_limit(curr_time_index)
+        key = (fleet_key, power_limit.tobytes() if power_limit is not None else None)
+        if key != schedule.unoptimized_key:
+            schedule.make_unoptimized_schedule(fleet.batteries(BatteryState.WAITING),
+                                               fleet.batteries(BatteryState.CHARGING),
+                                               fleet.batteries(BatteryState.FINISHED),
+                                               power_limit,
+                                               key=key)
+
+        curves = {}
+        for name, optimized in [('optimized', True), ('unoptimized', False)]:
+            load_curve = schedule.cached_load_curve(optimized)
+            if load_curve is None:
+                load_curve = schedule.get_load_curve(fleet.batteries(BatteryState.CHARGING) +
+                                                     fleet.batteries(BatteryState.WAITING), optimized)
+            curves[f'{name}_schedule'] = read_only(schedule.optimized_schedule if optimized
+                                                   else schedule.unoptimized_schedule)
+            curves[f'{name}_load_curve'] = load_curve
+            curves[f'{name}_cost_curve'] = self.cached_cost_curve(schedule, optimized, load_curve, price_profile)
+        curves['price_profile'] = read_only(np.concatenate([price_profile[curr_time_index:],
+                                                            price_profile[:curr_time_index]]))
+        curves['waiting_battery_prognosis'] = read_only(self.prognose_waiting_batteries(
+            schedule.optimized_schedule, fleet.count(BatteryState.WAITING)))
+        curves['finished_battery_prognosis'] = read_only(self.prognose_finished_batteries(
+            schedule.optimized_schedule, fleet.count(BatteryState.FINISHED)))
+
+        self.snapshot = SimulationSnapshot(
+            version=self.snapshot.version + 1 if self.snapshot else 0,
+            current_time=current_time,
+            fleet=fleet,
+            schedules=curves['optimized_schedule'],
+            price_profile=read_only(price_profile),
+            rotated_price_profile=curves['price_profile'],
+            demand_events=demand_model.rotate(seconds).tolist(),
+            pending_charge_requests=pending_charge_requests,
+            pending_exchange_requests=pending_exchange_requests,
+            curves=curves
+        )
+        for listener in list(self.listeners):
+            listener(self.snapshot)
+        self.metrics.phase_seconds.observe(time() - tik, phase='publish')
+
+    def cached_cost_curve(self, schedule: Schedule, optimized: bool, load_curve: np.ndarray,
+                          price_profile: np.ndarray) -> np.ndarray:
+        """
+        Returns the read-only cost curve of a schedule, calculated once per schedule version and price profile.
+        """
+        version = schedule.version if optimized else schedule.unoptimized_version
+        cached = self.cost_curves.get(optimized)
+        if cached is None or cached[0] is not schedule or cached[1] != version or cached[2] is not price_profile:
+            cached = (schedule, version, price_profile, read_only(self.get_cost_curve(load_curve, price_profile)))
+            self.cost_curves[optimized] = cached
+        return cached[3]
+
+    def get_compact(self) -> CompactSnapshot:
+        """
+        Returns the compact encodings of the published snapshot, calculated once per snapshot.
+        """
+        snapshot = self.snapshot
+        compact = self.compact
+        if compact is None or compact.version != snapshot.version:
+            compact = CompactSnapshot(snapshot)
+            self.compact = compact
+        return compact
+
+    def get_confidence(self) -> dict:
+        """
+        Estimates the stockout probability and cost distribution of the published schedule,
+        calculated once per snapshot.
+        """
+        snapshot = self.snapshot
+        with self.estimator_lock:
+            if self.confidence is not None and self.confidence[0] == snapshot.version:
+                return self.confidence[1]
+            if self.estimator is None:
+                self.estimator = ConfidenceEstimator.from_csv()
+            seconds = seconds_since_midnight(snapshot.current_time) if snapshot.current_time is not None else 0
+            confidence = self.estimator.estimate(
+                supply=snapshot.curves['finished_battery_prognosis'],
+                load_curve=np.sum(snapshot.curves['optimized_load_curve'], axis=0),
+                demand_events=snapshot.demand_events,
+                price_profile=snapshot.rotated_price_profile,
+                hour=seconds // 3600
             )
-            if not works:
-                self.constraints[0, sorted_indices[idx]] = False
-                self.schedule.update_schedule(
-                    self.waiting_batteries,
-                    self.charging_batteries,
-                    self.finished_batteries,
-                    demand_array,
-                    self.constraints
-                )
-            idx += 1
-        return True
+            self.confidence = (snapshot.version, confidence)
+            return confidence
 
     def rest_get_optimized_schedule(self) -> dict:
-        # get baseline unoptimized schedule
-        optimized_schedule = self.schedule.optimized_schedule
-        charging_and_waiting_batteries = self.charging_batteries + self.waiting_batteries
-        load_curve = self.schedule.get_load_curve(batteries=charging_and_waiting_batteries, optimized=True)
-        cost_curve = self.get_cost_curve(load_curve)
-
-        rest_dict = {
-            "resolution_seconds": config.resolution,
-            "schedules": [optimized_schedule.tolist()],
-            "load_curve": load_curve.tolist(),
-            "cost_curve": cost_curve.tolist()
-        }
-        return rest_dict
+        return self.snapshot.optimized_schedule
 
     def rest_get_unoptimized_schedule(self) -> dict:
-        # get baseline unoptimized schedule
-        self.schedule.make_unoptimized_schedule(self.waiting_batteries,
-                                                self.charging_batteries,
-                                                self.finished_batteries)
-        unoptimized_schedule = self.schedule.unoptimized_schedule
-        charging_and_waiting_batteries = self.charging_batteries + self.waiting_batteries
-        load_curve = self.schedule.get_load_curve(batteries=charging_and_waiting_batteries, optimized=False)
-        cost_curve = self.get_cost_curve(load_curve)
-
-        rest_dict = {
-            "resolution_seconds": config.resolution,
-            "schedules": [unoptimized_schedule.tolist()],
-            "load_curve": load_curve.tolist(),
-            "cost_curve": cost_curve.tolist()
-        }
-        return rest_dict
+        return self.snapshot.unoptimized_schedule
 
     def total_batteries(self):
-        total_batteries = len(self.finished_batteries) + \
-                          len(self.waiting_batteries) + \
-                          len(self.charging_batteries) + \
-                          len(self.battery_requests)
+        total_batteries = len(self.fleet.handles) + len(self.battery_requests)
         return total_batteries
 
-    def prognose_waiting_batteries(self):
-        # Get the schedule
-        schedule = self.schedule.optimized_schedule
+    @staticmethod
+    def prognose_waiting_batteries(schedule: np.ndarray, waiting_battery_count: int):
+        # Initialize waiting_batteries_prognosis using the number of waiting batteries
+        waiting_batteries_prognosis = np.ones((1, schedule.shape[1]), int) * waiting_battery_count
 
-        # Initialize waiting_batteries_prognosis using the length of waiting_batteries
-        waiting_batteries_prognosis = np.ones(schedule.shape, int) * len(self.waiting_batteries)
+        # Calculate differences in schedule of each charger
+        schedule_diff = np.diff(schedule, axis=1)
 
-        # Calculate differences in schedule[0]
-        schedule_diff = np.diff(schedule[0])
+        # Find where a charger changes to another battery, not to -1
+        mask = np.logical_and(schedule_diff != 0, schedule[:, 1:] != -1)
 
-        # Find where schedule[0] changes to -1
-        mask = np.logical_and(schedule_diff != 0, schedule[0][1:] != -1)
-
-        # Count the number of events that meet the condition
-        swapped_battery_sum = np.cumsum(mask)
+        # Count the number of events that meet the condition on all chargers
+        swapped_battery_sum = np.cumsum(np.sum(mask, axis=0))
 
         # Insert 0 at the beginning of swapped_battery_sum
         swapped_battery_sum = np.insert(swapped_battery_sum, 0, 0)
@@ -404,66 +637,220 @@ class Simulation:
 
         return waiting_batteries_prognosis
 
-    def prognose_finished_batteries(self):
-        schedule = self.schedule.optimized_schedule
-
-        swapped_battery_events = np.insert(np.diff(schedule[0]), 0, 0)
-        swapped_battery_sum = np.cumsum(swapped_battery_events != 0)
-        finished_batteries_prognosis = swapped_battery_sum + len(self.finished_batteries)
+    @staticmethod
+    def prognose_finished_batteries(schedule: np.ndarray, finished_battery_count: int):
+        swapped_battery_sum = np.cumsum(swapped_battery_events(schedule))
+        finished_batteries_prognosis = swapped_battery_sum + finished_battery_count
         return finished_batteries_prognosis
 
-    def get_cost_curve(self, load_curve):
-        load_curve = load_curve.flatten()
-        price_profile_eur_per_wh = self.price_profile.flatten() / 1000000
+    def get_cost_curve(self, load_curve, price_profile: Optional[np.ndarray] = None):
+        # total load of all chargers
+        load_curve = np.sum(np.atleast_2d(load_curve), axis=0)
+        price_profile = self.price_profile if price_profile is None else price_profile
+        price_profile_eur_per_wh = price_profile.flatten() / 1000000
         assert np.all(price_profile_eur_per_wh.shape == load_curve.shape)
         resolution = config.resolution
         energy_curve_Wh = load_curve * (resolution / 3600)
         cost_curve = energy_curve_Wh * price_profile_eur_per_wh
         return cost_curve
 
+    def charging_factors(self, rows: np.ndarray, slots: int) -> np.ndarray:
+        """
+        Returns the share of its maximum power each charging battery is charged with in the next slots.
+        The share is 0 while the charger of the battery is blocked and lowered to share the power limit
+        of the station among all batteries charged at the same time.
+        """
+        active = ~self.constraints[self.fleet.charger[rows], :slots]
+        total_power = self.fleet.max_power[rows] @ active
+        power_limit = self.current_power_limit(self.current_time_index())
+        power_limit = power_limit[:slots] if power_limit is not None else np.inf
+        power_factor = np.minimum(1.0, np.divide(power_limit, total_power, out=np.ones(slots),
+                                                 where=total_power > 0))
+        return active * power_factor
+
+    def next_swap(self, slots: int) -> int:
+        """
+        Returns the number of slots until batteries are swapped next, at most slots.
+        """
+        with self.lock:
+            charging = self.fleet.rows(BatteryState.CHARGING)
+            if len(charging) < self.charger_count and self.fleet.count(BatteryState.WAITING):
+                # a free charger takes a waiting battery after the next slot
+                return 1
+            progress = np.cumsum(self.charging_factors(charging, slots), axis=1)
+            needed = np.maximum((1 - self.fleet.soc[charging]) / self.fleet.soc_delta[charging], 1e-9)
+            full = progress >= needed[:, None]
+            swap_slots = np.where(full.any(axis=1), np.argmax(full, axis=1) + 1, slots)
+            return int(np.min(swap_slots, initial=slots))
+
+    def advance(self, slots: int = 1) -> np.ndarray:
+        """
+        Charges the batteries for the given number of slots, then swaps fully charged batteries to finished
+        and waiting batteries to free chargers. Batteries are only swapped after the last slot,
+        use next_swap to advance until the next swap.
+        Returns the total charging load of the station in each slot in W.
+        """
+        with self.lock:
+            fleet = self.fleet
+            if fleet.removed() > max(len(fleet.handles), 64):
+                fleet.compact()
+
+            # share the power limit of the station among all charging batteries
+            charging = fleet.rows(BatteryState.CHARGING)
+            charging_factors = self.charging_factors(charging, slots)
+            load = fleet.max_power[charging] @ charging_factors
+
+            # swap fully charged batteries to finished
+            full = fleet.charge(charging, charging_factors.sum(axis=1))
+            fleet.set_state(charging[full], BatteryState.FINISHED)
+            fleet.charger[charging[full]] = -1
+
+            # swap waiting batteries to free chargers, following the charger assignment of the schedule
+            free_chargers = np.setdiff1d(np.arange(self.charger_count), fleet.charger[charging[~full]])
+            if len(free_chargers):
+                waiting = fleet.rows(BatteryState.WAITING)
+                for charger in free_chargers:
+                    candidates = np.flatnonzero(fleet.charger[waiting] == charger)
+                    if len(candidates) == 0:
+                        candidates = np.flatnonzero(fleet.charger[waiting] == -1)
+                    if len(candidates) == 0:
+                        continue
+                    row = waiting[candidates[0]]
+                    fleet.charger[row] = charger
+                    fleet.set_state(np.array([row]), BatteryState.CHARGING)
+                    waiting = np.delete(waiting, candidates[0])
+
+            self.constraints = np.roll(self.constraints, -slots, axis=1)
+            self.constraints[:, -slots:] = False
+            self.schedule.shift(slots)
+            self.slots_since_replan += slots
+        return load
+
+    def follows_schedule(self) -> bool:
+        """
+        Returns whether the batteries on the chargers are the ones the schedule planned for the current slot.
+        """
+        with self.lock:
+            charging = self.fleet.rows(BatteryState.CHARGING)
+            planned = self.schedule.optimized_schedule[:, 0]
+            actual = np.full(len(planned), -1)
+            actual[self.fleet.charger[charging]] = self.fleet.id[charging]
+            return np.array_equal(planned, actual)
+
+    def needs_replan(self) -> bool:
+        """
+        Returns whether the plan has to be optimized again. Without changes of the inputs, the shifted plan of
+        the last slot is still optimal, unless the batteries were not charged as planned.
+        """
+        return (self.replan_requested.is_set() or
+                not self.plan_complete or
+                self.slots_since_replan >= config.replan_interval_slots or
+                not self.follows_schedule())
+
+    def wait_for_changes(self, deadline: float):
+        """
+        Waits until no replanning was requested for config.replan_debounce_s, at most until the deadline.
+        """
+        while not self.stopped.is_set():
+            self.replan_requested.clear()
+            timeout = min(config.replan_debounce_s, deadline - time())
+            if timeout <= 0 or not self.replan_requested.wait(timeout):
+                return
+
+    def tick(self):
+        """
+        Charges the batteries for one slot and swaps batteries. The plan is only optimized again within the
+        remaining time of the slot if something changed, otherwise the shifted plan is published.
+        """
+        start = time()
+        self.advance()
+        advanced = time()
+        self.metrics.phase_seconds.observe(advanced - start, phase='advance')
+
+        replanned = self.needs_replan()
+        if replanned:
+            remaining = config.resolution / config.simulation_time_factor - (time() - start)
+            self.replan(remaining)
+        else:
+            self.metrics.shifted_ticks.inc()
+            self.publish_snapshot()
+        planned = time()
+
+        # Log the schedule, formatting it is skipped if it is not logged
+        if logger.isEnabledFor(logging.INFO):
+            formatted_schedule = \
+                f'Current time: {timedelta(seconds=self.current_time)}, ' + \
+                f'Waiting Batteries: {self.fleet.count(BatteryState.WAITING)}, ' + \
+                f'Finished Batteries: {self.fleet.count(BatteryState.FINISHED)}, ' + \
+                f'Requests: {len(self.battery_requests)} ' + self.schedule.format_schedule()
+            logger.info(formatted_schedule)
+        end = time()
+        self.metrics.phase_seconds.observe(end - planned, phase='log')
+        self.metrics.tick_seconds.observe(end - start)
+
+        if config.tick_trace:
+            trace_logger.info(json.dumps({
+                'current_time': self.current_time,
+                'tick_s': end - start,
+                'advance_s': advanced - start,
+                'plan_s': planned - advanced,
+                'log_s': end - planned,
+                'replanned': replanned,
+                'plan_complete': self.plan_complete,
+                'waiting': self.fleet.count(BatteryState.WAITING),
+                'charging': self.fleet.count(BatteryState.CHARGING),
+                'finished': self.fleet.count(BatteryState.FINISHED),
+            }))
+
     def start(self):
-        self.current_time = 0
-        while True:
+        """
+        Runs the simulation loop until stop is called.
+        """
+        if self.current_time is None:
+            self.current_time = 0
+        while not self.stopped.is_set():
             start = time()
-
-            with self.lock:
-                # swap fully charged batteries to finished
-                swap_batteries = []
-
-                for charging_battery in self.charging_batteries:
-                    if not self.constraints[0, 0]:
-                        if charging_battery.update():
-                            # battery is fully charged
-                            swap_batteries.append(charging_battery)
-                for swap_battery in swap_batteries:
-                    self.charging_batteries.remove(swap_battery)
-                    self.finished_batteries.append(swap_battery)
-
-                # swap waiting batteries to charging
-                swap_count = self.charger_count - len(self.charging_batteries)
-                swap_batteries = self.waiting_batteries[:swap_count]
-                for waiting_battery in swap_batteries:
-                    self.charging_batteries.append(waiting_battery)
-                    self.waiting_batteries.remove(waiting_battery)
-
-                self.constraints = np.roll(self.constraints, -1, axis=1)
-                self.constraints[0, -1] = False
-
-                # remaining time 
-                remaining = config.resolution / config.simulation_time_factor - (time() - start)
-                self.create_optimized_schedule(self.current_time, remaining)
-                # Log the schedule
-                formatted_schedule = \
-                    f'Current time: {timedelta(seconds=self.current_time)}, ' + \
-                    f'Waiting Batteries: {len(self.waiting_batteries)}, ' + \
-                    f'Finished Batteries: {len(self.finished_batteries)}, ' + \
-                    f'Requests: {len(self.battery_requests)} ' + self.schedule.format_schedule()
-                if formatted_schedule:
-                    logger.info(formatted_schedule)
-
-            remaining = config.resolution / config.simulation_time_factor - (time() - start)
-            if remaining > 0:
-                sleep(remaining)
-            else:
-                print('warning: simulation is too slow...')
+            self.tick()
+
+            # replan whenever the inputs change until the next slot is due, bursts of changes are planned once
+            deadline = start + config.resolution / config.simulation_time_factor
+            remaining = deadline - time()
+            if remaining <= 0:
+                self.metrics.tick_overruns.inc()
+                logger.warning(f'simulation is too slow, the tick took {time() - start:.3f}s')
+            while remaining > 0 and not self.stopped.is_set():
+                if self.replan_requested.wait(remaining) and not self.stopped.is_set():
+                    self.wait_for_changes(deadline)
+                    self.replan(0)
+                remaining = deadline - time()
             self.current_time += config.resolution
+            if self.store is not None and self.store.count_slot():
+                tik = time()
+                self.store.save(self)
+                self.metrics.phase_seconds.observe(time() - tik, phase='persist')
+        # the stop request is consumed, the loop can be started again
+        self.stopped.clear()
+
+    async def run(self):
+        """
+        Runs the simulation loop in a worker thread, to be managed as asyncio task.
+        The event loop stays free for the API, which only reads snapshots and applies short changes.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self.start)
+
+    def close(self):
+        """
+        Releases the background workers of the simulation.
+        """
+        self.notifier.shutdown()
+        with self.estimator_lock:
+            if self.estimator is not None:
+                self.estimator.shutdown()
+                self.estimator = None
+
+    def stop(self):
+        """
+        Stops the simulation loop after the current tick.
+        """
+        self.stopped.set()
+        self.replan_requested.set()
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import drone.config as config
+from drone.fleet import BatteryState, Fleet
+
+
+def read_only(array) -> np.ndarray:
+    """
+    Returns a read-only copy of the array.
+    """
+    array = np.array(array)
+    array.setflags(write=False)
+    return array
+
+
+@dataclass(frozen=True)
+class SimulationSnapshot:
+    """
+    Immutable state of the simulation, published at the end of every tick and after every replanning.
+
+    The read paths of the API are served from the latest snapshot, so they neither wait for the
+    simulation lock nor for the optimizer. The snapshot is replaced as a whole, never modified.
+    The batteries, schedules and prognoses are serialized on first read, a tick nobody reads costs nothing.
+    """
+    version: int
+    current_time: Optional[int]
+    fleet: Fleet  # copy of the fleet, not changed after publishing
+    schedules: np.ndarray
+    price_profile: np.ndarray
+    rotated_price_profile: np.ndarray  # price profile starting at the current time
+    demand_events: List[int]  # demand events in seconds after the current time
+    pending_charge_requests: dict
+    pending_exchange_requests: dict
+    curves: Dict[str, np.ndarray]  # schedules, curves and prognoses as arrays for the compact encodings
+
+    @cached_property
+    def batteries(self) -> dict:
+        return self.fleet.serialize_states()
+
+    @cached_property
+    def battery_key(self) -> bytes:
+        """
+        Fingerprint of the batteries, equal for snapshots with equal batteries.
+        """
+        return self.fleet.fingerprint(BatteryState.WAITING, BatteryState.CHARGING, BatteryState.FINISHED)
+
+    @cached_property
+    def optimized_schedule(self) -> dict:
+        return self.schedule_dict('optimized')
+
+    @cached_property
+    def unoptimized_schedule(self) -> dict:
+        return self.schedule_dict('unoptimized')
+
+    @cached_property
+    def battery_prognosis(self) -> dict:
+        return {
+            "waiting_battery_prognosis": self.curves['waiting_battery_prognosis'].tolist(),
+            "finished_battery_prognosis": self.curves['finished_battery_prognosis'].tolist()
+        }
+
+    def schedule_dict(self, name: str) -> dict:
+        return {
+            "resolution_seconds": config.resolution,
+            "schedules": [self.curves[f'{name}_schedule'].tolist()],
+            "load_curve": self.curves[f'{name}_load_curve'].tolist(),
+            "cost_curve": self.curves[f'{name}_cost_curve'].tolist()
+        }
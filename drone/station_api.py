@@ -0,0 +1,271 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, Path, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+import drone.config as config
+from drone.models import (Battery, ChargeRequest, DemandEstimation, ExchangeCompleted, ExchangeRequest, PowerLimit,
+                          PriceProfile, SimulationConfig, STATION_ID_PATTERN, StationConfig)
+from drone.stations import StationError, StationPool
+
+pool = StationPool()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the stations run in the worker processes as long as the service
+    pool.start()
+    yield
+    pool.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.exception_handler(StationError)
+async def station_error(request: Request, error: StationError):
+    return JSONResponse({"success": False, "message": error.detail}, status_code=error.status)
+
+
+StationId = Path(..., regex=STATION_ID_PATTERN, example="station1")
+
+
+@app.post("/stations",
+          summary="Add a station",
+          description="""
+    This endpoint is used to add a station with its chargers and scheduler. The simulation of the station runs
+    in the worker process of its shard, all further requests to the station are routed to this worker.
+    """)
+async def create_station(station: StationConfig):
+    await pool.create(station.dict())
+    return {
+        "success": True,
+        "message": f"station {station.station_id} added"
+    }
+
+
+@app.get("/stations",
+         summary="List of stations",
+         description="This endpoint returns the ids of all stations.")
+async def stations():
+    return {
+        "success": True,
+        "stations": await pool.list()
+    }
+
+
+@app.delete("/stations/{station_id}",
+            summary="Remove a station",
+            description="This endpoint stops the simulation of the station and deletes its state.")
+async def remove_station(station_id: str = StationId):
+    await pool.call(station_id, 'remove')
+    return {
+        "success": True
+    }
+
+
+@app.post("/stations/{station_id}/battery",
+          summary="Add a battery",
+          description="This endpoint is used to add a battery to the station, as POST /battery.")
+async def add_battery(battery: Battery, station_id: str = StationId):
+    return await pool.call(station_id, 'add_battery', battery.dict())
+
+
+@app.post("/stations/{station_id}/batteries",
+          summary="Add batteries",
+          description="This endpoint is used to add batteries to the station, as POST /batteries.")
+async def add_batteries(batteries: List[Battery], station_id: str = StationId):
+    return await pool.call(station_id, 'add_batteries', [battery.dict() for battery in batteries])
+
+
+@app.delete("/stations/{station_id}/batteries",
+            summary="Remove all batteries",
+            description="This endpoint is used to remove all batteries of the station.")
+async def remove_batteries(station_id: str = StationId):
+    return await pool.call(station_id, 'remove_batteries')
+
+
+@app.get("/stations/{station_id}/batteries",
+         summary="status of batteries",
+         description="This endpoint returns a list of the batteries of the station with their status.")
+async def batteries(station_id: str = StationId):
+    return await pool.call(station_id, 'get_batteries')
+
+
+@app.post("/stations/{station_id}/charge-request",
+          summary="Request for charging",
+          description="""
+    This endpoint is used by a drone to request a battery at the station shortly before arrival,
+    as POST /charge-request.
+    """)
+async def charge_request(charge_request: ChargeRequest, station_id: str = StationId):
+    return await pool.call(station_id, 'charge_request', charge_request.dict())
+
+
+@app.post("/stations/{station_id}/charge-requests",
+          summary="Requests for charging",
+          description="""
+    This endpoint is used by drones to request batteries at the station shortly before arrival,
+    as POST /charge-requests.
+    """)
+async def charge_requests(charge_requests: List[ChargeRequest], station_id: str = StationId):
+    return await pool.call(station_id, 'charge_requests', [request.dict() for request in charge_requests])
+
+
+@app.put("/stations/{station_id}/exchange",
+         summary="Battery exchange",
+         description="This endpoint is used to execute the battery exchange of a landed drone, as PUT /exchange.")
+async def exchange_battery(exchange_request: ExchangeRequest, station_id: str = StationId):
+    return await pool.call(station_id, 'exchange_battery', exchange_request.dict())
+
+
+@app.put("/stations/{station_id}/exchanges",
+         summary="Battery exchanges",
+         description="This endpoint is used to execute the battery exchanges of landed drones, as PUT /exchanges.")
+async def exchange_batteries(exchange_requests: List[ExchangeRequest], station_id: str = StationId):
+    return await pool.call(station_id, 'exchange_batteries', [request.dict() for request in exchange_requests])
+
+
+@app.put("/stations/{station_id}/exchange-completed",
+         summary="Battery exchange completed",
+         description="""
+    This endpoint is used to indicate that the battery of a drone has been exchanged successfully,
+    as PUT /exchange-completed.
+    """)
+async def exchange_completed(exchange_completed: ExchangeCompleted, station_id: str = StationId):
+    return await pool.call(station_id, 'exchange_completed', exchange_completed.dict())
+
+
+@app.put("/stations/{station_id}/exchanges-completed",
+         summary="Battery exchanges completed",
+         description="""
+    This endpoint is used to indicate that the batteries of drones have been exchanged successfully,
+    as PUT /exchanges-completed.
+    """)
+async def exchanges_completed(exchanges: List[ExchangeCompleted], station_id: str = StationId):
+    return await pool.call(station_id, 'exchanges_completed', [exchange.dict() for exchange in exchanges])
+
+
+@app.get("/stations/{station_id}/exchange-notifications",
+         summary="Exchange notification metrics",
+         description="This endpoint returns delivery metrics of the exchange confirmations of the station.")
+async def exchange_notifications(station_id: str = StationId):
+    return await pool.call(station_id, 'get_exchange_notifications')
+
+
+@app.put("/stations/{station_id}/demand-estimation",
+         summary="Demand estimation",
+         description="This endpoint is used to send a prognosis of the demand of the station, as PUT /demand-estimation.")
+async def demand_estimation(demand_estimation: DemandEstimation, station_id: str = StationId):
+    return await pool.call(station_id, 'set_demand', demand_estimation.dict())
+
+
+@app.put("/stations/{station_id}/price-profile",
+         summary="Price profile",
+         description="This endpoint is used to send a prognosis of the price profile of the station.")
+async def update_price_profile(price_profile: PriceProfile, station_id: str = StationId):
+    return await pool.call(station_id, 'set_price_profile', price_profile.dict())
+
+
+@app.get("/stations/{station_id}/price-profile",
+         summary="Price profile",
+         description="This endpoint is used to get the price profile of the station.")
+async def get_price_profile(station_id: str = StationId):
+    return await pool.call(station_id, 'get_price_profile')
+
+
+@app.put("/stations/{station_id}/power-limit",
+         summary="Power limit",
+         description="This endpoint is used to set the grid connection limit of the station shared by all chargers.")
+async def update_power_limit(power_limit: PowerLimit, station_id: str = StationId):
+    return await pool.call(station_id, 'set_power_limit', power_limit.dict())
+
+
+@app.get("/stations/{station_id}/schedules",
+         summary="Current charging schedule",
+         description="This endpoint returns the current charging schedules of the station.")
+async def schedule(station_id: str = StationId):
+    return await pool.call(station_id, 'get_schedules')
+
+
+@app.get("/stations/{station_id}/confidence",
+         summary="Confidence of the current schedule",
+         description="This endpoint returns a Monte Carlo estimate of the current schedule, as GET /confidence.")
+async def confidence(station_id: str = StationId):
+    return await pool.call(station_id, 'get_confidence')
+
+
+@app.post("/stations/{station_id}/restart",
+          summary="Restart the station",
+          description="This endpoint restarts the simulation of the station")
+async def restart(simulation_config: SimulationConfig, station_id: str = StationId):
+    return await pool.call(station_id, 'restart', simulation_config.dict())
+
+
+@app.get("/stations/{station_id}/visualisation",
+         summary="All necessary information for visualisation",
+         description="This endpoint returns the state of the station for visualisation, as GET /visualisation.")
+async def visualisation(station_id: str = StationId):
+    return await pool.call(station_id, 'visualisation')
+
+
+@app.get("/stations/{station_id}/visualisation/compact",
+         summary="Compact schedules and curves for visualisation",
+         description="""
+    This endpoint returns the schedules and curves of the station in a compact form,
+    as GET /visualisation/compact.
+    """)
+async def compact_visualisation(station_id: str = StationId,
+                                format: str = Query("json", regex="^(json|npz)$"),
+                                known: Optional[str] = Query(None, description="tags of known sections"),
+                                if_none_match: Optional[str] = Header(None)):
+    compact = await pool.call(station_id, 'compact_visualisation',
+                              {"format": format, "known": known, "if_none_match": if_none_match})
+    headers = {"ETag": compact["etag"]}
+    if compact["status"] == 304:
+        return Response(status_code=304, headers=headers)
+    media_type = "application/octet-stream" if format == "npz" else "application/json"
+    return Response(compact["body"], media_type=media_type, headers=headers)
+
+
+@app.get("/stations/{station_id}/events",
+         summary="Stream of the state of the station",
+         description="""
+    This endpoint streams the state of the station as server-sent events, as GET /events. The service polls
+    the worker of the station for new states, the stream ends when the station is removed.
+    """)
+async def events(station_id: str = StationId):
+    # unknown stations are answered before the stream starts
+    frame = await pool.call(station_id, 'events')
+
+    async def stream():
+        current = frame
+        while True:
+            if current is not None:
+                yield current.event
+                version = current.version
+            await asyncio.sleep(config.station_event_interval_s)
+            try:
+                current = await pool.call(station_id, 'events', version)
+            except StationError:
+                break
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.get("/stations/{station_id}/metrics",
+         summary="Metrics in the Prometheus text format",
+         response_class=PlainTextResponse,
+         description="This endpoint returns the metrics of the simulation of the station, as GET /metrics.")
+async def metrics(station_id: str = StationId):
+    return PlainTextResponse(await pool.call(station_id, 'get_metrics'), media_type="text/plain; version=0.0.4")
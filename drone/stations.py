@@ -0,0 +1,484 @@
+"""simulations of many stations sharded across worker processes
+
+Each worker process owns the stations whose id hashes to its shard and runs their simulation loops in threads,
+so the optimizers of stations in different shards run on different cores instead of sharing one interpreter.
+The service forwards requests to the worker of the station over queues and awaits the responses.
+The operations on the simulation of a station take and return plain data, they also serve the API of
+a single station.
+
+Run the service of all stations with:
+
+    uvicorn drone.station_api:app
+"""
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from threading import Lock, Thread
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import drone.config as config
+from drone.broadcast import Frame, make_frame
+from drone.compact import CompactSnapshot, parse_known
+from drone.persistence import StateStore
+from drone.simulation import Simulation
+from drone.snapshot import SimulationSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class StationError(Exception):
+    """
+    Error of a request to a station, answered with the status code.
+    """
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(status, detail)
+        self.status = status
+        self.detail = detail
+
+
+def shard_of(station_id: str, shards: int) -> int:
+    # stable across processes and restarts, unlike hash()
+    return zlib.crc32(station_id.encode()) % shards
+
+
+def namespaces(items: List[dict]) -> List[SimpleNamespace]:
+    return [SimpleNamespace(**item) for item in items]
+
+
+def add_battery(simulation: Simulation, battery: dict) -> dict:
+    new_battery, = simulation.create_batteries(namespaces([battery]))
+    return {"success": True, "message": f"battery {new_battery.id} added"}
+
+
+def add_batteries(simulation: Simulation, batteries: List[dict]) -> dict:
+    new_batteries = simulation.create_batteries(namespaces(batteries))
+    return {
+        "success": True,
+        "message": f"{len(new_batteries)} batteries added",
+        "results": [{"battery_id": battery["battery_id"], "id": new_battery.id}
+                    for battery, new_battery in zip(batteries, new_batteries)]
+    }
+
+
+def remove_batteries(simulation: Simulation, args) -> dict:
+    simulation.clear_batteries()
+    return {"success": True, "message": "all batteries removed successfully"}
+
+
+def get_batteries(simulation: Simulation, args) -> dict:
+    return {"success": True, "batteries": simulation.get_batteries()}
+
+
+def charge_request(simulation: Simulation, request: dict) -> dict:
+    accepted, = simulation.add_requests(namespaces([request]))
+    return {"success": accepted, "message": f"charging request {'accepted' if accepted else 'declined'}"}
+
+
+def charge_requests(simulation: Simulation, requests: List[dict]) -> dict:
+    accepted = simulation.add_requests(namespaces(requests))
+    return {
+        "success": all(accepted),
+        "message": f"{sum(accepted)} of {len(accepted)} charging requests accepted",
+        "results": [{"drone_id": request["drone_id"], "success": success}
+                    for request, success in zip(requests, accepted)]
+    }
+
+
+def exchange_battery(simulation: Simulation, request: dict) -> dict:
+    started, = simulation.exchange_batteries(namespaces([request]))
+    return {
+        "success": started,
+        "message": "battery exchange in progress" if started else "no accepted charging request of the drone"
+    }
+
+
+def exchange_batteries(simulation: Simulation, requests: List[dict]) -> dict:
+    started = simulation.exchange_batteries(namespaces(requests))
+    return {
+        "success": all(started),
+        "message": f"{sum(started)} of {len(started)} battery exchanges in progress",
+        "results": [{"drone_id": request["drone_id"], "success": success}
+                    for request, success in zip(requests, started)]
+    }
+
+
+def exchange_completed(simulation: Simulation, exchange: dict) -> dict:
+    completed, = simulation.exchanges_completed([exchange["drone_id"]])
+    return {"success": completed, "message": "battery exchange completed"}
+
+
+def exchanges_completed(simulation: Simulation, exchanges: List[dict]) -> dict:
+    completed = simulation.exchanges_completed([exchange["drone_id"] for exchange in exchanges])
+    return {
+        "success": all(completed),
+        "message": f"{sum(completed)} of {len(completed)} battery exchanges completed",
+        "results": [{"drone_id": exchange["drone_id"], "success": success}
+                    for exchange, success in zip(exchanges, completed)]
+    }
+
+
+def set_demand(simulation: Simulation, demand: dict) -> dict:
+    simulation.set_demand(SimpleNamespace(**demand))
+    return {"success": True}
+
+
+def set_price_profile(simulation: Simulation, price_profile: dict) -> dict:
+    simulation.set_price_profile(SimpleNamespace(**price_profile))
+    return {"success": True}
+
+
+def get_price_profile(simulation: Simulation, args) -> dict:
+    return {"success": True, "price_profile": simulation.get_price_profile().tolist()}
+
+
+def set_power_limit(simulation: Simulation, power_limit: dict) -> dict:
+    simulation.set_power_limit(SimpleNamespace(**power_limit))
+    return {"success": True}
+
+
+def get_schedules(simulation: Simulation, args) -> dict:
+    return {
+        "success": True,
+        "schedules": {
+            "resolution_seconds": config.resolution,
+            "schedules": simulation.get_schedules().tolist()
+        }
+    }
+
+
+def get_confidence(simulation: Simulation, args) -> dict:
+    return {"success": True, "confidence": simulation.get_confidence()}
+
+
+def get_exchange_notifications(simulation: Simulation, args) -> dict:
+    return {"success": True, "metrics": simulation.notifier.get_metrics()}
+
+
+def visualisation(simulation: Simulation, args) -> dict:
+    # served from a single snapshot, so all parts belong to the same point in time
+    snapshot = simulation.snapshot
+    return {
+        "current_time": str(timedelta(seconds=snapshot.current_time or 0)),
+        "optimized_schedule": snapshot.optimized_schedule,
+        "unoptimized_schedule": snapshot.unoptimized_schedule,
+        "price_profile": snapshot.rotated_price_profile.tolist(),
+        "batteries": snapshot.batteries,
+        "demand_events": snapshot.demand_events,
+        "battery_prognosis": snapshot.battery_prognosis,
+        "pending_charge_requests": snapshot.pending_charge_requests,
+        "pending_exchange_requests": snapshot.pending_exchange_requests
+    }
+
+
+def compact_visualisation(simulation: Simulation, args: dict) -> dict:
+    """
+    Returns the status, the ETag and the body of the compact encodings, the body is left out if not modified.
+    """
+    compact = simulation.get_compact()
+    if args["if_none_match"] == compact.etag:
+        return {"status": 304, "etag": compact.etag, "body": None}
+    if args["format"] == "npz":
+        return {"status": 200, "etag": compact.etag, "body": compact.to_npz()}
+    return {"status": 200, "etag": compact.etag, "body": json.dumps(compact.encode(parse_known(args["known"])))}
+
+
+def restart(simulation: Simulation, args: dict) -> dict:
+    simulation.restart(args["start_time"])
+    return {"success": True}
+
+
+def get_metrics(simulation: Simulation, args) -> str:
+    return simulation.metrics.registry.render()
+
+
+OPERATIONS = {
+    'add_battery': add_battery,
+    'add_batteries': add_batteries,
+    'remove_batteries': remove_batteries,
+    'get_batteries': get_batteries,
+    'charge_request': charge_request,
+    'charge_requests': charge_requests,
+    'exchange_battery': exchange_battery,
+    'exchange_batteries': exchange_batteries,
+    'exchange_completed': exchange_completed,
+    'exchanges_completed': exchanges_completed,
+    'set_demand': set_demand,
+    'set_price_profile': set_price_profile,
+    'get_price_profile': get_price_profile,
+    'set_power_limit': set_power_limit,
+    'get_schedules': get_schedules,
+    'get_confidence': get_confidence,
+    'get_exchange_notifications': get_exchange_notifications,
+    'visualisation': visualisation,
+    'compact_visualisation': compact_visualisation,
+    'restart': restart,
+    'get_metrics': get_metrics,
+}
+
+
+class StationFrames:
+    """
+    Frames of the state of a station for the event streams, which poll for the changes since the version
+    they know. The recently served snapshots are kept, so a stream that skipped snapshots still gets the
+    changes since its version and only a stream older than all of them gets the full state again.
+    A frame is serialized once for all streams that know the same version.
+    """
+
+    def __init__(self, simulation: Simulation, history: int = config.push_queue_size):
+        self.simulation = simulation
+        self.history = history
+        self.lock = Lock()
+        self.served: Dict[int, Tuple[SimulationSnapshot, CompactSnapshot]] = {}  # by version, oldest first
+        self.version: Optional[int] = None  # version of the latest served snapshot
+        self.frames: Dict[Optional[int], Frame] = {}  # frames of the latest served snapshot by known version
+
+    def frame(self, known: Optional[int] = None) -> Optional[Frame]:
+        """
+        Returns the changes since the known version, the full state without known version,
+        None if the known version is the latest.
+        """
+        snapshot, compact = self.simulation.snapshot, self.simulation.get_compact()
+        if compact.version != snapshot.version:
+            # published in between
+            compact = CompactSnapshot(snapshot)
+        with self.lock:
+            if self.version is None or compact.version > self.version:
+                self.served[compact.version] = (snapshot, compact)
+                while len(self.served) > self.history:
+                    del self.served[next(iter(self.served))]
+                self.version = compact.version
+                self.frames = {}
+            if known == self.version:
+                return None
+            if known not in self.served:
+                known = None
+            if known not in self.frames:
+                snapshot, compact = self.served[self.version]
+                previous, previous_compact = self.served.get(known, (None, None))
+                self.frames[known] = make_frame(compact, snapshot, previous, previous_compact)
+            return self.frames[known]
+
+
+class StationWorker:
+    """
+    Simulations of the stations of one shard, each running its loop in a thread of the worker process.
+    With a state directory, the state of each station is kept in a directory of its own and restored on startup.
+    """
+
+    def __init__(self, shard: int = 0, shards: int = 1, state_dir: Optional[Path] = config.state_dir):
+        self.shard = shard
+        self.shards = shards
+        self.state_dir = Path(state_dir) / 'stations' if state_dir is not None else None
+        self.lock = Lock()  # guards the stations, not their simulations
+        self.simulations: Dict[str, Simulation] = {}
+        self.threads: Dict[str, Thread] = {}
+        self.frames: Dict[str, StationFrames] = {}
+
+    def directory(self, station_id: str) -> Optional[Path]:
+        """
+        Returns the state directory of the station, None without state directory.
+        """
+        if self.state_dir is None:
+            return None
+        directory = (self.state_dir / station_id).resolve()
+        if directory.parent != self.state_dir.resolve():
+            raise StationError(400, f'invalid station id {station_id}')
+        return directory
+
+    def create(self, station: dict):
+        """
+        station - id, number of chargers, scheduler and start time of the station
+        """
+        station_id = station['station_id']
+        with self.lock:
+            if station_id in self.simulations:
+                raise StationError(409, f'station {station_id} exists')
+            directory = self.directory(station_id)
+            simulation = Simulation(charger_count=station['charger_count'], scheduler=station['scheduler'])
+            simulation.current_time = station['start_time']
+            if directory is not None:
+                directory.mkdir(parents=True, exist_ok=True)
+                (directory / 'station.json').write_text(json.dumps(station))
+                StateStore(directory).restore(simulation)
+            thread = Thread(target=simulation.start, name=f'station-{station_id}', daemon=True)
+            self.simulations[station_id] = simulation
+            self.threads[station_id] = thread
+            self.frames[station_id] = StationFrames(simulation)
+        thread.start()
+
+    def restore(self):
+        """
+        Starts the stations of the shard with a state directory.
+        """
+        if self.state_dir is None or not self.state_dir.exists():
+            return
+        for path in sorted(self.state_dir.glob('*/station.json')):
+            station = json.loads(path.read_text())
+            if shard_of(station['station_id'], self.shards) == self.shard:
+                self.create(station)
+
+    def stop_station(self, station_id: str):
+        simulation, thread = self.simulations.pop(station_id), self.threads.pop(station_id)
+        self.frames.pop(station_id)
+        simulation.stop()
+        thread.join()
+        if simulation.store is not None:
+            simulation.store.save(simulation)
+            simulation.store.close()
+        simulation.close()
+
+    def remove(self, station_id: str):
+        """
+        Stops the simulation of the station and deletes its state.
+        """
+        with self.lock:
+            if station_id not in self.simulations:
+                raise StationError(404, f'unknown station {station_id}')
+            directory = self.directory(station_id)
+            self.stop_station(station_id)
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def handle(self, station_id: Optional[str], operation: str, args=None):
+        if operation == 'create':
+            return self.create(args)
+        if operation == 'list':
+            return sorted(self.simulations)
+        if operation == 'remove':
+            return self.remove(station_id)
+        simulation, frames = self.simulations.get(station_id), self.frames.get(station_id)
+        if simulation is None or frames is None:
+            raise StationError(404, f'unknown station {station_id}')
+        if operation == 'events':
+            return frames.frame(args)
+        return OPERATIONS[operation](simulation, args)
+
+    def stop(self):
+        with self.lock:
+            for station_id in list(self.simulations):
+                self.stop_station(station_id)
+
+
+def run_worker(shard: int, shards: int, requests: multiprocessing.Queue, responses: multiprocessing.Queue,
+               state_dir: Optional[Path] = None):
+    """
+    Serves the requests to the stations of the shard until None is received.
+    Requests are handled on a thread pool, so a slow request does not hold up the other stations.
+    """
+    # every station logs its schedule each tick on INFO
+    logging.basicConfig(level=logging.WARNING)
+    worker = StationWorker(shard, shards, state_dir)
+    worker.restore()
+
+    def handle(request_id: int, station_id: Optional[str], operation: str, args):
+        try:
+            responses.put((request_id, 200, worker.handle(station_id, operation, args)))
+        except StationError as error:
+            responses.put((request_id, error.status, error.detail))
+        except Exception as error:
+            logger.exception(f'{operation} of station {station_id} failed')
+            responses.put((request_id, 500, repr(error)))
+
+    with ThreadPoolExecutor(max_workers=config.station_handler_threads) as executor:
+        for request in iter(requests.get, None):
+            executor.submit(handle, *request)
+    worker.stop()
+
+
+class StationPool:
+    """
+    Worker processes owning the stations, requests are routed to the worker of the shard of the station id.
+    """
+
+    def __init__(self, workers: int = config.station_workers, timeout: float = config.station_request_timeout,
+                 state_dir: Optional[Path] = config.state_dir):
+        """
+        workers - number of worker processes, 0 for one per CPU core
+        timeout - time to wait for the response of a worker in seconds
+        state_dir - directory of the state of the stations, None keeps the state in memory
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.state_dir = state_dir
+        self.timeout = timeout
+        self.processes: List[multiprocessing.Process] = []
+        self.requests: List[multiprocessing.Queue] = []
+        self.responses: Optional[multiprocessing.Queue] = None
+        self.reader: Optional[Thread] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.request_ids = itertools.count()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        # the workers are spawned, so they do not inherit the threads and the state of the service
+        context = multiprocessing.get_context('spawn')
+        self.responses = context.Queue()
+        for shard in range(self.workers):
+            requests = context.Queue()
+            process = context.Process(target=run_worker, args=(shard, self.workers, requests, self.responses, self.state_dir),
+                                      name=f'station-worker-{shard}', daemon=True)
+            process.start()
+            self.requests.append(requests)
+            self.processes.append(process)
+        self.reader = Thread(target=self.read_responses, name='station-responses', daemon=True)
+        self.reader.start()
+
+    def stop(self):
+        """
+        Stops the workers after their pending requests, the workers save the state of their stations.
+        """
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join()
+        self.responses.put(None)
+        self.reader.join()
+        self.processes, self.requests = [], []
+
+    def read_responses(self):
+        for request_id, status, result in iter(self.responses.get, None):
+            self.loop.call_soon_threadsafe(self.resolve, request_id, status, result)
+
+    def resolve(self, request_id: int, status: int, result):
+        future = self.pending.pop(request_id, None)
+        if future is not None and not future.done():
+            future.set_result((status, result))
+
+    async def call_shard(self, shard: int, station_id: Optional[str], operation: str, args=None):
+        if not self.requests:
+            raise StationError(503, 'the stations are stopped')
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        self.pending[request_id] = future
+        self.requests[shard].put((request_id, station_id, operation, args))
+        try:
+            status, result = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(request_id, None)
+            raise StationError(504, f'no response of worker {shard} for station {station_id}')
+        if status != 200:
+            raise StationError(status, result)
+        return result
+
+    async def call(self, station_id: str, operation: str, args=None):
+        """
+        Runs an operation on the station in its worker and returns the result.
+        """
+        return await self.call_shard(shard_of(station_id, self.workers), station_id, operation, args)
+
+    async def create(self, station: dict):
+        await self.call(station['station_id'], 'create', station)
+
+    async def list(self) -> List[str]:
+        shards = await asyncio.gather(*[self.call_shard(shard, None, 'list') for shard in range(self.workers)])
+        return sorted(station_id for station_ids in shards for station_id in station_ids)
@@ -0,0 +1,28 @@
+from types import SimpleNamespace
+
+
+def battery(state_of_charge, capacity_kwh=2, max_power_watt=2000):
+    """
+    Battery as passed to the simulation by the API.
+    """
+    return SimpleNamespace(state_of_charge=state_of_charge, capacity_kwh=capacity_kwh, max_power_watt=max_power_watt)
+
+
+def charge_request(drone_id, state_of_charge=0.3):
+    """
+    Charge request as passed to the simulation by the API.
+    """
+    return SimpleNamespace(drone_id=drone_id, state_of_charge=state_of_charge, capacity_kwh=2, max_power_watt=2000)
+
+
+def battery_json(battery_id, state_of_charge):
+    return {"battery_id": battery_id, "state_of_charge": state_of_charge, "capacity_kwh": 2, "max_power_watt": 2000}
+
+
+def charge_request_json(drone_id, state_of_charge=0.3):
+    return {"drone_id": drone_id, "state_of_charge": state_of_charge, "capacity_kwh": 2, "max_power_watt": 2000,
+            "delta_eta_seconds": 600}
+
+
+def station_config(station_id, charger_count=1):
+    return {"station_id": station_id, "charger_count": charger_count, "scheduler": "greedy", "start_time": 0}
@@ -1,13 +1,20 @@
+import asyncio
 import pytest
 from httpx import AsyncClient
+import drone.api as api
 from drone.api import app
-from time import sleep, time
+from drone.simulation import Simulation
+from time import time
 from datetime import datetime
 import drone.config as config
 
 @pytest.mark.asyncio
 async def test_batteries_scenario():
-    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+    async with app.router.lifespan_context(app), AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+
+        # Start the simulation at the current time
+        response = await ac.post("/restart", json={"start_time": int(time())})
+        assert response.status_code == 200
 
         # Clear batteries
         response = await ac.delete("/batteries")
@@ -45,10 +52,21 @@ async def test_batteries_scenario():
 
         # Check if 5 batteries are charged
         # Depending on your API structure, you might need to adjust this step.
-        sleep(10)
+        await asyncio.sleep(10)
         response = await ac.get("/batteries")
         assert response.status_code == 200
         data = response.json()
         batteries = data['batteries']
         assert len(batteries['finished_batteries']) == 5
         # Further checks based on your application logic
+
+
+@pytest.mark.asyncio
+async def test_visualisation_before_the_first_tick(monkeypatch):
+    simulation = Simulation()
+    monkeypatch.setattr(api, 'simulation', simulation)
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+        response = await ac.get("/visualisation")
+        assert response.status_code == 200
+        assert response.json()["current_time"] == "0:00:00"
+    simulation.close()
@@ -0,0 +1,35 @@
+import numpy as np
+
+from drone.backtest import Scenario, backtest
+
+
+def test_backtest_saves_cost(tmp_path):
+    csv_file_path = tmp_path / 'prices.csv'
+    # expensive after midnight, cheap in the early morning before the first demand at 8:00
+    prices = [100 if hour < 4 else 20 for hour in range(24)]
+    csv_file_path.write_text('date,actual\n' + ''.join(f'{day:02d}.03.2020 {hour:02d}:00,{prices[hour]}\n'
+                                                       for day in range(1, 4) for hour in range(24)))
+    scenario = Scenario(batteries=[0.2] * 4, scheduler='optimal')
+
+    result = backtest('2020-03-01', '2020-03-03', scenario, csv_file_path=csv_file_path)
+    assert result.days == 3 and [day.day for day in result.day_results] == ['2020-03-01', '2020-03-02', '2020-03-03']
+    assert result.infeasible_days == 0
+    assert result.optimized_cost < result.unoptimized_cost
+    assert np.isclose(result.savings, sum(day.unoptimized_cost - day.optimized_cost for day in result.day_results))
+
+    pooled = backtest('2020-03-01', '2020-03-03', scenario, workers=2, csv_file_path=csv_file_path)
+    assert [day.optimized_cost for day in pooled.day_results] == [day.optimized_cost for day in result.day_results]
+
+
+def test_backtest_with_default_scheduler_saves_cost(tmp_path):
+    csv_file_path = tmp_path / 'prices.csv'
+    prices = [100 if hour < 4 else 20 for hour in range(24)]
+    csv_file_path.write_text('date,actual\n' + ''.join(f'{day:02d}.03.2020 {hour:02d}:00,{prices[hour]}\n'
+                                                       for day in range(1, 3) for hour in range(24)))
+    # the greedy scheduler of the configuration
+    scenario = Scenario(batteries=[0.2] * 4)
+    assert scenario.scheduler == 'greedy'
+
+    result = backtest('2020-03-01', '2020-03-02', scenario, csv_file_path=csv_file_path)
+    assert result.infeasible_days == 0
+    assert result.savings > 0 and result.optimized_cost < result.unoptimized_cost
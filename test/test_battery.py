@@ -0,0 +1,36 @@
+import numpy as np
+
+from drone.battery import Battery, finish_indices
+
+
+def sequential_finish_indices(batteries, charging_constraints):
+    finish = []
+    i = 0
+    for battery in batteries:
+        needed = max(int(np.ceil((1 - battery.soc) / battery.soc_delta_per_timestep)), 1)
+        count_false = 0
+        for j, val in enumerate(charging_constraints[0, i:]):
+            count_false += not val
+            if count_false >= needed:
+                i += j + 1
+                finish.append(i)
+                break
+        else:
+            finish.append(-1)
+            i = charging_constraints.shape[1]
+    return finish
+
+
+def test_finish_indices_match_sequential_charging():
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        batteries = [Battery(i, rng.uniform(0.6, 1.0), 2, resolution=60, max_power=2000) for i in range(10)]
+        charging_constraints = rng.random((1, 300)) < 0.3
+        assert finish_indices(batteries, charging_constraints).tolist() == \
+            sequential_finish_indices(batteries, charging_constraints)
+
+
+def test_remaining_timesteps():
+    battery = Battery(0, 0.96, 2, resolution=60, max_power=2000)  # needs 3 time steps
+    assert battery.remaining_timesteps(np.array([[False, True, False, False, True]])) == 4
+    assert battery.remaining_timesteps(np.array([[True, False, True, False]])) == -1
@@ -0,0 +1,33 @@
+import json
+
+from click.testing import CliRunner
+
+import drone.config as config
+from benchmarks.suite import main, simulation_config, synthetic_simulation
+
+
+def test_simulation_config_sets_horizon_and_resolution():
+    slot_count, resolution = config.slot_count, config.resolution
+    with simulation_config(24, 300):
+        simulation = synthetic_simulation(20)
+        assert simulation.schedule.optimized_schedule.shape == (2, 24 * 12)
+        assert simulation.waiting_batteries[0].resolution == 300
+        assert simulation.create_optimized_schedule(simulation.current_time, 0.1)
+        simulation.close()
+    assert (config.slot_count, config.resolution) == (slot_count, resolution)
+
+
+def test_suite_writes_and_compares_results(tmp_path):
+    output = tmp_path / 'results.json'
+    args = ['--cases', 'price_profile,update_schedule,load_curve,batteries', '--fleet-sizes', '10',
+            '--horizons', '24', '--resolutions', '300,3600', '--repetitions', '1']
+    result = CliRunner().invoke(main, args + ['--output', str(output)])
+    assert result.exit_code == 0, result.output
+
+    results = json.loads(output.read_text())['results']
+    assert {result['case'] for result in results} == {'price_profile', 'update_schedule', 'load_curve', 'batteries'}
+    assert {result['params']['resolution_s'] for result in results} == {300, 3600}
+    assert all(result['median_s'] >= 0 for result in results)
+
+    result = CliRunner().invoke(main, args + ['--compare', str(output)])
+    assert result.exit_code == 0 and 'of baseline' in result.output
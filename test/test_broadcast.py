@@ -0,0 +1,104 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from httpx import AsyncClient
+
+from drone.broadcast import SnapshotBroadcaster
+from drone.compact import decode_runs
+from drone.simulation import Simulation
+
+from conftest import battery, charge_request
+
+
+@pytest.mark.asyncio
+async def test_frames_are_serialized_once_for_all_subscribers():
+    simulation = Simulation()
+    simulation.current_time = 0
+    broadcaster = SnapshotBroadcaster(simulation, queue_size=2)
+    broadcaster.start()
+    subscribers = [broadcaster.subscribe() for _ in range(3)]
+
+    full = [queue.get_nowait() for queue in subscribers]
+    assert all(frame is full[0] for frame in full)
+    assert json.loads(full[0].data)['full'] and 'batteries' in json.loads(full[0].data)
+
+    simulation.create_battery(battery(0.5))
+    simulation.replan(np.inf)
+    await asyncio.sleep(0)
+    frames = [queue.get_nowait() for queue in subscribers]
+    assert all(frame is frames[0] for frame in frames)
+    changes = json.loads(frames[0].data)
+    assert not changes['full'] and changes['version'] == simulation.snapshot.version
+    assert np.array_equal(decode_runs(changes['sections']['optimized_schedule']), simulation.get_schedules())
+    assert 'price_profile' not in changes['sections'] and 'batteries' in changes
+
+    # a subscriber that falls behind continues with the full state
+    for _ in range(3):
+        simulation.replan(np.inf)
+        await asyncio.sleep(0)
+    assert subscribers[0].qsize() == 1 and json.loads(subscribers[0].get_nowait().data)['full']
+
+    broadcaster.stop()
+    frames = [subscribers[1].get_nowait() for _ in range(subscribers[1].qsize())]
+    assert frames[-1] is None
+    simulation.notifier.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_frames_with_pending_requests():
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.create_batteries([battery(1), battery(1)])
+    broadcaster = SnapshotBroadcaster(simulation)
+    broadcaster.start()
+    queue = broadcaster.subscribe()
+    queue.get_nowait()
+
+    assert simulation.add_requests([charge_request('drone1'), charge_request('drone2')]) == [True, True]
+    assert simulation.exchange_batteries([SimpleNamespace(drone_id='drone1', state_of_charge=0.25,
+                                                          response_uri='http://localhost/done')]) == [True]
+    simulation.replan(np.inf)
+    await asyncio.sleep(0)
+    changes = json.loads(queue.get_nowait().data)
+    assert list(changes['pending_charge_requests']) == ['drone2']
+    assert changes['pending_exchange_requests']['drone1']['response_uri'] == 'http://localhost/done'
+    assert changes['pending_exchange_requests']['drone1']['new_battery']['soc'] == 0.25
+
+    # unchanged requests are left out of the next frame, new subscribers get them with the full state
+    simulation.replan(np.inf)
+    await asyncio.sleep(0)
+    changes = json.loads(queue.get_nowait().data)
+    assert 'pending_charge_requests' not in changes and 'pending_exchange_requests' not in changes
+    full = json.loads(broadcaster.subscribe().get_nowait().data)
+    assert full['full'] and list(full['pending_exchange_requests']) == ['drone1']
+
+    broadcaster.stop()
+    simulation.notifier.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_event_stream():
+    from drone.api import app, broadcaster, simulation
+
+    async def publish_and_stop():
+        try:
+            while not broadcaster.subscribers:
+                await asyncio.sleep(0.01)
+            simulation.replan(0)
+            await asyncio.sleep(0.01)
+        finally:
+            broadcaster.stop()
+
+    simulation.current_time = 0
+    broadcaster.start()
+    task = asyncio.create_task(publish_and_stop())
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+        response = await ac.get("/events")
+    await task
+    assert response.headers['content-type'].startswith('text/event-stream')
+    events = [json.loads(event.split('data: ')[1]) for event in response.text.split('\n\n') if event]
+    assert [event['full'] for event in events] == [True, False]
+    assert events[1]['version'] == simulation.snapshot.version
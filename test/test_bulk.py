@@ -0,0 +1,46 @@
+import pytest
+from httpx import AsyncClient
+
+from drone.api import app, simulation
+from drone.fleet import BatteryState
+
+from conftest import battery_json, charge_request_json
+
+
+@pytest.mark.asyncio
+async def test_bulk_ingestion():
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+        response = await ac.post("/restart", json={"start_time": 0})
+        assert response.status_code == 200
+        simulation.replan_requested.clear()
+
+        batteries = [battery_json(f"battery{i}", 1 if i < 2 else 0.5) for i in range(500)]
+        response = await ac.post("/batteries", json=batteries)
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [result["id"] for result in results] == list(range(500))
+        assert results[-1]["battery_id"] == "battery499"
+        assert simulation.fleet.count(BatteryState.FINISHED) == 2
+        assert simulation.fleet.count(BatteryState.WAITING) == 498
+        assert simulation.replan_requested.is_set()
+
+        # only two charged batteries are available
+        requests = [charge_request_json(f"drone{i}") for i in range(3)]
+        response = await ac.post("/charge-requests", json=requests)
+        assert [result["success"] for result in response.json()["results"]] == [True, True, False]
+        assert not response.json()["success"]
+
+        exchanges = [{"drone_id": drone_id, "state_of_charge": 0.25, "response_uri": "http://127.0.0.1:9/"}
+                     for drone_id in ["drone0", "drone1", "drone2"]]
+        response = await ac.put("/exchanges", json=exchanges)
+        assert [result["success"] for result in response.json()["results"]] == [True, True, False]
+
+        response = await ac.put("/exchanges-completed", json=[{"drone_id": "drone1"}, {"drone_id": "drone0"}])
+        assert response.json()["success"]
+        assert simulation.fleet.count(BatteryState.WAITING) == 500
+        assert not simulation.exchange_requests and not simulation.battery_requests
+
+        # unknown drones are reported per item instead of failing the request
+        response = await ac.put("/exchange", json=exchanges[2])
+        assert response.status_code == 200 and not response.json()["success"]
+    simulation.notifier.shutdown()
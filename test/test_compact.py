@@ -0,0 +1,68 @@
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from httpx import AsyncClient
+
+from drone.api import app, simulation
+from drone.compact import CompactSnapshot, decode_runs, encode_runs, run_lengths
+
+from conftest import battery
+
+
+def test_runs_round_trip():
+    values, lengths = run_lengths(np.array([3, 3, 3, -1, 5, 5]))
+    assert values.tolist() == [3, -1, 5] and lengths.tolist() == [3, 1, 2]
+    assert run_lengths(np.array([]))[1].tolist() == []
+
+    schedule = np.repeat([[0, 1, -1], [2, -1, -1]], [10, 20, 2850], axis=1)
+    runs = encode_runs(schedule)
+    assert runs['rows'][1] == {'values': [2, -1], 'lengths': [10, 2870]}
+    assert np.array_equal(decode_runs(runs), schedule)
+    curve = np.repeat(np.linspace(10, 100, 48), 60)
+    assert np.array_equal(decode_runs(encode_runs(curve)), curve)
+
+
+def test_known_sections_are_left_out():
+    simulation.current_time = 0
+    simulation.create_battery(battery(0.5))
+    simulation.replan(np.inf)
+    compact = CompactSnapshot(simulation.snapshot)
+    encoded = compact.encode()
+    assert set(encoded['sections']) == set(simulation.snapshot.curves)
+    assert np.array_equal(decode_runs(encoded['sections']['optimized_schedule']), simulation.get_schedules())
+
+    # only the sections changed by a new price profile are sent again
+    simulation.set_price_profile(SimpleNamespace(price=np.linspace(100, 10, 48).tolist(), resolution_s=3600))
+    simulation.replan(np.inf)
+    changed_compact = CompactSnapshot(simulation.snapshot)
+    changed = changed_compact.encode(encoded['tags'].values())
+    assert 'price_profile' in changed['sections'] and 'optimized_cost_curve' in changed['sections']
+    assert 'unoptimized_schedule' not in changed['sections']
+    assert changed_compact.etag != compact.etag
+
+    # a new snapshot of the same time and content keeps the ETag
+    simulation.replan(np.inf)
+    republished = CompactSnapshot(simulation.snapshot)
+    assert republished.version > changed_compact.version and republished.etag == changed_compact.etag
+
+
+@pytest.mark.asyncio
+async def test_compact_visualisation():
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+        response = await ac.get("/visualisation/compact")
+        assert response.status_code == 200
+        etag = response.headers['etag']
+        tags = response.json()['tags']
+
+        response = await ac.get("/visualisation/compact", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        response = await ac.get("/visualisation/compact", params={"known": ','.join(tags.values())})
+        assert response.json()['sections'] == {}
+
+        response = await ac.get("/visualisation/compact", params={"format": "npz"})
+        with np.load(io.BytesIO(response.content)) as sections:
+            assert np.array_equal(sections['optimized_schedule'], simulation.get_schedules())
+        response = await ac.get("/visualisation/compact", params={"format": "xml"})
+        assert response.status_code == 422
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from drone.confidence_estimator import ConfidenceEstimator, price_deviations
+
+
+def schedule(slots=120):
+    supply = np.zeros(slots, int)
+    supply[30:] = 1
+    supply[90:] = 2
+    load_curve = np.zeros(slots)
+    load_curve[:90] = 2000
+    return supply, load_curve
+
+
+def test_price_deviations():
+    prices = pd.Series(np.arange(72, dtype=float) ** 2)
+    deviations = price_deviations(prices)
+    assert len(deviations) == 48
+    assert deviations[0] == 24 ** 2 and deviations[47] == 71 ** 2 - 47 ** 2
+
+
+def test_estimate_stockouts_and_cost():
+    supply, load_curve = schedule()
+    price_profile = np.full(len(supply), 100.0)
+    kwargs = dict(supply=supply, load_curve=load_curve, price_profile=price_profile, hour=0)
+
+    estimator = ConfidenceEstimator(np.zeros(24 * 10), samples=500, demand_jitter_s=60, seed=0)
+    # energy of 90 slots at 2 kW for 100 EUR/MWh
+    expected_cost = 2 * 1.5 * 100 / 1000
+    confidence = estimator.estimate(demand_events=np.array([]), **kwargs)
+    assert confidence['stockout_probability'] == 0
+    assert np.isclose(confidence['cost_eur']['mean'], expected_cost) and confidence['cost_eur']['std'] < 1e-9
+
+    # the first battery is demanded long before it is finished
+    confidence = estimator.estimate(demand_events=np.array([300, 100 * 60]), **kwargs)
+    assert 0.55 < confidence['stockout_probability'] < 0.8
+    # the first battery is demanded just in time, stockout only if more than one drone comes
+    confidence = estimator.estimate(demand_events=np.array([40 * 60]), **kwargs)
+    assert np.isclose(confidence['stockout_probability'], 1 - 2 / np.e, atol=0.05)
+
+    estimator = ConfidenceEstimator(np.full(24 * 10, 50.0), samples=100, seed=0)
+    confidence = estimator.estimate(demand_events=np.array([]), **kwargs)
+    assert np.isclose(confidence['cost_eur']['mean'], expected_cost * 1.5)
+
+
+def test_workers_match_local_evaluation():
+    supply, load_curve = schedule()
+    rng = np.random.default_rng(0)
+    deviations = rng.normal(0, 20, 24 * 30)
+    kwargs = dict(supply=supply, load_curve=load_curve, demand_events=np.array([1800, 3600, 5400]),
+                  price_profile=np.full(len(supply), 100.0), hour=5)
+
+    local = ConfidenceEstimator(deviations, samples=400, batch_size=100, seed=1).estimate(**kwargs)
+    estimator = ConfidenceEstimator(deviations, samples=400, batch_size=100, workers=2, seed=1)
+    try:
+        assert estimator.estimate(**kwargs) == local
+    finally:
+        estimator.shutdown()
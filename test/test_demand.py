@@ -0,0 +1,28 @@
+import numpy as np
+
+import drone.config as config
+from drone.demand import DemandModel
+
+
+def test_demand_array_matches_the_rotated_events():
+    model = DemandModel([7200, 3600, 50000])
+    assert model.events.tolist() == [3600, 7200, 50000, 90000, 93600, 136400]
+    assert model.rotate(7200).tolist() == [0, 42800, 82800, 86400, 129200, 172800 - 3600]
+
+    rng = np.random.default_rng(0)
+    model = DemandModel(rng.integers(0, 2 * 86400, 50))
+    for seconds in [0, 3600, 86399]:
+        for batteries in [0, 10, 100]:
+            demand_array = np.zeros(config.slot_count)
+            for event in model.rotate(seconds)[:batteries]:
+                if event // config.resolution < config.slot_count:
+                    demand_array[event // config.resolution] += 1
+            assert np.array_equal(model.demand_array(seconds, batteries), np.cumsum(demand_array))
+
+
+def test_demand_arrays_are_cached():
+    model = DemandModel.daily()
+    demand_array = model.demand_array(3600, 5)
+    assert model.demand_array(3600, 5) is demand_array and not demand_array.flags.writeable
+    assert demand_array[-1] == 5 and demand_array[0] == 1
+    assert model.demand_array(3600, 6) is not demand_array
@@ -0,0 +1,53 @@
+import numpy as np
+
+from drone.battery import Battery
+from drone.schedule import Schedule
+
+
+def test_engine_matches_full_schedule_update():
+    rng = np.random.default_rng(0)
+    slots = 200
+    for _ in range(20):
+        batteries = [Battery(i, rng.uniform(0.5, 1.0), 2, resolution=60, max_power=2000) for i in range(8)]
+        demand_events = np.zeros(slots)
+        for event in rng.integers(20, slots, 5):
+            demand_events[event] += 1
+        demand = np.cumsum(demand_events) - 1
+
+        schedule = Schedule(slots)
+        constraints = np.zeros((1, slots), dtype=bool)
+        waiting, charging = batteries[1:], batteries[:1]
+        if not schedule.update_schedule(waiting, charging, [], demand, constraints):
+            continue
+        engine = schedule.feasibility_engines(demand, constraints)[0]
+        assert engine.feasible
+
+        for slot in rng.permutation(slots):
+            blocked = engine.block(slot)
+            check_constraints = constraints.copy()
+            check_constraints[0, slot] = True
+            assert blocked == schedule.update_schedule(waiting, charging, [], demand, check_constraints)
+            assert constraints[0, slot] == blocked
+
+
+def test_charger_engines_keep_schedule_feasible():
+    rng = np.random.default_rng(3)
+    slots, chargers = 200, 3
+    for _ in range(10):
+        batteries = [Battery(i, rng.uniform(0.5, 1.0), 2, resolution=60, max_power=2000) for i in range(20)]
+        demand_events = np.zeros(slots)
+        for event in rng.integers(20, slots, 10):
+            demand_events[event] += 1
+        demand = np.cumsum(demand_events)
+
+        schedule = Schedule(slots, chargers=chargers)
+        constraints = np.zeros((chargers, slots), dtype=bool)
+        if not schedule.update_schedule(batteries, [], [], demand, constraints):
+            continue
+        engines = schedule.feasibility_engines(demand, constraints)
+
+        for slot in rng.permutation(slots):
+            for engine in engines:
+                engine.block(slot)
+        assert constraints.sum() > 0
+        assert schedule.apply_constraints(constraints)
@@ -0,0 +1,55 @@
+import numpy as np
+
+from drone.battery import Battery
+from drone.fleet import BatteryState, Fleet
+
+
+def test_fleet_queues_and_handles():
+    fleet = Fleet(size=2)
+    handles = [fleet.add(Battery(i, soc, 2, max_power=2000), BatteryState.WAITING)
+               for i, soc in enumerate([0.2, 0.9, 0.5, 0.9])]
+    fleet.add(Battery(4, 1, 2), BatteryState.FINISHED)
+    fleet.add(Battery(5, 1, 2), BatteryState.FINISHED)
+
+    fleet.sort(BatteryState.WAITING)
+    assert [battery.id for battery in fleet.batteries(BatteryState.WAITING)] == [1, 3, 2, 0]
+
+    # handles behave like batteries
+    handles[0].charger = 1
+    assert handles[0].charger == 1 and handles[1].charger is None
+    assert not handles[2].update(3)
+    assert np.isclose(handles[2].soc, 0.5 + 3 * 2000 / 60 / 2000)
+
+    # finished batteries leave in the order they were finished
+    popped = fleet.pop(BatteryState.FINISHED)
+    assert (popped.id, popped.soc, fleet.count(BatteryState.FINISHED)) == (4, 1, 1)
+    assert type(popped) is Battery
+
+    full = fleet.charge(fleet.rows(BatteryState.WAITING), np.array([6, 0, 0, 100]))
+    assert full.tolist() == [True, False, False, True]
+
+    fleet.compact()
+    assert fleet.size == 5
+    assert [battery.id for battery in fleet.batteries(BatteryState.WAITING)] == [1, 3, 2, 0]
+    assert handles[0].soc == 1 and handles[0].charger == 1
+    assert fleet.serialize(BatteryState.FINISHED) == [
+        {'battery_id': 5, 'soc': 1.0, 'capacity': 2.0, 'max_power': 200.0}
+    ]
+
+
+def test_copies_do_not_follow_the_fleet():
+    fleet = Fleet()
+    for i, soc in enumerate([0.2, 0.9, 1]):
+        fleet.add(Battery(i, soc, 2, max_power=2000), BatteryState.FINISHED if soc == 1 else BatteryState.WAITING)
+    copy = fleet.copy()
+    assert copy.serialize_states() == fleet.serialize_states()
+    assert copy.fingerprint(BatteryState.WAITING) == fleet.fingerprint(BatteryState.WAITING)
+
+    fleet.charge(fleet.rows(BatteryState.WAITING), np.array([6, 6]))
+    fleet.pop(BatteryState.FINISHED)
+    assert [battery['soc'] for battery in copy.serialize_states()['waiting_batteries']] == [0.2, 0.9]
+    assert copy.count(BatteryState.FINISHED) == 1
+    # the handles of the copy read the copied columns
+    batteries = copy.batteries(BatteryState.WAITING)
+    assert [battery.soc for battery in batteries] == [0.2, 0.9] and batteries[0].fleet is copy
+    assert copy.batteries(BatteryState.WAITING)[0] is batteries[0]
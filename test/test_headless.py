@@ -0,0 +1,52 @@
+import numpy as np
+
+from drone.headless import Arrival, arrivals_from_demand, run_headless
+from drone.simulation import Simulation
+
+
+def stocked_station(charger_count):
+    simulation = Simulation(charger_count=charger_count)
+    simulation.current_time = 0
+    # soc increases by 1/16 per slot, so the results are exact
+    for soc in [1, 1, 0.5, 0.25, 0.75, 0]:
+        simulation.create_battery(Arrival(0, soc, capacity_kwh=0.5, max_power_watt=1875))
+    return simulation
+
+
+def test_headless_matches_stepping_every_slot():
+    arrivals = [Arrival(time, soc, capacity_kwh=0.5, max_power_watt=1875)
+                for time, soc in [(120, 0.5), (130, 0.25), (600, 0), (610, 0.5), (615, 0.125), (3000, 0.5)]]
+    duration = 2 * 60 * 60
+
+    for charger_count in [1, 3]:
+        headless = stocked_station(charger_count)
+        result = run_headless(headless, duration, arrivals, time_budget=0)
+
+        stepped = stocked_station(charger_count)
+        served = declined = 0
+        energy_wh = 0.0
+        for current_time in range(0, duration, 60):
+            stepped.current_time = current_time
+            for arrival in arrivals:
+                if current_time - 60 < arrival.time <= current_time:
+                    success, _ = stepped.take_battery()
+                    if success:
+                        stepped.create_battery(arrival)
+                    served, declined = served + success, declined + (not success)
+            stepped.create_optimized_schedule(current_time, 0)
+            energy_wh += float(np.sum(stepped.advance())) / 60
+
+        assert (result.served, result.declined) == (served, declined)
+        assert result.end_time == duration
+        assert result.events < duration / 60
+        for state in ['waiting_batteries', 'charging_batteries', 'finished_batteries']:
+            assert [battery.soc for battery in getattr(headless, state)] == \
+                   [battery.soc for battery in getattr(stepped, state)]
+        assert np.isclose(result.energy_wh, energy_wh)
+        headless.notifier.shutdown()
+        stepped.notifier.shutdown()
+
+
+def test_arrivals_from_demand():
+    arrivals = arrivals_from_demand([7200, 3600, 90000], days=2, start_time=100)
+    assert [arrival.time for arrival in arrivals] == [3700, 7300, 90100, 93700]
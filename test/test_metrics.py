@@ -0,0 +1,61 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+from httpx import AsyncClient
+
+import drone.config as config
+from drone.metrics import Registry
+from drone.simulation import Simulation
+
+from conftest import battery
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    counter = registry.counter('requests_total', 'Requests.')
+    histogram = registry.histogram('latency_seconds', 'Latency.', buckets=[0.1, 1])
+    counter.inc(2, handler='a')
+    histogram.observe(0.5)
+    histogram.observe(5)
+    lines = registry.render().splitlines()
+    assert '# TYPE drone_requests_total counter' in lines
+    assert 'drone_requests_total{handler="a"} 2' in lines
+    assert 'drone_latency_seconds_bucket{le="0.1"} 0' in lines
+    assert 'drone_latency_seconds_bucket{le="1"} 1' in lines
+    assert 'drone_latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert 'drone_latency_seconds_count 2' in lines and 'drone_latency_seconds_sum 5.5' in lines
+
+
+def test_ticks_are_measured(monkeypatch, caplog):
+    monkeypatch.setattr(config, 'simulation_time_factor', 1.0)
+    monkeypatch.setattr(config, 'tick_trace', True)
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.set_demand(SimpleNamespace(demand=[hour * 3600 for hour in range(8, 18)]))
+    simulation.create_battery(battery(0.5))
+    with caplog.at_level(logging.INFO, logger='drone.simulation.trace'):
+        for _ in range(3):
+            simulation.tick()
+            simulation.current_time += config.resolution
+
+    metrics = simulation.metrics
+    assert metrics.tick_seconds.count() == 3
+    assert metrics.replans.get() == 1 and metrics.shifted_ticks.get() == 2
+    assert metrics.optimizer_iterations.get() == metrics.optimizer_slots.get() == config.slot_count
+    assert metrics.feasibility_checks.get() > config.slot_count
+    assert metrics.phase_seconds.count(phase='optimize') == 1 and metrics.phase_seconds.count(phase='publish') == 4
+    assert metrics.lock_wait_seconds.count() == metrics.lock_hold_seconds.count() > 0
+    assert len([record for record in caplog.records if record.name == 'drone.simulation.trace']) == 3
+    simulation.notifier.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint():
+    from drone.api import app
+    async with AsyncClient(app=app, base_url="http://localhost:8000") as ac:
+        await ac.get("/batteries")
+        response = await ac.get("/metrics")
+    assert response.status_code == 200
+    assert 'drone_api_request_seconds_count{handler="batteries"}' in response.text
+    assert 'drone_exchange_notifications_delivered' in response.text
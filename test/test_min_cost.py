@@ -0,0 +1,37 @@
+from itertools import product
+
+import numpy as np
+
+from drone.battery import Battery
+from drone.schedule import Schedule
+
+
+def schedule_cost(schedule, batteries, price_profile):
+    return float(np.sum(schedule.get_load_curve(batteries, optimized=True)[0] * price_profile))
+
+
+def test_optimal_constraints_match_brute_force():
+    rng = np.random.default_rng(1)
+    slots = 10
+    for _ in range(5):
+        price_profile = rng.uniform(-5, 50, slots)
+        batteries = [
+            Battery(0, 0.98, 2, resolution=60, max_power=2000),
+            Battery(1, 0.95, 2, resolution=60, max_power=1000),
+            Battery(2, 0.97, 2, resolution=60, max_power=3000),
+        ]
+        demand = np.array([0, 0, 0, 0, 1, 1, 1, 2, 2, 2])
+        waiting, charging = batteries[1:], batteries[:1]
+
+        schedule = Schedule(slots, mode='optimal')
+        assert schedule.update_schedule(waiting, charging, [], demand, np.zeros((1, slots), dtype=bool))
+        constraints = schedule.optimal_constraints(demand, price_profile)
+        assert schedule.update_schedule(waiting, charging, [], demand, constraints)
+        optimal_cost = schedule_cost(schedule, batteries, price_profile)
+
+        best_cost = np.inf
+        for blocked in product([False, True], repeat=slots):
+            brute_force_constraints = np.array([blocked])
+            if schedule.update_schedule(waiting, charging, [], demand, brute_force_constraints):
+                best_cost = min(best_cost, schedule_cost(schedule, batteries, price_profile))
+        assert np.isclose(optimal_cost, best_cost)
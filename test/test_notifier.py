@@ -0,0 +1,94 @@
+import json
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread
+from time import sleep, time
+from types import SimpleNamespace
+
+import pytest
+
+from drone.battery import Battery
+from drone.notifier import ExchangeNotifier
+from drone.simulation import Simulation
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.received.append((self.path, json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+        sleep(self.server.delay)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    server.received, server.statuses, server.delay = [], [], 0
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def url(server, path):
+    return f'http://127.0.0.1:{server.server_port}{path}'
+
+
+def test_notifications_are_retried_with_backoff(stub_server):
+    notifier = ExchangeNotifier(default_uri=url(stub_server, '/default'), retries=2, backoff=0.01)
+    stub_server.statuses = [503, 200]
+    assert notifier.notify('drone1').result(timeout=5)
+    stub_server.statuses = [404]
+    assert not notifier.notify('drone2', url(stub_server, '/custom')).result(timeout=5)
+
+    assert stub_server.received == [
+        ('/default', {'assetId': 'drone1'}),
+        ('/default', {'assetId': 'drone1'}),
+        ('/custom', {'assetId': 'drone2'}),
+    ]
+    metrics = notifier.get_metrics()
+    assert (metrics['pending'], metrics['delivered'], metrics['failed'], metrics['retried']) == (0, 1, 1, 1)
+    assert metrics['latency_seconds']['max'] > 0
+    notifier.shutdown()
+
+
+def test_exchange_completed_does_not_wait_for_delivery(stub_server):
+    stub_server.delay = 1
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.battery_requests['drone1'] = {
+        'charged_battery': Battery(0, 1, 2),
+        'new_battery': Battery(1, 0.2, 2),
+    }
+    simulation.exchange_battery(SimpleNamespace(
+        drone_id='drone1', state_of_charge=0.3, response_uri=url(stub_server, '/exchanged')))
+
+    tik = time()
+    assert simulation.exchange_completed('drone1')
+    assert time() - tik < 0.5
+    assert [battery.id for battery in simulation.waiting_batteries] == [1]
+
+    simulation.notifier.shutdown()
+    assert stub_server.received == [('/exchanged', {'assetId': 'drone1'})]
+    assert simulation.notifier.get_metrics()['delivered'] == 1
+
+
+def test_exchanges_are_notified_after_the_simulation_was_closed(stub_server):
+    simulation = Simulation()
+    simulation.current_time = 0
+    # the simulation of the service outlives the app, which closes it on shutdown
+    simulation.close()
+    simulation.battery_requests['drone1'] = {
+        'charged_battery': Battery(0, 1, 2),
+        'new_battery': Battery(1, 0.2, 2),
+    }
+    simulation.exchange_battery(SimpleNamespace(
+        drone_id='drone1', state_of_charge=0.3, response_uri=url(stub_server, '/exchanged')))
+    assert simulation.exchange_completed('drone1')
+
+    simulation.close()
+    assert stub_server.received == [('/exchanged', {'assetId': 'drone1'})]
+    assert simulation.notifier.get_metrics()['delivered'] == 1
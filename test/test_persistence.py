@@ -0,0 +1,188 @@
+from threading import Thread
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from drone.fleet import BatteryState
+from drone.persistence import StateStore
+from drone.simulation import Simulation
+
+from conftest import battery, charge_request
+
+
+def make_simulation(charger_count: int = 2) -> Simulation:
+    simulation = Simulation(charger_count=charger_count)
+    simulation.current_time = 0
+    return simulation
+
+
+def setup_station(simulation: Simulation):
+    simulation.set_demand(SimpleNamespace(demand=[hour * 3600 for hour in range(8, 18)]))
+    simulation.set_price_profile(SimpleNamespace(price=[100 if hour < 6 else 20 for hour in range(24)],
+                                                 resolution_s=3600))
+    simulation.set_power_limit(SimpleNamespace(power_watt=[6000] * 24, resolution_s=3600))
+    simulation.create_batteries([battery(soc) for soc in [1, 1, 0.9, 0.5, 0.3]])
+
+
+def assert_same_state(restored: Simulation, simulation: Simulation):
+    assert restored.serialize_batteries() == simulation.serialize_batteries()
+    assert restored.current_time == simulation.current_time and restored.id_counter == simulation.id_counter
+    for name in ['constraints', 'price_profile', 'power_limit']:
+        assert np.array_equal(getattr(restored, name), getattr(simulation, name))
+    assert np.array_equal(restored.demand_model.events, simulation.demand_model.events)
+    assert np.array_equal(restored.schedule.optimized_schedule, simulation.schedule.optimized_schedule)
+    assert np.array_equal(restored.schedule.charging_constraints, simulation.schedule.charging_constraints)
+    for name in ['battery_requests', 'exchange_requests']:
+        requests, restored_requests = getattr(simulation, name), getattr(restored, name)
+        assert restored_requests.keys() == requests.keys()
+        for drone_id, request in requests.items():
+            assert restored_requests[drone_id].get('response_uri') == request.get('response_uri')
+            for battery in ['charged_battery', 'new_battery']:
+                assert vars(restored_requests[drone_id][battery]) == vars(request[battery])
+
+
+def test_restore_from_snapshot_and_log(tmp_path):
+    simulation = make_simulation()
+    store = StateStore(tmp_path)
+    assert not store.restore(simulation)
+    setup_station(simulation)
+    assert simulation.create_optimized_schedule(simulation.current_time, 0.5)
+    simulation.advance(5)
+    simulation.current_time += 5 * 60
+    store.save(simulation)
+    assert store.segments() == []
+
+    # changes after the snapshot are only in the log
+    assert simulation.add_requests([charge_request('drone1'), charge_request('drone2')]) == [True, True]
+    assert simulation.exchange_batteries([SimpleNamespace(drone_id='drone1', state_of_charge=0.25,
+                                                          response_uri='http://localhost/done')]) == [True]
+    simulation.notifier.shutdown()
+    assert simulation.exchanges_completed(['drone1'], notify=False) == [True]
+    simulation.create_batteries([battery(0.6, max_power_watt=3000)])
+    simulation.set_demand(SimpleNamespace(demand=[3600 * 9]))
+    store.close()
+
+    restored = make_simulation()
+    restored_store = StateStore(tmp_path)
+    assert restored_store.restore(restored)
+    assert_same_state(restored, simulation)
+    assert restored.plan_complete == simulation.plan_complete
+    assert restored.snapshot.batteries == restored.serialize_batteries()
+    # the optimizer continues from the restored constraints
+    assert restored.constraints.any() and restored.follows_schedule()
+
+    # changes of the restored simulation are logged with further sequence numbers
+    assert restored.store is restored_store
+    restored.exchanges_completed(['drone2'], notify=False)
+    assert [entry['op'] for entry in restored_store.entries(store.sequence)] == ['exchanges_completed']
+    restored_store.close()
+    simulation.close()
+    restored.close()
+
+
+def test_charge_requests_keep_their_battery(tmp_path):
+    simulation = make_simulation(charger_count=1)
+    store = StateStore(tmp_path)
+    store.restore(simulation)
+    simulation.create_batteries([battery(0.9)])
+    store.save(simulation)
+
+    # the battery is charged after the snapshot and reserved by a charge request
+    simulation.fleet.soc[0] = 1.0
+    simulation.fleet.set_state(np.array([0]), BatteryState.FINISHED)
+    assert simulation.add_request(charge_request('drone1'))
+    store.close()
+
+    restored = make_simulation(charger_count=1)
+    StateStore(tmp_path).restore(restored)
+    assert restored.fleet.count(BatteryState.WAITING) == 0 and len(restored.fleet.handles) == 0
+    assert restored.battery_requests['drone1']['charged_battery'].soc == 1.0
+    assert restored.battery_requests['drone1']['new_battery'].id == 1 and restored.id_counter == 2
+    simulation.close()
+    restored.close()
+
+
+def test_taken_batteries_stay_taken(tmp_path):
+    simulation = make_simulation(charger_count=1)
+    store = StateStore(tmp_path)
+    store.restore(simulation)
+    simulation.create_batteries([battery(soc) for soc in [1, 1, 0.5]])
+    store.save(simulation)
+    success, taken = simulation.take_battery()
+    assert success
+    store.close()
+
+    restored = make_simulation(charger_count=1)
+    StateStore(tmp_path).restore(restored)
+    assert taken.id not in restored.fleet.handles
+    assert_same_state(restored, simulation)
+    simulation.close()
+    restored.close()
+
+
+def test_log_is_written_outside_the_lock(tmp_path, monkeypatch):
+    simulation = make_simulation()
+    store = StateStore(tmp_path)
+    store.restore(simulation)
+    commit = store.commit
+
+    def unlocked_commit():
+        assert not simulation.lock.locked()
+        commit()
+
+    monkeypatch.setattr(store, 'commit', unlocked_commit)
+    simulation.create_batteries([battery(0.5)])
+    # a change is in the log once it returns
+    assert [entry['op'] for entry in store.entries()] == ['create_batteries']
+
+    # concurrent changes are written in the order of their sequence numbers
+    threads = [Thread(target=simulation.create_batteries, args=([battery(0.1 * index)],)) for index in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [entry['seq'] for entry in store.entries()] == list(range(1, 10))
+    store.close()
+
+    restored = make_simulation()
+    StateStore(tmp_path).restore(restored)
+    assert_same_state(restored, simulation)
+    simulation.close()
+    restored.close()
+
+
+def test_crash_while_saving_and_appending(tmp_path):
+    simulation = make_simulation()
+    store = StateStore(tmp_path)
+    store.restore(simulation)
+    setup_station(simulation)
+    store.save(simulation)
+    simulation.restart(3600)
+    simulation.create_batteries([battery(0.5)])
+    # crash after the log was rotated but before the snapshot was written
+    with simulation.lock:
+        store.rotate()
+    simulation.create_batteries([battery(0.7)])
+    store.close()
+    # crash while appending an entry
+    with open(store.log_path, 'a') as file:
+        file.write('{"seq": 99, "op": "clear_batt')
+
+    restored = make_simulation()
+    StateStore(tmp_path).restore(restored)
+    assert_same_state(restored, simulation)
+    assert [battery['soc'] for battery in restored.serialize_batteries()['waiting_batteries']] == [0.5, 0.7]
+    simulation.close()
+    restored.close()
+
+
+def test_snapshot_of_other_configuration_is_rejected(tmp_path):
+    simulation = make_simulation(charger_count=2)
+    store = StateStore(tmp_path)
+    store.save(simulation)
+    restored = make_simulation(charger_count=3)
+    with pytest.raises(ValueError, match='charger_count'):
+        StateStore(tmp_path).restore(restored)
+    simulation.close()
+    restored.close()
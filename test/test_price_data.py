@@ -0,0 +1,43 @@
+import os
+from datetime import date
+
+import numpy as np
+import pytest
+
+from drone.price_data import PriceHistory
+
+
+def write_prices(path, rows):
+    path.write_text('date,actual\n' + ''.join(f'{timestamp},{price}\n' for timestamp, price in rows))
+
+
+def test_prices_are_cached_and_sliced_without_copies(tmp_path):
+    csv_file_path = tmp_path / 'prices.csv'
+    rows = [(f'{day:02d}.03.2020 {hour:02d}:00', day * 100 + hour) for day in [1, 2] for hour in range(24)]
+    # a missing price, a missing hour and a repeated hour
+    rows[5] = (rows[5][0], '')
+    del rows[30]
+    rows.insert(40, rows[40])
+    write_prices(csv_file_path, rows)
+
+    history = PriceHistory.load(csv_file_path)
+    assert len(history) == 48
+    assert history.day('2020-03-02').tolist() == [200 + hour for hour in range(24)]
+    assert history.prices[5] == 105
+    assert history.window(np.datetime64('2020-03-01T23'), 2).tolist() == [123, 200]
+
+    cached = PriceHistory.load(csv_file_path)
+    assert isinstance(cached.prices, np.memmap) and not cached.prices.flags.writeable
+    assert np.array_equal(cached.prices, history.prices)
+    assert np.shares_memory(cached.day(date(2020, 3, 1)), cached.prices)
+    assert cached.days().shape == (2, 24) and np.shares_memory(cached.days(), cached.prices)
+    with pytest.raises(ValueError):
+        cached.day('2020-03-03')
+
+    # touching the file keeps the cache, changing it rebuilds the cache
+    os.utime(csv_file_path, ns=(0, 0))
+    assert isinstance(PriceHistory.load(csv_file_path).prices, np.memmap)
+    rows[0] = (rows[0][0], 1000)
+    write_prices(csv_file_path, rows)
+    assert PriceHistory.load(csv_file_path).prices[0] == 1000
+    assert PriceHistory.load(csv_file_path).prices[0] == 1000
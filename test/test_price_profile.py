@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import drone.config as config
+from drone.simulation import convert_price_profile
+
+
+def test_hourly_profile_is_repeated_for_each_day():
+    prices = list(range(24))
+    price_profile = convert_price_profile(SimpleNamespace(price=prices, resolution_s=3600))
+    assert len(price_profile) == config.slot_count
+    slots_per_hour = 3600 // config.resolution
+    assert np.allclose(price_profile, np.tile(np.repeat(prices, slots_per_hour), 2))
+
+
+def test_slots_average_partially_covered_prices():
+    # 90 s resolution: every other 60 s slot covers two prices
+    price_profile = convert_price_profile(SimpleNamespace(price=[10, 40, 70], resolution_s=90))
+    assert np.allclose(price_profile[:5], [10, 25, 40, 70, 40])
+
+
+def test_sub_slot_resolution_is_averaged():
+    prices = np.arange(config.slot_count * config.resolution, dtype=float)
+    price_profile = convert_price_profile(SimpleNamespace(price=prices.tolist(), resolution_s=1))
+    assert np.allclose(price_profile, prices.reshape(-1, config.resolution).mean(axis=1))
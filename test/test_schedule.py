@@ -0,0 +1,42 @@
+import numpy as np
+
+from drone.battery import Battery
+from drone.schedule import Schedule
+
+
+def test_batteries_are_charged_in_parallel():
+    slots, chargers = 20, 4
+    batteries = [Battery(i, 0.96, 2, resolution=60, max_power=2000) for i in range(8)]  # 3 time steps each
+    charging, waiting = batteries[:2], batteries[2:]
+    charging[0].charger, charging[1].charger = 2, 0
+
+    schedule = Schedule(slots, chargers=chargers)
+    constraints = np.zeros((chargers, slots), dtype=bool)
+    constraints[1, :3] = True
+    demand = np.zeros(slots)
+    demand[3:] = 3
+    demand[6:] = 7
+    assert schedule.update_schedule(waiting, charging, [], demand, constraints)
+
+    assert schedule.optimized_schedule[:, 0].tolist() == [1, 2, 0, 3]
+    assert [battery.charger for battery in batteries] == [2, 0, 1, 3, 0, 2, 3, 0]
+    assert schedule.optimized_schedule[1, 5] == 2
+    assert schedule.optimized_schedule[1, 6] == -1
+    assert schedule.optimized_schedule[0, 8] == 7
+    assert np.all(schedule.optimized_schedule[:, 9:] == -1)
+
+
+def test_power_limit_lowers_charging_power():
+    slots, chargers = 30, 2
+    batteries = [Battery(i, 0.96, 2, resolution=60, max_power=2000) for i in range(2)]  # 2.4 time steps each
+    schedule = Schedule(slots, chargers=chargers)
+    constraints = np.zeros((chargers, slots), dtype=bool)
+    power_limit = np.full(slots, 3000.0)
+    assert schedule.update_schedule(batteries, [], [], np.zeros(slots), constraints, power_limit)
+
+    load_curve = schedule.get_load_curve(batteries, optimized=True)
+    assert np.all(load_curve.sum(axis=0) <= 3000)
+    assert np.allclose(load_curve[:, 0], 1500)
+    # 2.4 time steps at full power take 3.2 time steps at 75% power
+    assert schedule.optimized_schedule[:, :4].tolist() == [[0] * 4, [1] * 4]
+    assert np.all(schedule.optimized_schedule[:, 4:] == -1)
@@ -0,0 +1,175 @@
+from threading import Thread
+from time import sleep, time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import drone.config as config
+from drone.fleet import BatteryState
+from drone.simulation import Simulation
+
+from conftest import battery
+
+
+def test_reads_are_served_from_snapshot():
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.create_battery(battery(0.5))
+    simulation.create_battery(battery(1))
+    assert simulation.replan_requested.is_set()
+
+    # writes are not visible before the next replanning
+    assert simulation.get_batteries()['waiting_batteries'] == []
+    simulation.replan(0)
+    snapshot = simulation.snapshot
+    assert [b['battery_id'] for b in simulation.get_batteries()['waiting_batteries']] == [0]
+    assert [b['battery_id'] for b in simulation.get_batteries()['finished_batteries']] == [1]
+    assert 0 in simulation.get_schedules()
+    with pytest.raises(ValueError):
+        simulation.get_schedules()[0, 0] = 1
+
+    # reads do not wait for the lock
+    with simulation.lock:
+        assert simulation.rest_get_optimized_schedule() is snapshot.optimized_schedule
+        assert len(simulation.rest_get_unoptimized_schedule()['load_curve']) == 1
+    simulation.notifier.shutdown()
+
+
+def test_snapshots_are_serialized_on_first_read():
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.create_batteries([battery(0.5), battery(1)])
+    simulation.replan(np.inf)
+    snapshot = simulation.snapshot
+    assert 'batteries' not in vars(snapshot) and 'optimized_schedule' not in vars(snapshot)
+    assert simulation.get_batteries() is snapshot.batteries is simulation.get_batteries()
+
+    # the snapshot keeps the batteries of its time
+    simulation.advance()
+    assert snapshot.batteries['waiting_batteries'][0]['soc'] == 0.5
+    simulation.publish_snapshot()
+    assert simulation.snapshot.battery_key != snapshot.battery_key
+    charged = simulation.snapshot
+    simulation.publish_snapshot()
+    assert simulation.snapshot.battery_key == charged.battery_key
+    simulation.notifier.shutdown()
+
+
+def test_plans_of_reset_state_are_discarded():
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.create_battery(battery(0.5))
+    simulation.set_price_profile(SimpleNamespace(price=[10, 20], resolution_s=3600))
+    epoch = simulation.epoch
+
+    simulation.clear_batteries()
+    simulation.commit_constraints(epoch, np.ones_like(simulation.constraints))
+    assert not simulation.constraints.any()
+    simulation.notifier.shutdown()
+
+
+def test_greedy_scheduler_charges_in_cheap_slots():
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.set_demand(SimpleNamespace(demand=[12 * 3600]))
+    simulation.set_price_profile(SimpleNamespace(price=[100] * 3 + [10] * 3 + [100] * 18, resolution_s=3600))
+    simulation.create_battery(battery(0.5))
+    simulation.replan(np.inf)
+
+    # the expensive slots are blocked first, the battery charges in the cheap hours before the demand
+    charging_slots = np.flatnonzero(~simulation.constraints[0])
+    assert len(charging_slots) > 0
+    assert np.all(simulation.price_profile[charging_slots] == 10)
+    simulation.notifier.shutdown()
+
+
+def test_ticks_without_changes_shift_the_plan(monkeypatch):
+    simulation = Simulation()
+    simulation.current_time = 0
+    simulation.set_demand(SimpleNamespace(demand=[hour * 3600 for hour in range(10, 14)]))
+    simulation.set_price_profile(SimpleNamespace(price=np.linspace(10, 100, 48).tolist(), resolution_s=3600))
+    for state_of_charge in [0.1, 0.35, 0.6, 0.77]:
+        simulation.create_battery(battery(state_of_charge, max_power_watt=700))
+    simulation.replan(np.inf)
+
+    plans = []
+    create_optimized_schedule = simulation.create_optimized_schedule
+    monkeypatch.setattr(simulation, 'create_optimized_schedule',
+                        lambda *args: plans.append(simulation.current_time) or create_optimized_schedule(*args))
+    monkeypatch.setattr(config, 'simulation_time_factor', 1.0)
+    # the first battery starts charging one slot later than planned, which is noticed when it is swapped,
+    # afterwards the batteries are swapped as planned and the plan is only optimized every replan_interval_slots
+    for _ in range(3 * config.replan_interval_slots):
+        simulation.tick()
+        assert simulation.snapshot.schedules is not None
+        simulation.current_time += config.resolution
+    assert len(plans) == 3
+    assert simulation.fleet.count(BatteryState.FINISHED) > 0
+
+    shifted = simulation.schedule.optimized_schedule.copy()
+    simulation.replan(np.inf)
+    assert np.array_equal(shifted[:, :-1], simulation.schedule.optimized_schedule[:, :-1])
+
+    # changes are planned in the next tick
+    simulation.set_demand(SimpleNamespace(demand=[hour * 3600 for hour in range(11, 14)]))
+    simulation.tick()
+    assert len(plans) == 5 and not simulation.replan_requested.is_set()
+    simulation.notifier.shutdown()
+
+
+def test_bursts_of_changes_are_planned_once(monkeypatch):
+    simulation = Simulation()
+    monkeypatch.setattr(config, 'replan_debounce_s', 0.05)
+
+    def burst():
+        for state_of_charge in np.linspace(0.1, 0.9, 10):
+            simulation.create_battery(battery(state_of_charge))
+            sleep(0.01)
+
+    simulation.request_replan()
+    thread = Thread(target=burst)
+    thread.start()
+    tik = time()
+    simulation.wait_for_changes(tik + 10)
+    thread.join()
+    # the wait lasts until the burst is over
+    assert 0.09 < time() - tik < 1 and not simulation.replan_requested.is_set()
+    assert len(simulation.battery_requests) + len(simulation.fleet.handles) == 10
+    # the deadline ends the wait even if changes keep coming
+    simulation.request_replan()
+    tik = time()
+    simulation.wait_for_changes(tik)
+    assert time() - tik < 0.05
+    simulation.notifier.shutdown()
+
+
+def test_baseline_is_made_again_only_if_the_fleet_changes():
+    simulation = Simulation()
+    simulation.current_time = 0
+    for state_of_charge in [0.2, 0.6, 0.4]:
+        simulation.create_battery(battery(state_of_charge))
+    simulation.replan(np.inf)
+    version = simulation.schedule.unoptimized_version
+    cost_curve = simulation.snapshot.curves['unoptimized_cost_curve']
+
+    simulation.replan(np.inf)
+    assert simulation.schedule.unoptimized_version == version
+    assert simulation.snapshot.curves['unoptimized_cost_curve'] is cost_curve
+
+    # a new price profile only changes the cost curve
+    simulation.set_price_profile(SimpleNamespace(price=[10, 20], resolution_s=3600))
+    simulation.replan(np.inf)
+    assert simulation.schedule.unoptimized_version == version
+    assert simulation.snapshot.curves['unoptimized_cost_curve'] is not cost_curve
+
+    simulation.advance()
+    simulation.publish_snapshot()
+    assert simulation.schedule.unoptimized_version == version + 1
+
+    # the baseline is made for the batteries sorted by SoC without reordering the batteries of the caller
+    waiting_batteries = sorted(simulation.waiting_batteries, key=lambda battery: battery.soc)
+    assert len(waiting_batteries) == 2
+    simulation.schedule.make_unoptimized_schedule(waiting_batteries, [], [])
+    assert waiting_batteries[0].soc < waiting_batteries[1].soc
+    simulation.notifier.shutdown()
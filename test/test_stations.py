@@ -0,0 +1,154 @@
+import asyncio
+import json
+
+import numpy as np
+import pytest
+from httpx import AsyncClient
+from pydantic import ValidationError
+
+import drone.config as config
+import drone.station_api as station_api
+from drone.models import StationConfig
+from drone.stations import StationError, StationPool, StationWorker, shard_of
+
+from conftest import battery_json, charge_request_json, station_config
+
+
+def test_worker_keeps_stations_apart(tmp_path):
+    worker = StationWorker(state_dir=tmp_path)
+    worker.create(station_config('a', charger_count=2))
+    worker.create(station_config('b'))
+    worker.handle('a', 'add_batteries', [battery_json('x', 1), battery_json('y', 0.5)])
+    assert worker.handle(None, 'list') == ['a', 'b']
+    assert worker.simulations['a'].charger_count == 2 and worker.simulations['a'].total_batteries() == 2
+    assert worker.simulations['b'].total_batteries() == 0
+    assert (tmp_path / 'stations' / 'a' / 'station.json').exists()
+
+    worker.remove('b')
+    assert not (tmp_path / 'stations' / 'b').exists()
+    worker.stop()
+
+    # the stations of the shard are started again with their state
+    restored = StationWorker(state_dir=tmp_path)
+    restored.restore()
+    assert restored.handle(None, 'list') == ['a']
+    assert restored.simulations['a'].total_batteries() == 2
+    restored.stop()
+
+
+@pytest.mark.parametrize('station_id', ['.', '..'])
+def test_station_ids_stay_within_the_state_directory(tmp_path, station_id):
+    with pytest.raises(ValidationError):
+        StationConfig(**station_config(station_id))
+    StationConfig(**station_config('station.1'))
+
+    worker = StationWorker(state_dir=tmp_path)
+    worker.create(station_config('a'))
+    with pytest.raises(StationError) as error:
+        worker.create(station_config(station_id))
+    assert error.value.status == 400 and station_id not in worker.simulations
+    with pytest.raises(StationError):
+        worker.remove(station_id)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['stations']
+    assert sorted(path.name for path in (tmp_path / 'stations').iterdir()) == ['a']
+    worker.stop()
+
+
+def test_event_frames_are_the_changes_since_the_known_version(tmp_path):
+    worker = StationWorker(state_dir=tmp_path)
+    worker.create(station_config('a'))
+    full = worker.handle('a', 'events')
+    assert json.loads(full.data)['full'] and worker.handle('a', 'events', full.version) is None
+
+    worker.handle('a', 'add_battery', battery_json('x', 0.5))
+    worker.simulations['a'].replan(np.inf)
+    frame = worker.handle('a', 'events', full.version)
+    changes = json.loads(frame.data)
+    assert not changes['full'] and changes['batteries']['waiting_batteries'][0]['soc'] == 0.5
+    # the frame is serialized once for all streams of the same version
+    assert worker.handle('a', 'events', full.version) is frame
+    # a stream of a version that is no longer kept gets the full state
+    assert json.loads(worker.handle('a', 'events', -1).data)['full']
+    worker.stop()
+    with pytest.raises(StationError):
+        worker.handle('a', 'events')
+
+
+@pytest.mark.asyncio
+async def test_requests_are_routed_to_the_worker_of_the_station(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'station_event_interval_s', 0.01)
+    # one station on each of the two shards
+    station_ids = ['a', next(station_id for station_id in 'bcdefgh' if shard_of(station_id, 2) != shard_of('a', 2))]
+    pool = StationPool(workers=2, state_dir=tmp_path)
+    monkeypatch.setattr(station_api, 'pool', pool)
+    pool.start()
+    try:
+        async with AsyncClient(app=station_api.app, base_url="http://localhost:8000") as ac:
+            for station_id in station_ids:
+                response = await ac.post("/stations", json=station_config(station_id))
+                assert response.status_code == 200
+            response = await ac.post("/stations", json=station_config('a'))
+            assert response.status_code == 409 and not response.json()["success"]
+            response = await ac.post("/stations", json=station_config('..'))
+            assert response.status_code == 422
+            response = await ac.get("/stations")
+            assert response.json()["stations"] == sorted(station_ids)
+
+            response = await ac.post("/stations/a/batteries", json=[battery_json('x', 1), battery_json('y', 0.5)])
+            assert [result["id"] for result in response.json()["results"]] == [0, 1]
+            response = await ac.post("/stations/a/charge-requests",
+                                     json=[charge_request_json('drone1')])
+            assert response.json()["success"]
+            response = await ac.get(f"/stations/{station_ids[1]}/visualisation")
+            assert response.json()["batteries"]["waiting_batteries"] == []
+            response = await ac.get("/stations/unknown/batteries")
+            assert response.status_code == 404
+
+            response = await ac.get("/stations/a/visualisation/compact")
+            etag = response.headers["ETag"]
+            response = await ac.get("/stations/a/visualisation/compact", headers={"If-None-Match": etag})
+            assert response.status_code in (200, 304) and response.headers["ETag"]
+            response = await ac.get("/stations/a/metrics")
+            assert "drone_replans_total" in response.text
+
+            # the per-drone requests of a station
+            response = await ac.post(f"/stations/{station_ids[1]}/battery", json=battery_json('z', 1))
+            assert response.json() == {"success": True, "message": "battery 0 added"}
+            response = await ac.post(f"/stations/{station_ids[1]}/charge-request",
+                                     json=charge_request_json('drone2'))
+            assert response.json()["success"]
+            response = await ac.put(f"/stations/{station_ids[1]}/exchange",
+                                    json={"drone_id": "drone2", "state_of_charge": 0.2,
+                                          "response_uri": "http://localhost/done"})
+            assert response.json()["success"]
+            response = await ac.put(f"/stations/{station_ids[1]}/exchange-completed", json={"drone_id": "drone3"})
+            assert not response.json()["success"]
+
+            # the event stream of the station ends when the station is removed
+            events = asyncio.create_task(ac.get(f"/stations/{station_ids[1]}/events"))
+            await asyncio.sleep(0.1)
+            response = await ac.delete(f"/stations/{station_ids[1]}")
+            assert response.status_code == 200
+            response = await events
+            assert response.headers['content-type'].startswith('text/event-stream')
+            frames = [json.loads(event.split('data: ')[1]) for event in response.text.split('\n\n') if event]
+            assert frames[0]['full'] and all(not frame['full'] for frame in frames[1:])
+            response = await ac.get("/stations/unknown/events")
+            assert response.status_code == 404
+            response = await ac.get(f"/stations/{station_ids[1]}/batteries")
+            assert response.status_code == 404
+    finally:
+        pool.stop()
+
+    # the workers restore their stations from the state directory
+    pool = StationPool(workers=2, state_dir=tmp_path)
+    monkeypatch.setattr(station_api, 'pool', pool)
+    pool.start()
+    try:
+        async with AsyncClient(app=station_api.app, base_url="http://localhost:8000") as ac:
+            response = await ac.get("/stations")
+            assert response.json()["stations"] == ['a']
+            response = await ac.get("/stations/a/visualisation")
+            assert list(response.json()["pending_charge_requests"]) == ["drone1"]
+    finally:
+        pool.stop()